@@ -8,7 +8,10 @@ import time
 from argparse import ArgumentDefaultsHelpFormatter
 from datetime import datetime, timedelta
 
-from sbws.globals import fail_hard
+from sbws.globals import RESULT_BLOCKS_EXT, fail_hard
+from sbws.lib.resultcolumns import COLUMNS_EXTS
+from sbws.lib.resultdump import compress_result_file
+from sbws.lib.resultstore import ResultStore
 from sbws.util.filelock import DirectoryLock
 from sbws.util.timestamp import unixts_to_dt_obj
 
@@ -104,6 +107,19 @@ def _compress_files(dname, file_descriptors, dry_run=True):
             os.remove(fd.name)
 
 
+def _compress_result_files(dname, file_descriptors, dry_run=True):
+    """Compress the result files passed as argument, in blocks that can be
+    read without decompressing the whole file."""
+    with DirectoryLock(dname):
+        for fd in file_descriptors:
+            log.info("Compressing %s", fd.name)
+            if dry_run or stat.S_ISLNK(os.stat(fd.fileno()).st_mode):
+                continue
+            compress_result_file(fd.name)
+            fd.close()
+            os.remove(fd.name)
+
+
 def _check_validity_periods_v3bw(compress_after_days, delete_after_days):
     if 1 <= compress_after_days and compress_after_days < delete_after_days:
         return True
@@ -144,7 +160,9 @@ def _clean_result_files(args, conf):
 
     # first delete so that the files to be deleted are not compressed first
     files_to_delete = _get_files_mtime_older_than(
-        datadir, delete_after_days, [".txt", ".gz"]
+        datadir,
+        delete_after_days,
+        [".txt", ".gz", RESULT_BLOCKS_EXT] + COLUMNS_EXTS,
     )
     _delete_files(datadir, files_to_delete, dry_run=args.dry_run)
 
@@ -153,7 +171,20 @@ def _clean_result_files(args, conf):
     files_to_compress = _get_files_mtime_older_than(
         datadir, compress_after_days, [".txt"]
     )
-    _compress_files(datadir, files_to_compress, dry_run=args.dry_run)
+    _compress_result_files(datadir, files_to_compress, dry_run=args.dry_run)
+
+    if conf.get("general", "results_backend") == "sqlite":
+        store = ResultStore(conf.getpath("paths", "results_db"))
+        if args.dry_run:
+            log.info(
+                "Would delete the results older than %d days from %s",
+                delete_after_days,
+                store.fname,
+            )
+        else:
+            num_results = store.delete_older_than(delete_after_days)
+            log.info("Deleted %d results from %s", num_results, store.fname)
+        store.close()
 
 
 def main(args, conf):
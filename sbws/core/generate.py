@@ -16,7 +16,9 @@ from sbws.globals import (
     fail_hard,
 )
 from sbws.lib import destination
+from sbws.lib.consensus import ConsensusSnapshot
 from sbws.lib.resultdump import load_recent_results_in_datadir
+from sbws.lib.resultstore import ResultStore
 from sbws.lib.v3bwfile import V3BWFile
 from sbws.util.fs import check_create_dir, check_create_file
 from sbws.util.timestamp import now_fname
@@ -125,6 +127,19 @@ def gen_parser(sub):
         type=int,
         help="Minimum number of a results to consider them.",
     )
+    p.add_argument(
+        "-j",
+        "--jobs",
+        default=1,
+        type=int,
+        help="Number of processes to use to read the result files.",
+    )
+    p.add_argument(
+        "--gzip",
+        action="store_true",
+        help="If specified, also write a gzip compressed copy of the "
+        "bandwidth file.",
+    )
     return p
 
 
@@ -147,6 +162,8 @@ def main(args, conf):
         fail_hard("--scale-constant must be positive")
     if args.torflow_bw_margin < 0:
         fail_hard("toflow-bw-margin must be major than 0.")
+    if args.jobs < 1:
+        fail_hard("--jobs must be positive")
     if args.scale_sbws:
         scaling_method = SBWS_SCALING
     elif args.raw:
@@ -163,12 +180,23 @@ def main(args, conf):
         fresh_days = conf.getint("general", "data_period")
     reset_bw_ipv4_changes = conf.getboolean("general", "reset_bw_ipv4_changes")
     reset_bw_ipv6_changes = conf.getboolean("general", "reset_bw_ipv6_changes")
-    results = load_recent_results_in_datadir(
-        fresh_days,
-        datadir,
-        on_changed_ipv4=reset_bw_ipv4_changes,
-        on_changed_ipv6=reset_bw_ipv6_changes,
-    )
+    if conf.get("general", "results_backend") == "sqlite":
+        store = ResultStore(conf.getpath("paths", "results_db"))
+        results = store.load_recent_results(
+            fresh_days,
+            on_changed_ipv4=reset_bw_ipv4_changes,
+            on_changed_ipv6=reset_bw_ipv6_changes,
+        )
+        store.close()
+    else:
+        results = load_recent_results_in_datadir(
+            fresh_days,
+            datadir,
+            on_changed_ipv4=reset_bw_ipv4_changes,
+            on_changed_ipv6=reset_bw_ipv6_changes,
+            use_index=conf.getboolean("general", "results_index"),
+            jobs=args.jobs,
+        )
     if len(results) < 1:
         log.warning(
             "No recent results, so not generating anything. (Have you "
@@ -179,6 +207,9 @@ def main(args, conf):
     consensus_path = os.path.join(
         conf.getpath("tor", "datadir"), "cached-consensus"
     )
+    consensus = ConsensusSnapshot.from_file(
+        consensus_path, conf.getpath("paths", "consensus_cache_fname")
+    )
     dirauth_nickname = conf["scanner"].get("dirauth_nickname", None)
     # Accept None as scanner_country to be compatible with older versions.
     scanner_country = conf["scanner"].get("country")
@@ -197,6 +228,7 @@ def main(args, conf):
         secs_away=args.secs_away,
         min_num=args.min_num,
         consensus_path=consensus_path,
+        consensus=consensus,
     )
-    bw_file.write(valid_output)
+    bw_file.write(valid_output, compress=args.gzip)
     bw_file.info_stats
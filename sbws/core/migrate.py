@@ -0,0 +1,62 @@
+"""Import the result files into the results database."""
+import logging
+import os
+from argparse import ArgumentDefaultsHelpFormatter
+from glob import glob
+
+from sbws.lib.resultstore import ResultStore
+
+log = logging.getLogger(__name__)
+
+
+def gen_parser(sub):
+    d = (
+        "Import the result files in the datadir into the SQLite results "
+        "database (see results_backend and results_db in sbws.ini). "
+        "The results already in the database are not imported again."
+    )
+    p = sub.add_parser(
+        "migrate",
+        description=d,
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    p.add_argument(
+        "--datadir",
+        default=None,
+        help="Import the result files in this directory instead of the "
+        "datadir in the configuration",
+    )
+    return p
+
+
+def _result_files(datadir):
+    """Return the result files in the datadir and the subdirectories one
+    level below, as :func:`~sbws.lib.resultdump.load_recent_results_in_datadir`
+    reads them."""
+    fnames = []
+    for pattern in ["*.txt", "*.txt.gz"]:
+        fnames.extend(glob(os.path.join(datadir, pattern)))
+        fnames.extend(glob(os.path.join(datadir, "*", pattern)))
+    return sorted(fnames)
+
+
+def main(args, conf):
+    """
+    Main entry point in to the migrate command.
+
+    :param argparse.Namespace args: command line arguments
+    :param configparser.ConfigParser conf: parsed config files
+    """
+    datadir = args.datadir or conf.getpath("paths", "datadir")
+    store = ResultStore(conf.getpath("paths", "results_db"))
+    num_results = 0
+    for fname in _result_files(datadir):
+        log.info("Importing %s", fname)
+        num_results += store.import_result_file(fname)
+    store.close()
+    log.info("Imported %d results into %s", num_results, store.fname)
+    if conf.get("general", "results_backend") != "sqlite":
+        log.warning(
+            "Set results_backend = sqlite in the configuration to use the "
+            "results database."
+        )
@@ -890,6 +890,111 @@ def log_measurement_exception(target, exception):
     )
 
 
+def expected_throughput(relay, results):
+    """Return the throughput expected when measuring ``relay``, in bytes per
+    second.
+
+    It is the bandwidth of the last successful result in ``results``, or the
+    relay consensus bandwidth when there are not successful results, or its
+    observed bandwidth when it is not in the consensus, or 0.
+    """
+    for result in reversed(results):
+        if isinstance(result, ResultSuccess) and result.downloads:
+            amount = sum(dl["amount"] for dl in result.downloads)
+            duration = sum(dl["duration"] for dl in result.downloads)
+            if duration > 0:
+                return amount / duration
+    return relay.consensus_bandwidth or relay.observed_bandwidth or 0
+
+
+class MeasurementScheduler:
+    """Measure relays in ``executor`` while there are free measurement
+    threads and the sum of the expected throughput of the relays being
+    measured is not larger than ``max_throughput``.
+
+    So that several fast relays measured at the same time do not saturate
+    the scanner link and make each other's downloads slower.
+
+    :param executor: the ``ThreadPoolExecutor`` that measures the relays.
+    :param int max_measurements: the number of measurement threads.
+    :param int max_throughput: the maximum throughput of the relays being
+        measured, in bytes per second, or 0 to do not limit it.
+    """
+
+    def __init__(self, executor, max_measurements, max_throughput=0):
+        self.executor = executor
+        self.max_measurements = max_measurements
+        self.max_throughput = max_throughput
+        # The relays being measured by their ``Future``.
+        self.pending_results = {}
+        # The time at which the measurement started and the expected
+        # throughput by ``Future``.
+        self._measurements = {}
+        # The expected throughput of the relays being measured.
+        self.throughput = 0
+
+    def __len__(self):
+        return len(self.pending_results)
+
+    def is_measuring(self, fingerprint):
+        return any(
+            fingerprint == target.fingerprint
+            for target in self.pending_results.values()
+        )
+
+    def can_submit(self, throughput=0):
+        """Whether a relay with the expected ``throughput`` can be measured
+        now.
+
+        A relay is always measured when no other relay is being measured,
+        also if its expected throughput is larger than ``max_throughput``.
+        """
+        if len(self.pending_results) >= self.max_measurements:
+            return False
+        return (
+            not self.max_throughput
+            or not self.pending_results
+            or self.throughput + throughput <= self.max_throughput
+        )
+
+    def submit(self, target, throughput, *args):
+        """Start measuring ``target`` calling ``dispatch_worker_thread`` with
+        ``args``."""
+        future = self.executor.submit(dispatch_worker_thread, *args, target)
+        self.pending_results[future] = target
+        self._measurements[future] = (time.monotonic(), throughput)
+        self.throughput += throughput
+        return future
+
+    def wait_first_completed(self, hbeat, result_dump):
+        """Wait for at least one of the measurements to complete.
+
+        Every completed ``Future`` is processed by
+        ``process_completed_future``.
+
+        :returns: the fingerprints of the relays which measurements
+            completed.
+        """
+        done, _ = concurrent.futures.wait(
+            self.pending_results,
+            return_when=concurrent.futures.FIRST_COMPLETED,
+        )
+        measured_fps = set()
+        for future_measurement in done:
+            target = self.pending_results.pop(future_measurement)
+            tstart, throughput = self._measurements.pop(future_measurement)
+            self.throughput -= throughput
+            hbeat.register_measurement_secs(time.monotonic() - tstart)
+            process_completed_future(
+                future_measurement, target, hbeat, result_dump
+            )
+            measured_fps.add(target.fingerprint)
+        if not self.pending_results:
+            # Do not accumulate floating point errors.
+            self.throughput = 0
+        return measured_fps
+
+
 def main_loop(
     args,
     conf,
@@ -900,94 +1005,134 @@ def main_loop(
     relay_prioritizer,
     destinations,
 ):
-    r"""Create the queue of future measurements for every relay to measure.
+    r"""Measure the relays continuously.
 
     It starts a loop that will be run while there is not and event signaling
     that sbws is stopping (because of SIGTERM or SIGINT).
 
-    Then the ``ThreadPoolExecutor`` (executor) queues all the relays to
-    measure in ``Future`` objects. These objects have an ``state``.
+    In every loop, the relays to measure are obtained from
+    ``relay_prioritizer``, and every relay is submitted to the
+    ``ThreadPoolExecutor`` (executor) as soon as the
+    ``MeasurementScheduler`` can measure it: when one of the
+    ``max_pending_results`` threads is free and, if ``max_throughput`` is
+    set, the expected throughput of the relay fits in it.
+    When there are not more relays in the loop, a new loop starts without
+    waiting for the relays still being measured to finish.
 
-    The executor starts a new thread for every relay to measure, which runs
-    ``measure_relay`` until there are ``max_pending_results`` threads.
-    After that, it will reuse a thread that has finished for every relay to
-    measure.
+    A relay is not submitted again while it is being measured or when it was
+    measured in the previous loop, since its result might not be stored yet
+    by ``result_dump``.
 
-    Then ``process_completed_futures`` is call, to obtain the results in the
-    completed ``future``\s.
+    Then ``MeasurementScheduler.wait_first_completed`` is call, to obtain the
+    results in the completed ``future``\s.
 
     """
     log.info("Started the main loop to measure the relays.")
-    hbeat = Heartbeat(conf.getpath("paths", "state_fname"))
-
-    # Set the time to wait for a thread to finish as the half of an HTTP
-    # request timeout.
-    # Do not start a new loop if sbws is stopping.
-    while not settings.end_event.is_set():
-        log.debug("Starting a new measurement loop.")
-        num_relays = 0
-        loop_tstart = time.monotonic()
-
-        # Register relay fingerprints to the heartbeat module
-        hbeat.register_consensus_fprs(relay_list.relays_fingerprints)
-        # num_threads
-        max_pending_results = conf.getint("scanner", "measurement_threads")
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=max_pending_results, thread_name_prefix="measurer"
-        ) as executor:
-            log.info("In the executor, queue all future measurements.")
-            # With futures, there's no need for callback, what it was the
-            # callback with multiprocessing library can be just a function
-            # that gets executed when the future result is obtained.
-            pending_results = {
-                executor.submit(
-                    dispatch_worker_thread,
+    # num_threads
+    max_pending_results = conf.getint("scanner", "measurement_threads")
+    max_throughput = conf.getint("scanner", "max_throughput")
+    hbeat = Heartbeat(
+        conf.getpath("paths", "state_fname"), max_pending_results
+    )
+    measured_fps = set()
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_pending_results, thread_name_prefix="measurer"
+    ) as executor:
+        scheduler = MeasurementScheduler(
+            executor, max_pending_results, max_throughput
+        )
+        # Do not start a new loop if sbws is stopping.
+        while not settings.end_event.is_set():
+            log.debug("Starting a new measurement loop.")
+            num_relays = 0
+            loop_tstart = time.monotonic()
+
+            # Register relay fingerprints to the heartbeat module
+            hbeat.register_consensus_fprs(relay_list.relays_fingerprints)
+            previous_measured_fps, measured_fps = measured_fps, set()
+            for target in relay_prioritizer.best_priority():
+                if settings.end_event.is_set():
+                    break
+                if target.fingerprint in previous_measured_fps or (
+                    scheduler.is_measuring(target.fingerprint)
+                ):
+                    continue
+                throughput = 0
+                if max_throughput:
+                    throughput = expected_throughput(
+                        target, result_dump.results_for_relay(target)
+                    )
+                # Wait for a thread to be free and for enough throughput.
+                while not scheduler.can_submit(throughput):
+                    measured_fps.update(
+                        scheduler.wait_first_completed(hbeat, result_dump)
+                    )
+                scheduler.submit(
+                    target,
+                    throughput,
                     args,
                     conf,
                     destinations,
                     circuit_builder,
                     relay_list,
-                    target,
-                ): target
-                for target in relay_prioritizer.best_priority()
-            }
-            log.debug("Measurements queued.")
-            # After the submitting all the targets to the executor, the pool
-            # has queued all the relays and pending_results has the list of all
-            # `Future`s.
-
-            # Each target relay_recent_measurement_attempt is incremented in
-            # `process_completed_futures` as well as hbeat measured
-            # fingerprints.
-            num_relays = len(pending_results)
-            # Without a callback, it's needed to pass `result_dump` here to
-            # call the function that writes the measurement when it's
-            # finished.
-            process_completed_futures(
-                executor,
-                hbeat,
-                result_dump,
-                pending_results,
+                )
+                num_relays += 1
+
+            # Print the heartbeat message
+            hbeat.print_heartbeat_message()
+
+            loop_tstop = time.monotonic()
+            loop_tdelta = (loop_tstop - loop_tstart) / 60
+            # At this point, we know the relays that were queued to be
+            # measured.
+            log.debug(
+                "Attempted to measure %s relays in %i minutes.",
+                num_relays,
+                loop_tdelta,
             )
-            wait_futures_completed(pending_results)
-
-        # Print the heartbeat message
-        hbeat.print_heartbeat_message()
-
-        loop_tstop = time.monotonic()
-        loop_tdelta = (loop_tstop - loop_tstart) / 60
-        # At this point, we know the relays that were queued to be
-        # measured.
-        log.debug(
-            "Attempted to measure %s relays in %i minutes.",
-            num_relays,
-            loop_tdelta,
-        )
-        # In a testing network, exit after first loop
-        if controller.get_conf("TestingTorNetwork") == "1":
-            log.info("In a testing network, exiting after the first loop.")
-            # Threads should be closed nicely in some refactor
-            stop_threads(signal.SIGTERM, None)
+            # In a testing network, exit after first loop
+            if controller.get_conf("TestingTorNetwork") == "1":
+                log.info("In a testing network, exiting after the first loop.")
+                while scheduler:
+                    scheduler.wait_first_completed(hbeat, result_dump)
+                # Threads should be closed nicely in some refactor
+                stop_threads(signal.SIGTERM, None)
+
+
+def process_completed_future(future_measurement, target, hbeat, result_dump):
+    """Obtain the measurement of a completed ``Future``.
+
+    It calls ``measurement_writer`` with the ``result``, or
+    ``log_measurement_exception`` if there was an exception not caught by
+    ``measure_relay``.
+    """
+    # 40023, disable to decrease state.dat json lines
+    # relay_list.increment_recent_measurement_attempt()
+    target.increment_relay_recent_measurement_attempt()
+
+    # Register this measurement to the heartbeat module
+    hbeat.register_measured_fpr(target.fingerprint)
+    log.debug(
+        "Future measurement for target %s (%s) is done: %s",
+        target.fingerprint,
+        target.nickname,
+        future_measurement.done(),
+    )
+    try:
+        measurement = future_measurement.result()
+    except Exception as e:
+        log_measurement_exception(target, e)
+        import psutil
+
+        log.warning(psutil.Process(os.getpid()).memory_full_info())
+        virtualMemoryInfo = psutil.virtual_memory()
+        availableMemory = virtualMemoryInfo.available
+        log.warning("Memory available %s MB.", availableMemory / 1024**2)
+        dumpstacks()
+    else:
+        log.info("Measurement ready: %s" % (measurement))
+        measurement_writer(result_dump, measurement)
 
 
 def process_completed_futures(executor, hbeat, result_dump, pending_results):
@@ -1012,34 +1157,9 @@ def process_completed_futures(executor, hbeat, result_dump, pending_results):
             pending_results
         ):
             target = pending_results[future_measurement]
-            # 40023, disable to decrease state.dat json lines
-            # relay_list.increment_recent_measurement_attempt()
-            target.increment_relay_recent_measurement_attempt()
-
-            # Register this measurement to the heartbeat module
-            hbeat.register_measured_fpr(target.fingerprint)
-            log.debug(
-                "Future measurement for target %s (%s) is done: %s",
-                target.fingerprint,
-                target.nickname,
-                future_measurement.done(),
+            process_completed_future(
+                future_measurement, target, hbeat, result_dump
             )
-            try:
-                measurement = future_measurement.result()
-            except Exception as e:
-                log_measurement_exception(target, e)
-                import psutil
-
-                log.warning(psutil.Process(os.getpid()).memory_full_info())
-                virtualMemoryInfo = psutil.virtual_memory()
-                availableMemory = virtualMemoryInfo.available
-                log.warning(
-                    "Memory available %s MB.", availableMemory / 1024**2
-                )
-                dumpstacks()
-            else:
-                log.info("Measurement ready: %s" % (measurement))
-                measurement_writer(result_dump, measurement)
             # `pending_results` has all the initial queued `Future`s,
             # they don't decrease as they get completed, but we know 1 has be
             # completed in each loop,
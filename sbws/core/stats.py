@@ -9,7 +9,7 @@ from sbws.lib.resultdump import (
     ResultErrorCircuit,
     ResultErrorStream,
     ResultSuccess,
-    load_recent_results_in_datadir,
+    load_recent_results,
 )
 
 log = logging.getLogger(__name__)
@@ -175,6 +175,19 @@ def gen_parser(sub):
         action="store_true",
         help="Also print information about each error type",
     )
+    p.add_argument(
+        "-j",
+        "--jobs",
+        default=1,
+        type=int,
+        help="Number of processes to use to read the result files.",
+    )
+
+
+def _results_db(conf):
+    if conf.get("general", "results_backend") == "sqlite":
+        return conf.getpath("paths", "results_db")
+    return None
 
 
 def main(args, conf):
@@ -188,8 +201,14 @@ def main(args, conf):
     datadir = conf.getpath("paths", "datadir")
 
     fresh_days = conf.getint("general", "data_period")
-    results = load_recent_results_in_datadir(
-        fresh_days, datadir, success_only=False
+    results = load_recent_results(
+        fresh_days,
+        datadir,
+        use_columns=conf.getboolean("general", "columnar_results"),
+        success_only=False,
+        use_index=conf.getboolean("general", "results_index"),
+        jobs=getattr(args, "jobs", 1),
+        results_db=_results_db(conf),
     )
     if len(results) < 1:
         log.warning("No fresh results")
@@ -10,7 +10,21 @@ from sbws import __version__
 
 log = logging.getLogger(__name__)
 
-RESULT_VERSION = 4
+RESULT_VERSION = 5
+# Oldest result version that can be read.
+# Since version 5, the relay counters of a result only contain the timestamps
+# that were not written in a previous result of the same relay in the same
+# file.
+RESULT_MIN_VERSION = 4
+# Name of the file in the datadir that caches the already parsed results
+# and the version of its format.
+RESULT_INDEX_FNAME = ".results-index"
+RESULT_INDEX_VERSION = 2
+# Compressed result files are compressed in blocks of this number of lines,
+# and the blocks are described in a file with the same name and this
+# extension.
+RESULT_BLOCK_LINES = 500
+RESULT_BLOCKS_EXT = ".idx"
 WIRE_VERSION = 1
 SPEC_VERSION = "1.9.0"
 
@@ -0,0 +1,261 @@
+"""Snapshot of the cached consensus used to generate a bandwidth file.
+
+The ``cached-consensus`` file is parsed once per ``sbws generate`` run and
+the router statuses, the number of relays and the sum of the consensus
+bandwidth are obtained from the same snapshot.
+
+The consensus is read by a line scanner that only parses the ``r``, ``s``
+and ``w`` lines of the router statuses, which is faster and uses less memory
+than parsing every router status with stem, that is only used when the
+scanner can not parse the file.
+
+Optionally, the values that sbws uses are cached in a JSON file, so that the
+consensus is not parsed again while it does not change.
+"""
+import binascii
+import json
+import logging
+import os
+from collections import namedtuple
+
+from stem.descriptor import parse_file
+
+log = logging.getLogger(__name__)
+
+CONSENSUS_CACHE_VERSION = 2
+
+#: The relay flags stored in :attr:`RouterStatus.flags`, the position is the
+#: bit in the mask. Do not change the order, only append new flags.
+#: Other flags are ignored.
+ROUTER_FLAGS = (
+    "Authority",
+    "BadExit",
+    "Exit",
+    "Fast",
+    "Guard",
+    "HSDir",
+    "MiddleOnly",
+    "NoEdConsensus",
+    "Running",
+    "Stable",
+    "StaleDesc",
+    "Sybil",
+    "V2Dir",
+    "Valid",
+)
+_FLAGS_BITS = {flag: 1 << i for i, flag in enumerate(ROUTER_FLAGS)}
+
+
+def flags_mask(flags):
+    """Return the bitmask of a list of relay flags."""
+    mask = 0
+    for flag in flags:
+        mask |= _FLAGS_BITS.get(flag, 0)
+    return mask
+
+
+def flags_from_mask(mask):
+    """Return the list of relay flags in a bitmask."""
+    return [flag for flag in ROUTER_FLAGS if mask & _FLAGS_BITS[flag]]
+
+
+class RouterStatus(
+    namedtuple(
+        "RouterStatus", ["fingerprint", "bandwidth", "is_unmeasured", "flags"]
+    )
+):
+    """The values of a consensus router status entry that sbws uses, with the
+    same names as in
+    :class:`~stem.descriptor.router_status_entry.RouterStatusEntryV3`, but
+    with the ``flags`` as a bitmask of :data:`ROUTER_FLAGS`.
+    """
+
+    __slots__ = ()
+
+    def has_flag(self, flag):
+        return bool(self.flags & _FLAGS_BITS.get(flag, 0))
+
+
+def _fingerprint(identity):
+    # The identity is the base64 of the fingerprint without the padding.
+    return binascii.a2b_base64(identity + "=").hex().upper()
+
+
+def parse_router_statuses(consensus_path):
+    """Read the router statuses of a consensus file scanning only the lines
+    that sbws needs.
+
+    :returns: a dictionary with :class:`RouterStatus` by relay fingerprint.
+    :raises ValueError: if the file can not be parsed.
+    """
+    router_statuses = {}
+    fp, bandwidth, is_unmeasured, flags = None, None, False, 0
+    with open(consensus_path, "rt") as fd:
+        try:
+            for line in fd:
+                keyword = line[:2]
+                if keyword == "r ":
+                    if fp is not None:
+                        router_statuses[fp] = RouterStatus(
+                            fp, bandwidth, is_unmeasured, flags
+                        )
+                    fp = _fingerprint(line.split(" ", 3)[2])
+                    bandwidth, is_unmeasured, flags = None, False, 0
+                elif fp is None:
+                    continue
+                elif keyword == "s " or line == "s\n":
+                    flags = flags_mask(line.split()[1:])
+                elif keyword == "w ":
+                    for key_value in line.split()[1:]:
+                        key, _, value = key_value.partition("=")
+                        if key == "Bandwidth":
+                            bandwidth = int(value)
+                        elif key == "Unmeasured":
+                            is_unmeasured = value == "1"
+                elif line.startswith("directory-footer"):
+                    break
+        except IndexError:
+            raise ValueError("Invalid router status line: {}".format(line))
+    if fp is not None:
+        router_statuses[fp] = RouterStatus(fp, bandwidth, is_unmeasured, flags)
+    return router_statuses
+
+
+def parse_router_statuses_stem(consensus_path):
+    """Read the router statuses of a consensus file with stem.
+
+    :returns: a dictionary with :class:`RouterStatus` by relay fingerprint.
+    """
+    return {
+        rs.fingerprint: RouterStatus(
+            rs.fingerprint,
+            rs.bandwidth,
+            rs.is_unmeasured,
+            flags_mask(rs.flags),
+        )
+        for rs in parse_file(consensus_path)
+    }
+
+
+def consensus_valid_after(consensus_path):
+    """Return the ``valid-after`` line value of a consensus file, without
+    parsing the router statuses, or None if it is not found."""
+    with open(consensus_path, "rt") as fd:
+        for line in fd:
+            if line.startswith("valid-after "):
+                return line.split(" ", 1)[1].strip()
+            # The router statuses come after the header.
+            if line.startswith("r "):
+                break
+    return None
+
+
+class ConsensusSnapshot:
+    """The router statuses of a consensus.
+
+    :param dict router_statuses: :class:`RouterStatus` by relay fingerprint,
+        or None if the consensus could not be read.
+    :param str valid_after: the consensus ``valid-after``.
+    """
+
+    def __init__(self, router_statuses=None, valid_after=None):
+        self.router_statuses = router_statuses
+        self.valid_after = valid_after
+
+    @property
+    def number_relays(self):
+        """The number of relays in the consensus, or None if the consensus
+        could not be read."""
+        if self.router_statuses is None:
+            return None
+        return len(self.router_statuses)
+
+    @property
+    def sum_bandwidth(self):
+        """The sum of the consensus bandwidth of all the relays in bytes, or
+        None if the consensus could not be read."""
+        if self.router_statuses is None:
+            return None
+        # The consensus bandwidth is in KB.
+        return sum(
+            (rs.bandwidth or 0) * 1000 for rs in self.router_statuses.values()
+        )
+
+    @classmethod
+    def from_file(cls, consensus_path, cache_fname=None):
+        """Parse the consensus file ``consensus_path``.
+
+        If ``cache_fname`` is given, the snapshot is read from that file when
+        it was stored from a consensus with the same ``valid-after`` and
+        modification time, otherwise it is stored there after parsing the
+        consensus.
+
+        When the consensus can not be read, the snapshot has no router
+        statuses.
+        """
+        try:
+            mtime = os.stat(consensus_path).st_mtime
+            valid_after = consensus_valid_after(consensus_path)
+        except (FileNotFoundError, TypeError):
+            log.warning(
+                "It is not possible to obtain the last consensus "
+                "cached file %s.",
+                consensus_path,
+            )
+            return cls()
+        if cache_fname:
+            snapshot = cls._read_cache(cache_fname, valid_after, mtime)
+            if snapshot is not None:
+                log.debug("Read the consensus from %s.", cache_fname)
+                return snapshot
+        try:
+            router_statuses = parse_router_statuses(consensus_path)
+        except ValueError as e:
+            log.warning("Parsing the consensus with stem: %s", e)
+            router_statuses = parse_router_statuses_stem(consensus_path)
+        snapshot = cls(router_statuses, valid_after)
+        if cache_fname:
+            snapshot._write_cache(cache_fname, mtime)
+        log.info("Number of relays in the network %s", snapshot.number_relays)
+        return snapshot
+
+    @classmethod
+    def _read_cache(cls, cache_fname, valid_after, mtime):
+        try:
+            with open(cache_fname, "rt") as fd:
+                cache = json.load(fd)
+        except (OSError, ValueError):
+            return None
+        if (
+            cache.get("version") != CONSENSUS_CACHE_VERSION
+            or cache.get("valid_after") != valid_after
+            or cache.get("mtime") != mtime
+        ):
+            return None
+        return cls(
+            {
+                fp: RouterStatus(fp, *values)
+                for fp, values in cache["router_statuses"].items()
+            },
+            valid_after,
+        )
+
+    def _write_cache(self, cache_fname, mtime):
+        cache = {
+            "version": CONSENSUS_CACHE_VERSION,
+            "valid_after": self.valid_after,
+            "mtime": mtime,
+            "router_statuses": {
+                fp: [rs.bandwidth, rs.is_unmeasured, rs.flags]
+                for fp, rs in self.router_statuses.items()
+            },
+        }
+        # Write to a temporal file first, so that a concurrent reader never
+        # reads a partial cache.
+        tmp_fname = cache_fname + ".tmp"
+        try:
+            with open(tmp_fname, "wt") as fd:
+                json.dump(cache, fd)
+            os.replace(tmp_fname, cache_fname)
+        except OSError as e:
+            log.warning("Can not write the consensus cache: %s", e)
@@ -15,7 +15,7 @@ class Heartbeat(object):
     information about the current state
     """
 
-    def __init__(self, state_path):
+    def __init__(self, state_path, measurement_threads=None):
         # Variable to count total progress in the last days:
         # In case it is needed to see which relays are not being measured,
         # store their fingerprint, not only their number.
@@ -28,9 +28,29 @@ class Heartbeat(object):
 
         self.previous_measurement_percent = 0
 
+        # To log how much time the measurement threads are measuring relays
+        # since the last heartbeat message.
+        self.measurement_threads = measurement_threads
+        self.measurement_secs = 0
+        self.heartbeat_tstart = self.main_loop_tstart
+
     def register_measured_fpr(self, async_result):
         self.measured_fp_set.add(async_result)
 
+    def register_measurement_secs(self, secs):
+        """Add the seconds that a measurement thread was measuring a relay."""
+        self.measurement_secs += secs
+
+    @property
+    def threads_utilization(self):
+        """The fraction of the time since the last heartbeat message that
+        the measurement threads were measuring relays, or None if the number
+        of threads is not known."""
+        secs = time.monotonic() - self.heartbeat_tstart
+        if not self.measurement_threads or secs <= 0:
+            return None
+        return self.measurement_secs / (self.measurement_threads * secs)
+
     def register_consensus_fprs(self, relay_fprs):
         for r in relay_fprs:
             self.consensus_fp_set.add(r)
@@ -42,7 +62,8 @@ class Heartbeat(object):
         measuring all the Network.
 
         Log the percentage, the number of relays measured and not measured,
-        the number of loops and the time elapsed since it started measuring.
+        the number of loops, the time elapsed since it started measuring and
+        the utilization of the measurement threads.
         """
         loops_count = self.state_dict.count("recent_priority_list")
 
@@ -76,3 +97,14 @@ class Heartbeat(object):
             )
 
         self.previous_measurement_percent = new_measured_percent
+
+        threads_utilization = self.threads_utilization
+        if threads_utilization is not None:
+            log.info(
+                "The %s measurement threads were measuring relays %i%% of "
+                "the time since the previous heartbeat.",
+                self.measurement_threads,
+                round(threads_utilization * 100),
+            )
+        self.measurement_secs = 0
+        self.heartbeat_tstart = time.monotonic()
@@ -1,10 +1,8 @@
-import copy
 import logging
 import time
 from decimal import Decimal
 
 from ..globals import MAX_RECENT_PRIORITY_RELAY_COUNT
-from ..lib.resultdump import ResultError
 from ..util import state, timestamps
 
 log = logging.getLogger(__name__)
@@ -85,16 +83,10 @@ class RelayPrioritizer:
         list of relays returned by this method, this method is run again
         before all the relays in the network are measured.
 
-        .. note::
-
-            In a future refactor, instead of having a static fraction of relays
-            to be measured, this method could be call when it's known that
-            there're X number of new relays in the network.
-
-        Since measurements made before than X days ago (too old) are not
-        considered, and the initial list of past measurements is only filtered
-        when the scanner starts, it's needed to filter here again to discard
-        those measurements.
+        The priorities are not calculated here, they are kept by the
+        :class:`~sbws.lib.resultdump.RelayPriorityIndex` of the
+        ``result_dump``, that is updated every time a result is stored or
+        becomes too old, so only the relays returned are looked at.
 
         :param bool prioritize_result_error: whether prioritize or not
             measurements that did not succeed.
@@ -105,52 +97,13 @@ class RelayPrioritizer:
 
         """
         fn_tstart = Decimal(time.monotonic())
-        relays = set(copy.deepcopy(self.relay_list.relays))
+        # The relays are not copied, the priorities are kept in a list of
+        # (priority, fingerprint), so that the relays returned are the ones
+        # in the relay list.
+        relays = {relay.fingerprint: relay for relay in self.relay_list.relays}
         if not self.measure_authorities:
-            relays = relays.difference(set(self.relay_list.authorities))
-        # Since there will be new measurements every time this method is called
-        # again, update the list of results.
-        # In a future refactor with other data structure there should not be
-        # needed.
-        rd = self.result_dump
-        for relay in relays:
-            results = rd.results_for_relay(relay)
-            priority = 0
-            # The time before which we do not consider results valid anymore
-            oldest_allowed = time.time() - self.fresh_seconds
-            for result in results:
-                # Ignore results that are too far in the past
-                if result.time < oldest_allowed:
-                    continue
-                # Calculate freshness as the remaining time until this result
-                # is no longer valid
-                freshness = result.time - oldest_allowed
-                if (
-                    isinstance(result, ResultError)
-                    and prioritize_result_error is True
-                ):
-                    # log.debug('Cutting freshness for a %s result by %d%% for'
-                    #           ' %s', result.type.value,
-                    #           result.freshness_reduction_factor * 100,
-                    #           relay.nickname)
-                    # result.freshness_reduction_factor are hard-coded values
-                    # on how much prioritize measurements that failed
-                    # depending on the type of error.
-                    # In a future refactor, create these values on an algorithm
-                    # or create constants.
-                    freshness *= max(
-                        1.0 - result.freshness_reduction_factor, 0
-                    )
-                priority += freshness
-            # In a future refactor, do not create a new attribute
-            relay.priority = priority
-        # Sort the relays by their priority, with the smallest (best) priority
-        # relays at the front
-        relays = sorted(relays, key=lambda r: r.priority)
-
-        fn_tstop = Decimal(time.monotonic())
-        fn_tdelta = (fn_tstop - fn_tstart) * 1000
-        log.info("Spent %f msecs calculating relay best priority", fn_tdelta)
+            for relay in self.relay_list.authorities:
+                relays.pop(relay.fingerprint, None)
 
         # Return a fraction of relays in the network if return_fraction is
         # True, otherwise return all.
@@ -158,22 +111,37 @@ class RelayPrioritizer:
             int(len(relays) * self.fraction_to_return), self.min_to_return
         )
         upper_limit = cutoff if return_fraction else len(relays)
+        rd = self.result_dump
+        with rd.data_lock:
+            # Remove the results that are too old since the last result was
+            # stored.
+            rd.expire_results()
+            index = rd.priority_index(prioritize_result_error)
+            # The relays without results have the best priority.
+            best = [(0, fp) for fp in relays if fp not in index]
+            best = best[:upper_limit]
+            best.extend(
+                index.best(upper_limit - len(best), relays, time.time())
+            )
+
+        fn_tstop = Decimal(time.monotonic())
+        fn_tdelta = (fn_tstop - fn_tstart) * 1000
+        log.info("Spent %f msecs calculating relay best priority", fn_tdelta)
+
         # NOTE: these two are blocking, write to disk
         # Increment the number of times ``best_priority`` has been run.
         self.increment_recent_priority_list()
         # Increment the number of relays that have been "prioritized".
         # Because in a small testing network the upper limit could be smaller
         # than the number of relays in the network, use the length of the list.
-        self.increment_recent_priority_relay(len(relays[0:upper_limit]))
-        for relay in relays[0:upper_limit]:
+        self.increment_recent_priority_relay(len(best))
+        for priority, fp in best:
+            relay = relays[fp]
             log.debug(
                 "Returning next relay %s with priority %f",
                 relay.nickname,
-                relay.priority,
+                priority,
             )
-            # In a future refactor, a new attribute should not be created,
-            # then no need to remove it.
-            del relay.priority
             # Increment the number of times a really was "prioritized" to be
             # measured.
             relay.increment_relay_recent_priority_list()
@@ -0,0 +1,348 @@
+"""Columnar storage of the results.
+
+Optionally, the results are stored in a compact binary format in the datadir,
+in parallel to the JSON lines result files.
+For every day there are three files:
+
+- ``YYYY-MM-DD.rec``: an array of fixed-width records, one per result, with
+  the time, the index of the relay fingerprint, the result type, the
+  position of the downloads in the ``.dl`` file and the relay bandwidths.
+- ``YYYY-MM-DD.dl``: an array of (amount, duration) download pairs.
+- ``YYYY-MM-DD.fps``: the relay fingerprints, one per line, in the order in
+  which they were seen that day.
+
+The files are only appended to, and a record is written after its
+fingerprint and downloads, so that they can be memory-mapped and read while
+they are being written without parsing any JSON.
+
+The JSON lines result files are still the interchange format, these files
+only contain the values needed by ``sbws stats`` and
+:class:`~sbws.lib.relayprioritizer.RelayPrioritizer`.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import time
+from array import array
+from datetime import datetime, timedelta
+
+log = logging.getLogger(__name__)
+
+RECORDS_EXT = ".rec"
+DOWNLOADS_EXT = ".dl"
+FINGERPRINTS_EXT = ".fps"
+COLUMNS_EXTS = [RECORDS_EXT, DOWNLOADS_EXT, FINGERPRINTS_EXT]
+
+# time, fingerprint index, type, number of downloads, first download index,
+# consensus bandwidth, consensus bandwidth is unmeasured, average bandwidth,
+# burst bandwidth, observed bandwidth.
+RECORD_STRUCT = struct.Struct("<dIBBIqbqqq")
+# amount, duration
+DOWNLOAD_STRUCT = struct.Struct("<qd")
+
+# The position in this tuple is the type stored in the records.
+# Do not change the order, only append new types.
+RESULT_TYPES = (
+    "success",
+    "error-misc",
+    "error-circ",
+    "error-stream",
+    "error-auth",
+    "error-second-relay",
+    "error-destination",
+)
+
+# Integers that can be None are stored as -1.
+_NONE = -1
+
+
+def _int_or_none(value):
+    return _NONE if value is None else int(value)
+
+
+def _none_if_negative(value):
+    return None if value < 0 else value
+
+
+class ResultColumns:
+    """Results stored by columns.
+
+    The position ``i`` in every column is the ``i`` result.
+    The downloads of the ``i`` result are the ``num_downloads[i]`` items
+    in ``download_amounts`` and ``download_durations`` starting at
+    ``downloads_start[i]``.
+    """
+
+    def __init__(self, fingerprints=None):
+        self.fingerprints = list(fingerprints or [])
+        self._fingerprints_index = {
+            fp: i for i, fp in enumerate(self.fingerprints)
+        }
+        self.time = array("d")
+        self.fingerprint_index = array("I")
+        self.type = array("B")
+        self.num_downloads = array("B")
+        self.downloads_start = array("I")
+        self.consensus_bandwidth = array("q")
+        self.consensus_bandwidth_is_unmeasured = array("b")
+        self.average_bandwidth = array("q")
+        self.burst_bandwidth = array("q")
+        self.observed_bandwidth = array("q")
+        self.download_amounts = array("q")
+        self.download_durations = array("d")
+
+    def __len__(self):
+        return len(self.time)
+
+    def fingerprint(self, i):
+        return self.fingerprints[self.fingerprint_index[i]]
+
+    def result_type(self, i):
+        return RESULT_TYPES[self.type[i]]
+
+    def downloads(self, i):
+        """Return the downloads of the ``i`` result as the list of
+        dictionaries stored in a ResultSuccess."""
+        start = self.downloads_start[i]
+        stop = start + self.num_downloads[i]
+        return [
+            {"amount": amount, "duration": duration}
+            for amount, duration in zip(
+                self.download_amounts[start:stop],
+                self.download_durations[start:stop],
+            )
+        ]
+
+    def relay_bandwidths(self, i):
+        """Return a tuple with the average, burst, observed, consensus
+        bandwidth and whether the consensus bandwidth is unmeasured of the
+        ``i`` result, with None when they were not known."""
+        unmeasured = self.consensus_bandwidth_is_unmeasured[i]
+        return (
+            _none_if_negative(self.average_bandwidth[i]),
+            _none_if_negative(self.burst_bandwidth[i]),
+            _none_if_negative(self.observed_bandwidth[i]),
+            _none_if_negative(self.consensus_bandwidth[i]),
+            None if unmeasured < 0 else bool(unmeasured),
+        )
+
+    def _fingerprint_index(self, fp):
+        if fp not in self._fingerprints_index:
+            self._fingerprints_index[fp] = len(self.fingerprints)
+            self.fingerprints.append(fp)
+        return self._fingerprints_index[fp]
+
+    def _append_row(self, row):
+        self.time.append(row[0])
+        self.fingerprint_index.append(row[1])
+        self.type.append(row[2])
+        self.num_downloads.append(row[3])
+        self.downloads_start.append(row[4])
+        self.consensus_bandwidth.append(row[5])
+        self.consensus_bandwidth_is_unmeasured.append(row[6])
+        self.average_bandwidth.append(row[7])
+        self.burst_bandwidth.append(row[8])
+        self.observed_bandwidth.append(row[9])
+
+    def append(self, result):
+        """Append a :class:`~sbws.lib.resultdump.Result`."""
+        downloads = getattr(result, "downloads", None) or []
+        self._append_row(
+            (
+                result.time,
+                self._fingerprint_index(result.fingerprint),
+                RESULT_TYPES.index(result.type),
+                len(downloads),
+                len(self.download_amounts),
+                _int_or_none(result.consensus_bandwidth),
+                _int_or_none(result.consensus_bandwidth_is_unmeasured),
+                _int_or_none(result.relay_average_bandwidth),
+                _int_or_none(result.relay_burst_bandwidth),
+                _int_or_none(result.relay_observed_bandwidth),
+            )
+        )
+        for dl in downloads:
+            self.download_amounts.append(dl["amount"])
+            self.download_durations.append(dl["duration"])
+
+    def extend(self, other, oldest_allowed=None):
+        """Append the results in ``other`` columns that are not older than
+        ``oldest_allowed``."""
+        fps_index = [self._fingerprint_index(fp) for fp in other.fingerprints]
+        for i in range(len(other)):
+            if oldest_allowed is not None and other.time[i] < oldest_allowed:
+                continue
+            start = other.downloads_start[i]
+            stop = start + other.num_downloads[i]
+            self._append_row(
+                (
+                    other.time[i],
+                    fps_index[other.fingerprint_index[i]],
+                    other.type[i],
+                    other.num_downloads[i],
+                    len(self.download_amounts),
+                    other.consensus_bandwidth[i],
+                    other.consensus_bandwidth_is_unmeasured[i],
+                    other.average_bandwidth[i],
+                    other.burst_bandwidth[i],
+                    other.observed_bandwidth[i],
+                )
+            )
+            self.download_amounts.extend(other.download_amounts[start:stop])
+            self.download_durations.extend(
+                other.download_durations[start:stop]
+            )
+
+    @classmethod
+    def from_results(cls, result_dict):
+        """Create columns from a results dictionary."""
+        columns = cls()
+        for results in result_dict.values():
+            for result in results:
+                columns.append(result)
+        return columns
+
+
+def _columns_prefix(datadir, dt):
+    return os.path.join(datadir, "{}".format(dt.date()))
+
+
+def _read_mmap(fname):
+    """Return the content of a file as a memory map, or empty bytes if the
+    file is empty."""
+    with open(fname, "rb") as fd:
+        if os.fstat(fd.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def load_columns(prefix):
+    """Read the results columns of a day.
+
+    :param str prefix: the path of the day files without extension.
+    :returns: :class:`ResultColumns`
+    """
+    with open(prefix + FINGERPRINTS_EXT, "rt") as fd:
+        columns = ResultColumns(fd.read().split())
+    records = _read_mmap(prefix + RECORDS_EXT)
+    downloads = _read_mmap(prefix + DOWNLOADS_EXT)
+    # A record that is being written is not read.
+    num_records = len(records) // RECORD_STRUCT.size
+    num_downloads = len(downloads) // DOWNLOAD_STRUCT.size
+    for row in RECORD_STRUCT.iter_unpack(
+        memoryview(records)[: num_records * RECORD_STRUCT.size]
+    ):
+        columns._append_row(row)
+    for amount, duration in DOWNLOAD_STRUCT.iter_unpack(
+        memoryview(downloads)[: num_downloads * DOWNLOAD_STRUCT.size]
+    ):
+        columns.download_amounts.append(amount)
+        columns.download_durations.append(duration)
+    for m in (records, downloads):
+        if isinstance(m, mmap.mmap):
+            m.close()
+    return columns
+
+
+def load_recent_columns_in_datadir(fresh_days, datadir):
+    """Read the results columns of the days that could have results that are
+    still valid.
+
+    :returns: :class:`ResultColumns` without the results older than
+        ``fresh_days``, or None if there are not columns for some day that
+        has a JSON result file, so that the caller can read the JSON files
+        instead.
+    """
+    today = datetime.utcfromtimestamp(time.time())
+    oldest_allowed = time.time() - fresh_days * 24 * 60 * 60
+    working_day = today - timedelta(days=fresh_days + 2)
+    columns = ResultColumns()
+    while working_day <= today:
+        prefix = _columns_prefix(datadir, working_day)
+        if os.path.exists(prefix + RECORDS_EXT):
+            columns.extend(load_columns(prefix), oldest_allowed)
+        elif os.path.exists(prefix + ".txt") or os.path.exists(
+            prefix + ".txt.gz"
+        ):
+            log.debug("There are not results columns for %s.", prefix)
+            return None
+        working_day += timedelta(days=1)
+    log.debug("Read %d results from the results columns.", len(columns))
+    return columns
+
+
+class ColumnarResultWriter:
+    """Append results to the day columns files in ``datadir``.
+
+    It must be used only by one thread, the
+    :class:`~sbws.lib.resultdump.ResultDump` one.
+    """
+
+    def __init__(self, datadir):
+        self.datadir = datadir
+        self._prefix = None
+        self._fingerprints_index = {}
+        self._num_downloads = 0
+
+    def _open_day(self, prefix):
+        self._prefix = prefix
+        self._fingerprints_index = {}
+        if os.path.exists(prefix + FINGERPRINTS_EXT):
+            with open(prefix + FINGERPRINTS_EXT, "rt") as fd:
+                self._fingerprints_index = {
+                    fp: i for i, fp in enumerate(fd.read().split())
+                }
+        self._num_downloads = 0
+        if os.path.exists(prefix + DOWNLOADS_EXT):
+            self._num_downloads = (
+                os.path.getsize(prefix + DOWNLOADS_EXT) // DOWNLOAD_STRUCT.size
+            )
+
+    def write(self, result):
+        """Append a :class:`~sbws.lib.resultdump.Result` to the files of the
+        day of the result."""
+        prefix = _columns_prefix(
+            self.datadir, datetime.utcfromtimestamp(result.time)
+        )
+        try:
+            if prefix != self._prefix:
+                self._open_day(prefix)
+            self._write(prefix, result)
+        # Catch any exception writing, as write_result_to_datadir.
+        except Exception as e:
+            log.error("Can not write results columns to %s: %s", prefix, e)
+            # Read again the day files in case they were partially written.
+            self._prefix = None
+
+    def _write(self, prefix, result):
+        fp = result.fingerprint
+        if fp not in self._fingerprints_index:
+            with open(prefix + FINGERPRINTS_EXT, "at") as fd:
+                fd.write(fp + "\n")
+            self._fingerprints_index[fp] = len(self._fingerprints_index)
+        downloads = getattr(result, "downloads", None) or []
+        if downloads:
+            with open(prefix + DOWNLOADS_EXT, "ab") as fd:
+                fd.write(
+                    b"".join(
+                        DOWNLOAD_STRUCT.pack(dl["amount"], dl["duration"])
+                        for dl in downloads
+                    )
+                )
+        record = RECORD_STRUCT.pack(
+            result.time,
+            self._fingerprints_index[fp],
+            RESULT_TYPES.index(result.type),
+            len(downloads),
+            self._num_downloads,
+            _int_or_none(result.consensus_bandwidth),
+            _int_or_none(result.consensus_bandwidth_is_unmeasured),
+            _int_or_none(result.relay_average_bandwidth),
+            _int_or_none(result.relay_burst_bandwidth),
+            _int_or_none(result.relay_observed_bandwidth),
+        )
+        self._num_downloads += len(downloads)
+        with open(prefix + RECORDS_EXT, "ab") as fd:
+            fd.write(record)
@@ -1,16 +1,40 @@
+import calendar
+import gzip
+import heapq
 import json
 import logging
 import os
+import pickle
+import re
+import sys
 import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 from enum import Enum
 from glob import glob
+from io import BytesIO
+from itertools import islice
 from queue import Empty, Queue
 from threading import RLock, Thread
 
-from sbws.globals import RESULT_VERSION, fail_hard
+from sbws.globals import (
+    RESULT_BLOCK_LINES,
+    RESULT_BLOCKS_EXT,
+    RESULT_INDEX_FNAME,
+    RESULT_INDEX_VERSION,
+    RESULT_MIN_VERSION,
+    RESULT_VERSION,
+    fail_hard,
+)
+from sbws.lib.resultcolumns import (
+    RESULT_TYPES,
+    ColumnarResultWriter,
+    load_recent_columns_in_datadir,
+)
 from sbws.util.filelock import DirectoryLock
-from sbws.util.json import CustomDecoder, CustomEncoder
+from sbws.util.json import CustomEncoder, decode_timestamp, loads
+from sbws.util.timestamps import DateTimeSeq
 
 from .. import settings
 
@@ -30,45 +54,389 @@ def merge_result_dicts(d1, d2):
     return d1
 
 
-def load_result_file(fname, success_only=False):
-    """Reads in all lines from the given file, and parses them into Result
-    structures (or subclasses of Result). Optionally only keeps ResultSuccess.
-    Returns all kept Results as a result dictionary. This function does not
-    care about the age of the results"""
+def _parse_result_line(line):
+    """Parse a result file line into a Result (or a subclass of Result).
+
+    Returns None when the line can not be decoded or has an unknown
+    ``version``.
+    """
+    try:
+        d = loads(line.strip())
+    except json.decoder.JSONDecodeError:
+        log.warning("Could not decode result %s", line.strip())
+        return None
+    # Only the relay counters contain timestamps.
+    for key in RESULT_COUNTERS:
+        if d.get(key):
+            d[key] = [decode_timestamp(ts) for ts in d[key]]
+    return Result.from_dict(d)
+
+
+def _results_list_to_dict(results, success_only=False):
+    """Group a list of Results by relay fingerprint, optionally keeping only
+    the ResultSuccess."""
     d = {}
-    num_total = 0
-    num_ignored = 0
+    for r in results:
+        if success_only and isinstance(r, ResultError):
+            continue
+        fp = r.fingerprint
+        if fp not in d:
+            d[fp] = []
+        d[fp].append(r)
+    return d
+
+
+# To obtain the time and type of a result without decoding the whole line.
+# Other keys' values can not contain these strings, since quotes in them are
+# escaped.
+_RESULT_TIME_RE = re.compile(r'"time": ([0-9.eE+-]+)')
+_RESULT_TYPE_RE = re.compile(r'"type": "([a-z-]+)"')
+
+
+def _keep_result_line(line, oldest_allowed=None, success_only=False):
+    """Whether a result line has to be decoded, looking only at its time and
+    type.
+
+    Returns False when the result is older than ``oldest_allowed`` or when
+    ``success_only`` is True and it is not a ResultSuccess.
+    If the time or the type can not be found, the line is kept, so that
+    decoding it decides.
+    """
+    if oldest_allowed is not None:
+        m = _RESULT_TIME_RE.search(line)
+        if m is not None and float(m.group(1)) < oldest_allowed:
+            return False
+    if success_only:
+        m = _RESULT_TYPE_RE.search(line)
+        if m is not None and m.group(1) != _ResultType.Success.value:
+            return False
+    return True
+
+
+def compress_result_file(fname, block_lines=RESULT_BLOCK_LINES):
+    """Compress a result file to ``fname.gz``.
+
+    The lines are compressed in blocks of ``block_lines`` lines, every block
+    is a gzip member, so that the file is still a valid gzip file.
+    The offset, length and maximum result time of every block are written
+    to ``fname.gz`` + :const:`RESULT_BLOCKS_EXT`, so that the blocks with
+    only old results can be skipped without decompressing them.
+    """
+    out_fname = fname + ".gz"
+    blocks = []
+    offset = 0
+    with open(fname, "rb") as fd, open(out_fname, "wb") as out_fd:
+        while True:
+            lines = list(islice(fd, block_lines))
+            if not lines:
+                break
+            times = [
+                float(m.group(1))
+                for m in map(_RESULT_TIME_RE.search, map(bytes.decode, lines))
+                if m is not None
+            ]
+            data = gzip.compress(b"".join(lines))
+            out_fd.write(data)
+            blocks.append([offset, len(data), max(times, default=None)])
+            offset += len(data)
+    with open(out_fname + RESULT_BLOCKS_EXT, "wt") as fd:
+        json.dump(blocks, fd)
+    return out_fname
+
+
+def _read_result_blocks(fname):
+    """Return the blocks of a compressed result file written by
+    :func:`compress_result_file`, or None if they are not known."""
+    try:
+        with open(fname + RESULT_BLOCKS_EXT, "rt") as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return None
+
+
+def _iter_compressed_result_lines(fname, oldest_allowed=None):
+    blocks = _read_result_blocks(fname)
+    offset = 0
+    with open(fname, "rb") as fd:
+        if blocks is None:
+            with gzip.open(fd) as gzip_fd:
+                for line in gzip_fd:
+                    offset += len(line)
+                    yield line.decode("utf-8"), offset
+            return
+        for block_offset, length, max_time in blocks:
+            if (
+                oldest_allowed is not None
+                and max_time is not None
+                and max_time < oldest_allowed
+            ):
+                log.debug("Skipping a block with old results in %s", fname)
+                continue
+            fd.seek(block_offset)
+            for line in BytesIO(gzip.decompress(fd.read(length))):
+                offset += len(line)
+                yield line.decode("utf-8"), offset
+
+
+def _iter_result_lines(fname, offset=0, oldest_allowed=None):
+    """Yield the lines of a result file starting at ``offset`` bytes,
+    together with the offset after every line.
+
+    The file is only locked to obtain its size. Since the results are
+    written under the lock, the lines before that size are complete and
+    they can be read while other results are being appended.
+
+    Compressed result files are read from the start, skipping the blocks
+    with results older than ``oldest_allowed`` when their blocks are known.
+    """
+    if fname.endswith(".gz"):
+        yield from _iter_compressed_result_lines(fname, oldest_allowed)
+        return
     with DirectoryLock(os.path.dirname(fname)):
-        with open(fname, "rt") as fd:
-            for line in fd:
-                num_total += 1
-                try:
-                    r = Result.from_dict(
-                        json.loads(line.strip(), cls=CustomDecoder)
-                    )
-                except json.decoder.JSONDecodeError:
-                    log.warning("Could not decode result %s", line.strip())
-                    r = None
-                if r is None:
-                    num_ignored += 1
-                    continue
-                if success_only and isinstance(r, ResultError):
-                    continue
-                fp = r.fingerprint
-                if fp not in d:
-                    d[fp] = []
-                d[fp].append(r)
-    num_kept = sum([len(d[fp]) for fp in d])
-    log.debug("Keeping %d/%d read lines from %s", num_kept, num_total, fname)
+        size = os.path.getsize(fname)
+    with open(fname, "rb") as fd:
+        fd.seek(offset)
+        for line in fd:
+            offset += len(line)
+            if offset > size:
+                break
+            yield line.decode("utf-8"), offset
+
+
+def iter_result_file(fname, oldest_allowed=None, success_only=False):
+    """Yield the Results in a result file, one at a time.
+
+    The lines with results older than ``oldest_allowed`` or, when
+    ``success_only`` is True, that are not a ResultSuccess are skipped
+    before decoding them.
+    """
+    for line, _ in _iter_result_lines(fname, oldest_allowed=oldest_allowed):
+        if not _keep_result_line(line, oldest_allowed, success_only):
+            continue
+        r = _parse_result_line(line)
+        if r is None:
+            continue
+        if success_only and isinstance(r, ResultError):
+            continue
+        yield r
+
+
+def _parse_result_file(
+    fname,
+    offset=0,
+    complete_only=False,
+    oldest_allowed=None,
+    success_only=False,
+):
+    """Parse the lines of a result file starting at ``offset`` bytes.
+
+    It is run in the worker processes when loading files in parallel.
+
+    When ``complete_only`` is True, a last line without end of line is not
+    parsed. The lines with results older than ``oldest_allowed`` or, when
+    ``success_only`` is True, that are not a ResultSuccess are not decoded.
+
+    :returns: the offset after the last line parsed and the list of Results.
+    """
+    results = []
+    num_lines = 0
+    num_skipped = 0
+    end = offset
+    for line, line_end in _iter_result_lines(fname, offset, oldest_allowed):
+        if complete_only and not line.endswith("\n"):
+            break
+        end = line_end
+        num_lines += 1
+        if not _keep_result_line(line, oldest_allowed, success_only):
+            num_skipped += 1
+            continue
+        r = _parse_result_line(line)
+        if r is not None:
+            results.append(r)
+    log.debug(
+        "Parsed %d lines from %s, skipped %d old ones.",
+        num_lines,
+        fname,
+        num_skipped,
+    )
+    num_ignored = num_lines - num_skipped - len(results)
     if num_ignored > 0:
         log.warning(
             "Had to ignore %d results due to not knowing how to "
             "parse them.",
             num_ignored,
         )
+    return end, results
+
+
+def _parse_result_files(
+    offsets,
+    jobs=1,
+    complete_only=False,
+    oldest_allowed=None,
+    success_only=False,
+):
+    """Parse every result file in ``offsets`` starting at its offset.
+
+    When ``jobs`` is greater than 1, the files are parsed in parallel in
+    that number of processes.
+
+    :param dict offsets: the offset to start parsing by file name.
+    :returns: a dictionary with the values returned by
+        :func:`_parse_result_file` by file name.
+    """
+    fnames = list(offsets.keys())
+    args = [
+        (fname, offsets[fname], complete_only, oldest_allowed, success_only)
+        for fname in fnames
+    ]
+    if jobs > 1 and len(fnames) > 1:
+        log.debug(
+            "Parsing %d result files in %d processes.", len(fnames), jobs
+        )
+        with ProcessPoolExecutor(max_workers=min(jobs, len(fnames))) as pool:
+            parsed = pool.map(_parse_result_file, *zip(*args))
+            return dict(zip(fnames, parsed))
+    return {fname: _parse_result_file(*a) for fname, a in zip(fnames, args)}
+
+
+def load_result_file(fname, success_only=False):
+    """Reads in all lines from the given file, and parses them into Result
+    structures (or subclasses of Result). Optionally only keeps ResultSuccess.
+    Returns all kept Results as a result dictionary. This function does not
+    care about the age of the results"""
+    _, results = _parse_result_file(fname)
+    d = _results_list_to_dict(results, success_only=success_only)
+    num_kept = sum([len(d[fp]) for fp in d])
+    log.debug("Keeping %d/%d results from %s", num_kept, len(results), fname)
     return d
 
 
+class ResultIndex:
+    """Persistent cache of the Results already parsed from the result files.
+
+    For every result file it stores the file modification time, the byte
+    offset up to which the file has been parsed and the Results parsed so
+    far. Result files are only appended to, so when a file grows only the
+    new lines after the offset are parsed. Files that did not change are not
+    read at all.
+
+    The index is stored in ``datadir`` as :const:`RESULT_INDEX_FNAME`.
+
+    .. note:: the index is a pickle, it must only be written and read by the
+       user running sbws, as the rest of ``datadir``.
+
+    :param str datadir: the directory containing the result files.
+    """
+
+    def __init__(self, datadir):
+        self._fname = os.path.join(datadir, RESULT_INDEX_FNAME)
+        self._entries = self._read()
+        self._mtimes = {}
+        self._changed = False
+
+    def _read(self):
+        if not os.path.exists(self._fname):
+            return {}
+        try:
+            with open(self._fname, "rb") as fd:
+                index = pickle.load(fd)
+        # Any error means the index is corrupt, it will be re-created.
+        except Exception as e:
+            log.warning("Ignoring results index %s: %s", self._fname, e)
+            return {}
+        if not isinstance(index, dict) or index.get("version") != (
+            RESULT_INDEX_VERSION,
+            RESULT_VERSION,
+        ):
+            log.debug("Ignoring results index with other version.")
+            return {}
+        return index.get("entries", {})
+
+    def write(self):
+        """Write the index if it changed, atomically replacing the old one."""
+        if not self._changed:
+            return
+        tmp_fname = self._fname + ".tmp"
+        index = {
+            "version": (RESULT_INDEX_VERSION, RESULT_VERSION),
+            "entries": self._entries,
+        }
+        try:
+            with open(tmp_fname, "wb") as fd:
+                pickle.dump(index, fd, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_fname, self._fname)
+        except OSError as e:
+            log.warning("Can not write results index %s: %s", self._fname, e)
+            return
+        self._changed = False
+
+    def prune(self, fnames):
+        """Remove from the index the files that are not in ``fnames``."""
+        for fname in set(self._entries) - set(fnames):
+            del self._entries[fname]
+            self._changed = True
+
+    def stale_offset(self, fname):
+        """Return the offset from which ``fname`` needs to be parsed, or None
+        when all its results are in the index."""
+        st = os.stat(fname)
+        self._mtimes[fname] = st.st_mtime_ns
+        entry = self._entries.get(fname)
+        # Compressed files are not appended to.
+        if fname.endswith(".gz"):
+            if entry is None or entry["mtime"] != st.st_mtime_ns:
+                return 0
+            log.debug("Using the results index for %s", fname)
+            return None
+        if (
+            entry is None
+            or st.st_size < entry["offset"]
+            # The file was re-written instead of appended.
+            or (
+                st.st_size == entry["offset"]
+                and st.st_mtime_ns != entry["mtime"]
+            )
+        ):
+            return 0
+        if entry["mtime"] != st.st_mtime_ns or entry["offset"] != st.st_size:
+            return entry["offset"]
+        log.debug("Using the results index for %s", fname)
+        return None
+
+    def update(self, fname, from_offset, offset, results):
+        """Add the ``results`` parsed from ``fname`` between ``from_offset``,
+        returned by :meth:`stale_offset`, and ``offset``."""
+        old_results = []
+        if from_offset > 0:
+            old_results = self._entries[fname]["results"]
+        self._entries[fname] = {
+            "mtime": self._mtimes.pop(fname, None),
+            "offset": offset,
+            "results": old_results + results,
+        }
+        self._changed = True
+
+    def results(self, fname, success_only=False):
+        """Return the results of ``fname`` in the index as a result
+        dictionary."""
+        return _results_list_to_dict(
+            self._entries[fname]["results"], success_only=success_only
+        )
+
+    def load_result_file(self, fname, success_only=False):
+        """Like :func:`load_result_file`, but only parsing the lines that are
+        not in the index yet."""
+        from_offset = self.stale_offset(fname)
+        if from_offset is not None:
+            self.update(
+                fname,
+                from_offset,
+                *_parse_result_file(fname, from_offset, complete_only=True),
+            )
+        return self.results(fname, success_only=success_only)
+
+
 def trim_results(fresh_days, result_dict):
     """Given a result dictionary, remove all Results that are no longer valid
     and return the new dictionary"""
@@ -137,13 +505,25 @@ def load_recent_results_in_datadir(
     success_only=False,
     on_changed_ipv4=False,
     on_changed_ipv6=False,
+    use_index=False,
+    jobs=1,
 ):
     """Given a data directory, read all results files in it that could have
     results in them that are still valid. Trim them, and return the valid
-    Results as a list"""
+    Results as a list
+
+    When ``use_index`` is True, the results already parsed in previous calls
+    are read from the :class:`ResultIndex` and only the new lines in the
+    result files are parsed.
+
+    When ``jobs`` is greater than 1, the result files are parsed in parallel
+    in that number of processes.
+    """
     # Inform the results are being loaded, since it takes some seconds.
     log.info("Reading and processing previous measurements.")
     results = {}
+    index = ResultIndex(datadir) if use_index else None
+    fnames = []
     today = datetime.utcfromtimestamp(time.time())
     data_period = fresh_days + 2
     oldest_day = today - timedelta(days=data_period)
@@ -152,18 +532,44 @@ def load_recent_results_in_datadir(
         # Cannot use ** and recursive=True in glob() because we support 3.4
         # So instead settle on finding files in the datadir and one
         # subdirectory below the datadir that fit the form of YYYY-MM-DD*.txt
+        # or YYYY-MM-DD*.txt.gz, when compressed by ``sbws cleanup``.
         d = working_day.date()
         patterns = [
             os.path.join(datadir, "{}*.txt".format(d)),
             os.path.join(datadir, "*", "{}*.txt".format(d)),
+            os.path.join(datadir, "{}*.txt.gz".format(d)),
+            os.path.join(datadir, "*", "{}*.txt.gz".format(d)),
         ]
         for pattern in patterns:
-            for fname in glob(pattern):
-                new_results = load_result_file(
-                    fname, success_only=success_only
-                )
-                results = merge_result_dicts(results, new_results)
+            fnames.extend(glob(pattern))
         working_day += timedelta(days=1)
+    if index is not None:
+        offsets = {fname: index.stale_offset(fname) for fname in fnames}
+        offsets = {f: o for f, o in offsets.items() if o is not None}
+        parsed = _parse_result_files(offsets, jobs=jobs, complete_only=True)
+    else:
+        # The index keeps all the results, only skip the old lines when
+        # not using it.
+        parsed = _parse_result_files(
+            dict.fromkeys(fnames, 0),
+            jobs=jobs,
+            oldest_allowed=time.time() - fresh_days * 24 * 60 * 60,
+            success_only=success_only,
+        )
+    for fname in fnames:
+        if index is not None:
+            if fname in parsed:
+                index.update(fname, offsets[fname], *parsed[fname])
+            new_results = index.results(fname, success_only=success_only)
+        else:
+            new_results = _results_list_to_dict(
+                parsed[fname][1], success_only=success_only
+            )
+        results = merge_result_dicts(results, new_results)
+    if index is not None:
+        # Files out of the period are not needed anymore.
+        index.prune(fnames)
+        index.write()
     results = trim_results(fresh_days, results)
     # in time fresh days is possible that a relay changed ip,
     # if that's the case, keep only the results for the last ip
@@ -183,6 +589,89 @@ def load_recent_results_in_datadir(
     return results
 
 
+def result_dict_from_columns(columns, success_only=False):
+    """Create a results dictionary from
+    :class:`~sbws.lib.resultcolumns.ResultColumns`, optionally only with
+    the ResultSuccess.
+
+    The Results only have the attributes stored in the columns: fingerprint,
+    time, type, downloads and the relay bandwidths.
+    """
+    classes = {
+        _ResultType.Success.value: ResultSuccess,
+        _ResultType.Error.value: ResultError,
+        _ResultType.ErrorCircuit.value: ResultErrorCircuit,
+        _ResultType.ErrorStream.value: ResultErrorStream,
+        _ResultType.ErrorAuth.value: ResultErrorAuth,
+        _ResultType.ErrorSecondRelay.value: ResultErrorSecondRelay,
+        _ResultType.ErrorDestination.value: ResultErrorDestination,
+    }
+    results = {}
+    for i in range(len(columns)):
+        fp = columns.fingerprint(i)
+        relay = Result.Relay(
+            fp, None, None, None, *columns.relay_bandwidths(i)
+        )
+        cls = classes[RESULT_TYPES[columns.type[i]]]
+        if success_only and cls is not ResultSuccess:
+            continue
+        if cls is ResultSuccess:
+            r = ResultSuccess(
+                [],
+                columns.downloads(i),
+                relay,
+                None,
+                None,
+                None,
+                t=columns.time[i],
+            )
+        else:
+            r = cls(relay, None, None, None, t=columns.time[i])
+        if fp not in results:
+            results[fp] = []
+        results[fp].append(r)
+    return results
+
+
+def load_recent_results(
+    fresh_days,
+    datadir,
+    success_only=False,
+    use_index=False,
+    use_columns=False,
+    jobs=1,
+    results_db=None,
+):
+    """Load the recent results from the SQLite database ``results_db`` when
+    it is given, from the results columns when ``use_columns`` is True and
+    there are columns for all the days, otherwise from the JSON result files
+    with :func:`load_recent_results_in_datadir`.
+
+    The results read from the columns only have the attributes stored in the
+    columns.
+    """
+    if results_db is not None:
+        # resultstore depends on this module.
+        from sbws.lib.resultstore import ResultStore
+
+        store = ResultStore(results_db)
+        try:
+            return store.load_recent_results(fresh_days, success_only)
+        finally:
+            store.close()
+    if use_columns:
+        columns = load_recent_columns_in_datadir(fresh_days, datadir)
+        if columns is not None:
+            return result_dict_from_columns(columns, success_only)
+    return load_recent_results_in_datadir(
+        fresh_days,
+        datadir,
+        success_only=success_only,
+        use_index=use_index,
+        jobs=jobs,
+    )
+
+
 def write_result_to_datadir(result, datadir):
     """Can be called from any thread"""
     dt = datetime.utcfromtimestamp(result.time)
@@ -204,6 +693,186 @@ def write_result_to_datadir(result, datadir):
         )
 
 
+# The relay counters stored in the results, which are written as deltas.
+RESULT_COUNTERS = (
+    "relay_in_recent_consensus",
+    "relay_recent_measurement_attempt",
+    "relay_recent_priority_list",
+    "xoff_recv",
+    "xoff_sent",
+)
+
+
+class ResultFileWriter:
+    """Write results to the day result files in ``datadir`` in batches.
+
+    The results are buffered until :meth:`flush` is called, then they are
+    all written under one :class:`~sbws.util.filelock.DirectoryLock`.
+    The file of the current day is kept open between batches.
+
+    The relay counters of a result only contain the timestamps that were not
+    written in a previous result of the same relay in the same file, so
+    the readers have to join them.
+
+    :param str datadir: the directory where to write the result files.
+    :param str durability: ``flush`` to flush the results to the operating
+        system in every batch, or ``fsync`` to also wait for them to be
+        written to disk.
+    """
+
+    def __init__(self, datadir, durability="flush"):
+        self.datadir = datadir
+        self.durability = durability
+        self._pending = []
+        self._fname = None
+        self._fd = None
+        # The file of the last written result and the last timestamp of
+        # every relay counter written in it.
+        self._counters_fname = None
+        self._last_counters = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def write(self, result):
+        """Add a result to the next batch."""
+        dt = datetime.utcfromtimestamp(result.time)
+        fname = os.path.join(self.datadir, "{}.txt".format(dt.date()))
+        if fname != self._counters_fname:
+            self._counters_fname = fname
+            self._last_counters = {}
+        d = result.to_dict()
+        self._remove_written_counters(d)
+        self._pending.append(
+            (fname, "{}\n".format(json.dumps(d, cls=CustomEncoder)))
+        )
+
+    def _remove_written_counters(self, d):
+        """Remove from the relay counters of a result dictionary the
+        timestamps already written for the relay in the current file.
+
+        The timestamps are only appended to the counters, so only the last
+        timestamp written of every counter is kept.
+        """
+        fp = d["fingerprint"]
+        for key in RESULT_COUNTERS:
+            timestamps = d.get(key)
+            if timestamps is None:
+                continue
+            if isinstance(timestamps, DateTimeSeq):
+                timestamps = timestamps.list()
+            timestamps = [
+                dt.replace(microsecond=0) if isinstance(dt, datetime) else dt
+                for dt in timestamps
+            ]
+            last = self._last_counters.get((fp, key))
+            if last is not None:
+                try:
+                    timestamps = [dt for dt in timestamps if dt > last]
+                except TypeError:
+                    pass
+            if timestamps:
+                self._last_counters[(fp, key)] = timestamps[-1]
+            d[key] = timestamps
+
+    def _close_file(self):
+        if self._fd is None:
+            return
+        self._fd.flush()
+        if self.durability == "fsync":
+            os.fsync(self._fd.fileno())
+        self._fd.close()
+        self._fd = None
+        self._fname = None
+
+    def _open_file(self, fname):
+        if self._fd is not None and self._fname != fname:
+            self._close_file()
+        if self._fd is None:
+            log.debug("Opening result file %s", fname)
+            self._fd = open(fname, "at")
+            self._fname = fname
+        return self._fd
+
+    def flush(self):
+        """Write the pending results."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        try:
+            with DirectoryLock(self.datadir):
+                # The file might have been removed or compressed.
+                if (
+                    self._fd is not None
+                    and os.fstat(self._fd.fileno()).st_nlink == 0
+                ):
+                    self._close_file()
+                    self._counters_fname = None
+                log.debug("Writing %d results.", len(pending))
+                for fname, line in pending:
+                    self._open_file(fname).write(line)
+                self._fd.flush()
+                if self.durability == "fsync":
+                    os.fsync(self._fd.fileno())
+        # Catch any exception writing.
+        except Exception as e:
+            log.error(
+                "Can not write to datadir %s: %s. "
+                "Please check that there is enough space in disk "
+                "and the directory has the correct permissions.",
+                self.datadir,
+                e,
+            )
+            # Open the file again in the next batch, and write the counters
+            # again, since they might not have been written.
+            self._counters_fname = None
+            if self._fd is not None and not self._fd.closed:
+                try:
+                    self._fd.close()
+                except OSError:
+                    pass
+            self._fd = None
+            self._fname = None
+
+    def close(self):
+        """Write the pending results and close the current file."""
+        self.flush()
+        try:
+            self._close_file()
+        except OSError as e:
+            log.error("Can not close result file %s: %s", self._fname, e)
+
+
+def _intern(value):
+    """Intern the strings repeated in many results, as fingerprints, so that
+    the results share them."""
+    return sys.intern(value) if type(value) is str else value
+
+
+def _compact_timestamps(timestamps):
+    """Return a list of datetimes, as read from a result file, as an array
+    of integer epoch seconds.
+
+    Other sequences, as the ``DateTimeSeq`` shared with a
+    :class:`~sbws.lib.relaylist.Relay`, are returned unchanged.
+    """
+    if type(timestamps) is not list or not all(
+        isinstance(dt, datetime) for dt in timestamps
+    ):
+        return timestamps
+    return array(
+        "q", [calendar.timegm(dt.utctimetuple()) for dt in timestamps]
+    )
+
+
+def _expand_timestamps(timestamps):
+    """Return the timestamps stored by :func:`_compact_timestamps` as a list
+    of datetimes."""
+    if type(timestamps) is array:
+        return [datetime.utcfromtimestamp(ts) for ts in timestamps]
+    return timestamps
+
+
 class _StrEnum(str, Enum):
     pass
 
@@ -237,8 +906,29 @@ class Result:
         .. note:: in a future refactor it would be simpler if a ``Relay`` has
            measurements and a measurement has a relay,
            instead of every measurement re-implementing ``Relay``.
+
+        Since there are many results in memory, the attributes are slots,
+        the strings are interned and the timestamps lists are stored as
+        arrays of epoch seconds.
         """
 
+        __slots__ = (
+            "fingerprint",
+            "nickname",
+            "address",
+            "master_key_ed25519",
+            "average_bandwidth",
+            "burst_bandwidth",
+            "observed_bandwidth",
+            "consensus_bandwidth",
+            "consensus_bandwidth_is_unmeasured",
+            "relay_in_recent_consensus",
+            "relay_recent_measurement_attempt",
+            "relay_recent_priority_list",
+            "xoff_recv",
+            "xoff_sent",
+        )
+
         def __init__(
             self,
             fingerprint,
@@ -267,10 +957,10 @@ class Result:
                :class:`~sbws.lib.v3bwfile.V3BWLine` and there should not be
                repeated in every class.
             """
-            self.fingerprint = fingerprint
-            self.nickname = nickname
-            self.address = address
-            self.master_key_ed25519 = master_key_ed25519
+            self.fingerprint = _intern(fingerprint)
+            self.nickname = _intern(nickname)
+            self.address = _intern(address)
+            self.master_key_ed25519 = _intern(master_key_ed25519)
             self.average_bandwidth = average_bandwidth
             self.burst_bandwidth = burst_bandwidth
             self.observed_bandwidth = observed_bandwidth
@@ -278,38 +968,49 @@ class Result:
             self.consensus_bandwidth_is_unmeasured = (
                 consensus_bandwidth_is_unmeasured
             )
-            self.relay_in_recent_consensus = relay_in_recent_consensus
-            self.relay_recent_measurement_attempt = (
+            self.relay_in_recent_consensus = _compact_timestamps(
+                relay_in_recent_consensus
+            )
+            self.relay_recent_measurement_attempt = _compact_timestamps(
                 relay_recent_measurement_attempt
             )
-            self.relay_recent_priority_list = relay_recent_priority_list
-            self.xoff_recv = xoff_recv
-            self.xoff_sent = xoff_sent
+            self.relay_recent_priority_list = _compact_timestamps(
+                relay_recent_priority_list
+            )
+            self.xoff_recv = _compact_timestamps(xoff_recv)
+            self.xoff_sent = _compact_timestamps(xoff_sent)
+
+    __slots__ = ("_relay", "_circ", "_dest_url", "_scanner", "_time")
 
     def __init__(self, relay, circ, dest_url, scanner_nick, t=None):
         """
         Initializes the measurement and the relay with all the relay
         attributes.
         """
-        self._relay = Result.Relay(
-            relay.fingerprint,
-            relay.nickname,
-            relay.address,
-            relay.master_key_ed25519,
-            relay.average_bandwidth,
-            relay.burst_bandwidth,
-            relay.observed_bandwidth,
-            relay.consensus_bandwidth,
-            relay.consensus_bandwidth_is_unmeasured,
-            relay.relay_in_recent_consensus,
-            relay.relay_recent_measurement_attempt,
-            relay.relay_recent_priority_list,
-            relay.xoff_recv,
-            relay.xoff_sent,
-        )
-        self._circ = circ
-        self._dest_url = dest_url
-        self._scanner = scanner_nick
+        # A Result.Relay is only created for this result when reading it, so
+        # there is no need to copy it.
+        if isinstance(relay, Result.Relay):
+            self._relay = relay
+        else:
+            self._relay = Result.Relay(
+                relay.fingerprint,
+                relay.nickname,
+                relay.address,
+                relay.master_key_ed25519,
+                relay.average_bandwidth,
+                relay.burst_bandwidth,
+                relay.observed_bandwidth,
+                relay.consensus_bandwidth,
+                relay.consensus_bandwidth_is_unmeasured,
+                relay.relay_in_recent_consensus,
+                relay.relay_recent_measurement_attempt,
+                relay.relay_recent_priority_list,
+                relay.xoff_recv,
+                relay.xoff_sent,
+            )
+        self._circ = circ if circ is None else list(map(_intern, circ))
+        self._dest_url = _intern(dest_url)
+        self._scanner = _intern(scanner_nick)
         self._time = time.time() if t is None else t
 
     @property
@@ -355,7 +1056,7 @@ class Result:
     @property
     def relay_in_recent_consensus(self):
         """Number of times the relay was in a consensus."""
-        return self._relay.relay_in_recent_consensus
+        return _expand_timestamps(self._relay.relay_in_recent_consensus)
 
     @property
     def relay_recent_measurement_attempt(self):
@@ -364,7 +1065,7 @@ class Result:
         It is initialized in :class:`~sbws.lib.relaylist.Relay` and
         incremented in :func:`~sbws.core.scanner.main_loop`.
         """
-        return self._relay.relay_recent_measurement_attempt
+        return _expand_timestamps(self._relay.relay_recent_measurement_attempt)
 
     @property
     def relay_recent_priority_list(self):
@@ -373,15 +1074,15 @@ class Result:
         It is initialized in :class:`~sbws.lib.relaylist.Relay` and
         incremented in :func:`~sbws.core.scanner.main_loop`.
         """
-        return self._relay.relay_recent_priority_list
+        return _expand_timestamps(self._relay.relay_recent_priority_list)
 
     @property
     def xoff_recv(self):
-        return self._relay.xoff_recv
+        return _expand_timestamps(self._relay.xoff_recv)
 
     @property
     def xoff_sent(self):
-        return self._relay.xoff_sent
+        return _expand_timestamps(self._relay.xoff_sent)
 
     @property
     def circ(self):
@@ -428,7 +1129,8 @@ class Result:
         Returns a :class:`~sbws.lib.resultdump.Result` subclass from a
         dictionary.
 
-        Returns None if the ``version`` attribute is not
+        Returns None if the ``version`` attribute is not between
+        :const:`~sbws.globals.RESULT_MIN_VERSION` and
         :const:`~sbws.globals.RESULT_VERSION`
 
         It raises ``NotImplementedError`` when the dictionary ``type`` can not
@@ -439,7 +1141,7 @@ class Result:
 
            ``version`` is not being used and should be removed.
         """
-        if d["version"] != RESULT_VERSION:
+        if not RESULT_MIN_VERSION <= d["version"] <= RESULT_VERSION:
             return None
         if d["type"] == _ResultType.Success.value:
             return ResultSuccess.from_dict(d)
@@ -465,6 +1167,8 @@ class Result:
 
 
 class ResultError(Result):
+    __slots__ = ("_msg",)
+
     def __init__(self, *a, msg=None, **kw):
         super().__init__(*a, **kw)
         self._msg = msg
@@ -528,6 +1232,8 @@ class ResultError(Result):
 
 
 class ResultErrorCircuit(ResultError):
+    __slots__ = ()
+
     def __init__(self, *a, **kw):
         super().__init__(*a, **kw)
 
@@ -583,6 +1289,8 @@ class ResultErrorCircuit(ResultError):
 
 
 class ResultErrorStream(ResultError):
+    __slots__ = ()
+
     def __init__(self, *a, **kw):
         super().__init__(*a, **kw)
 
@@ -643,6 +1351,8 @@ class ResultErrorSecondRelay(ResultError):
        and assign the type in the ``scanner`` module.
     """
 
+    __slots__ = ()
+
     def __init__(self, *a, **kw):
         super().__init__(*a, **kw)
 
@@ -696,6 +1406,8 @@ class ResultErrorDestination(ResultError):
        and assign the type in the ``scanner`` module.
     """
 
+    __slots__ = ()
+
     def __init__(self, *a, **kw):
         super().__init__(*a, **kw)
 
@@ -736,6 +1448,8 @@ class ResultErrorDestination(ResultError):
 
 
 class ResultErrorAuth(ResultError):
+    __slots__ = ()
+
     def __init__(self, *a, **kw):
         super().__init__(*a, **kw)
 
@@ -789,6 +1503,8 @@ class ResultErrorAuth(ResultError):
 
 
 class ResultSuccess(Result):
+    __slots__ = ("_rtts", "_downloads")
+
     def __init__(self, rtts, downloads, *a, **kw):
         super().__init__(*a, **kw)
         self._rtts = rtts
@@ -855,6 +1571,145 @@ class ResultSuccess(Result):
         return d
 
 
+class RelayPriorityIndex:
+    """Priority of the relays to be measured, updated every time the results
+    of a relay change.
+
+    The priority of a relay is the sum of the freshness of its results, ie.
+    the time until every result is older than ``fresh_seconds``, as it was
+    calculated by
+    :meth:`~sbws.lib.relayprioritizer.RelayPrioritizer.best_priority`.
+    The relays with the smallest priority are the best ones to be measured.
+
+    At a time ``now``, the priority of a relay with results at times ``t``
+    and weights ``w`` is ``sum(w * t) - (now - fresh_seconds) * sum(w)``, so
+    it decreases linearly with time. The relays with the same ``sum(w)``
+    keep their order while time passes, so there is a heap of relays by
+    ``sum(w * t)`` for every ``sum(w)``, and the best relays are obtained
+    merging the heaps at ``now``, without calculating the priority of all
+    the relays.
+
+    :param int fresh_seconds: the time after which a result is too old.
+    :param bool prioritize_result_error: whether the freshness of the
+        :class:`ResultError` is reduced by their
+        :attr:`~ResultError.freshness_reduction_factor`.
+    """
+
+    def __init__(self, fresh_seconds, prioritize_result_error=False):
+        self.fresh_seconds = fresh_seconds
+        self.prioritize_result_error = prioritize_result_error
+        # [sum(w * t), counter, fingerprint, sum(w)] by relay fingerprint.
+        # The fingerprint is set to None when the entry is removed from the
+        # heap.
+        self._entries = {}
+        # Heaps of entries by sum(w).
+        self._heaps = {}
+        self._num_removed = 0
+        self._counter = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, fingerprint):
+        return fingerprint in self._entries
+
+    def _weight(self, result):
+        if self.prioritize_result_error and isinstance(result, ResultError):
+            return max(1.0 - result.freshness_reduction_factor, 0)
+        return 1
+
+    def update(self, fingerprint, results):
+        """Set the priority of a relay from its fresh ``results``.
+
+        The relays without results are removed.
+        """
+        entry = self._entries.pop(fingerprint, None)
+        if entry is not None:
+            entry[2] = None
+            self._num_removed += 1
+        if results:
+            sum_weights = 0
+            sum_times = 0
+            for result in results:
+                weight = self._weight(result)
+                sum_weights += weight
+                sum_times += weight * result.time
+            self._counter += 1
+            entry = [sum_times, self._counter, fingerprint, sum_weights]
+            self._entries[fingerprint] = entry
+            heapq.heappush(self._heaps.setdefault(sum_weights, []), entry)
+        if self._num_removed > max(len(self._entries), 1000):
+            self._compact()
+
+    def _compact(self):
+        """Remove the entries of the relays that were updated from the
+        heaps."""
+        self._heaps = {}
+        for entry in self._entries.values():
+            self._heaps.setdefault(entry[3], []).append(entry)
+        for heap in self._heaps.values():
+            heapq.heapify(heap)
+        self._num_removed = 0
+
+    def _top(self, sum_weights):
+        """Return the first entry of a heap that was not removed, or None."""
+        heap = self._heaps[sum_weights]
+        while heap and heap[0][2] is None:
+            heapq.heappop(heap)
+            self._num_removed -= 1
+        if not heap:
+            del self._heaps[sum_weights]
+            return None
+        return heap[0]
+
+    def priority(self, fingerprint, now=None):
+        """Return the priority of a relay, 0 if it does not have results."""
+        entry = self._entries.get(fingerprint)
+        if entry is None:
+            return 0
+        now = time.time() if now is None else now
+        return entry[0] - (now - self.fresh_seconds) * entry[3]
+
+    def best(self, num_relays, fingerprints=None, now=None):
+        """Return the ``num_relays`` relays with the smallest priority.
+
+        :param int num_relays: the maximum number of relays to return.
+        :param fingerprints: if given, only the relays with these
+            fingerprints are returned.
+        :param float now: the time at which the priority is calculated.
+        :returns: a list of (priority, fingerprint), ordered by priority.
+        """
+        now = time.time() if now is None else now
+        oldest_allowed = now - self.fresh_seconds
+        # The first entry of every heap, by its priority at ``now``.
+        merged = []
+        for sum_weights in list(self._heaps):
+            entry = self._top(sum_weights)
+            if entry is not None:
+                merged.append(
+                    (entry[0] - oldest_allowed * sum_weights, entry[1], entry)
+                )
+        heapq.heapify(merged)
+        best = []
+        popped = []
+        while merged and len(best) < num_relays:
+            priority, _, entry = heapq.heappop(merged)
+            sum_weights = entry[3]
+            popped.append(heapq.heappop(self._heaps[sum_weights]))
+            if fingerprints is None or entry[2] in fingerprints:
+                best.append((priority, entry[2]))
+            entry = self._top(sum_weights)
+            if entry is not None:
+                heapq.heappush(
+                    merged,
+                    (entry[0] - oldest_allowed * sum_weights, entry[1], entry),
+                )
+        # The relays are not removed, push them back.
+        for entry in popped:
+            heapq.heappush(self._heaps.setdefault(entry[3], []), entry)
+        return best
+
+
 class ResultDump:
     """Runs the enter() method in a new thread and collects new Results on its
     queue. Writes them to daily result files in the data directory"""
@@ -863,7 +1718,30 @@ class ResultDump:
         self.conf = conf
         self.fresh_days = conf.getint("general", "data_period")
         self.datadir = conf.getpath("paths", "datadir")
+        self.flush_interval = conf.getfloat(
+            "general", "results_flush_interval"
+        )
+        durability = conf.get("general", "results_durability")
+        if conf.get("general", "results_backend") == "sqlite":
+            # resultstore depends on this module.
+            from sbws.lib.resultstore import ResultStore
+
+            self.writer = ResultStore(
+                conf.getpath("paths", "results_db"), durability
+            )
+        else:
+            self.writer = ResultFileWriter(self.datadir, durability)
+        self.columns_writer = None
+        if conf.getboolean("general", "columnar_results"):
+            self.columns_writer = ColumnarResultWriter(self.datadir)
+        # Results by relay fingerprint, every list ordered by time.
         self.data = {}
+        # (time, fingerprint) of every result in ``data``, to find the next
+        # results to expire without looking at all the relays.
+        self._expiry_heap = []
+        # RelayPriorityIndex by ``prioritize_result_error``, created the
+        # first time that they are needed.
+        self._priority_indexes = {}
         self.data_lock = RLock()
         self.thread = Thread(target=self.enter)
         self.queue = Queue()
@@ -872,14 +1750,98 @@ class ResultDump:
         except RuntimeError as e:
             fail_hard(e)
 
+    def set_data(self, result_dict):
+        """Replace the stored results by the ones in ``result_dict``."""
+        with self.data_lock:
+            self.data = {}
+            for fp, results in result_dict.items():
+                if results:
+                    self.data[fp] = sorted(results, key=lambda r: r.time)
+            self._expiry_heap = [
+                (r.time, fp)
+                for fp, results in self.data.items()
+                for r in results
+            ]
+            heapq.heapify(self._expiry_heap)
+            self.expire_results()
+            self._priority_indexes = {
+                prioritize_result_error: self._new_priority_index(
+                    prioritize_result_error
+                )
+                for prioritize_result_error in self._priority_indexes
+            }
+
+    def expire_results(self):
+        """Remove the results older than ``fresh_days``.
+
+        Only the relays that have results to expire are visited.
+        """
+        oldest_allowed = time.time() - self.fresh_days * 24 * 60 * 60
+        with self.data_lock:
+            heap = self._expiry_heap
+            expired_fps = set()
+            while heap and heap[0][0] < oldest_allowed:
+                _, fp = heapq.heappop(heap)
+                results = self.data.get(fp)
+                if results is None:
+                    continue
+                expired_fps.add(fp)
+                num_old = 0
+                while (
+                    num_old < len(results)
+                    and results[num_old].time < oldest_allowed
+                ):
+                    num_old += 1
+                # Modify the list in place, since it might have been returned
+                # by ``results_for_relay``.
+                del results[:num_old]
+                if not results:
+                    del self.data[fp]
+            for fp in expired_fps:
+                self._update_priority(fp)
+
+    def _update_priority(self, fp):
+        """Update the priority of a relay in the priority indexes."""
+        for index in self._priority_indexes.values():
+            index.update(fp, self.data.get(fp))
+
+    def _new_priority_index(self, prioritize_result_error):
+        index = RelayPriorityIndex(
+            self.fresh_days * 24 * 60 * 60, prioritize_result_error
+        )
+        for fp, results in self.data.items():
+            index.update(fp, results)
+        return index
+
+    def priority_index(self, prioritize_result_error=False):
+        """Return the :class:`RelayPriorityIndex` of the stored results.
+
+        The index is updated every time a result is stored or expired, so
+        it must only be used while holding ``data_lock``.
+        """
+        with self.data_lock:
+            index = self._priority_indexes.get(prioritize_result_error)
+            if index is None:
+                index = self._new_priority_index(prioritize_result_error)
+                self._priority_indexes[prioritize_result_error] = index
+            return index
+
     def store_result(self, result):
         """Call from ResultDump thread"""
         with self.data_lock:
             fp = result.fingerprint
             if fp not in self.data:
                 self.data[fp] = []
-            self.data[fp].append(result)
-            self.data = trim_results(self.fresh_days, self.data)
+            results = self.data[fp]
+            # Results arrive mostly in time order, so this rarely needs to
+            # look at more than the last result.
+            i = len(results)
+            while i > 0 and results[i - 1].time > result.time:
+                i -= 1
+            results.insert(i, result)
+            heapq.heappush(self._expiry_heap, (result.time, fp))
+            self.expire_results()
+            self._update_priority(fp)
             # Not calling trim_results_ip_changed here to do not remove
             # the results for a relay that has changed address.
             # It will be called when loading the results to generate a v3bw
@@ -899,7 +1861,9 @@ class ResultDump:
             )
             return
         self.store_result(result)
-        write_result_to_datadir(result, self.datadir)
+        self.writer.write(result)
+        if self.columns_writer is not None:
+            self.columns_writer.write(result)
         if result.type == "success":
             msg = (
                 "Success measuring {} ({}) via circuit {} and "
@@ -942,15 +1906,36 @@ class ResultDump:
         # heartbeat msg to indicate progress.
         log.debug(msg)
 
+    def handle_event(self, event):
+        """Call from ResultDump thread with every item got from the queue."""
+        data = event
+        if data is None:
+            log.debug("Got None in ResultDump")
+        elif isinstance(data, list):
+            for r in data:
+                self.handle_result(r)
+        elif isinstance(data, Result):
+            self.handle_result(data)
+        else:
+            log.warning(
+                "The only thing we should ever receive in the "
+                "result thread is a Result or list of Results. "
+                "Ignoring %s",
+                type(data),
+            )
+
     def enter(self):
         """Main loop for the ResultDump thread.
 
         When there are results in the queue, queue.get will get them until
         there are not anymore or timeout happen.
 
-        For every result it gets, it process it and store in the filesystem,
-        which takes ~1 millisecond and will not trigger the timeout.
-        It can then store in the filesystem ~1000 results per second.
+        Every time it gets a result, it also gets all the other results that
+        are already in the queue and process them as a batch.
+        The results are written to the filesystem when
+        ``results_flush_interval`` seconds passed since the last write or
+        when there are not more results in the queue, so that a file lock is
+        taken once per batch instead of once per result.
 
         I does not accept any other data type than Results or list of Results,
         therefore is not possible to put big data types in the queue.
@@ -960,34 +1945,40 @@ class ResultDump:
 
         """
         with self.data_lock:
-            self.data = load_recent_results_in_datadir(
-                self.fresh_days, self.datadir
-            )
+            if isinstance(self.writer, ResultFileWriter):
+                # The RelayPrioritizer only needs the columns' attributes.
+                self.set_data(
+                    load_recent_results(
+                        self.fresh_days,
+                        self.datadir,
+                        use_columns=self.columns_writer is not None,
+                    )
+                )
+            else:
+                self.set_data(self.writer.load_recent_results(self.fresh_days))
+        last_flush = time.monotonic()
         while not (settings.end_event.is_set() and self.queue.empty()):
             try:
-                event = self.queue.get(timeout=1)
+                self.handle_event(self.queue.get(timeout=1))
             except Empty:
+                # Nothing else to do, write the pending results.
+                self.writer.flush()
+                last_flush = time.monotonic()
                 continue
-            data = event
-            if data is None:
-                log.debug("Got None in ResultDump")
-                continue
-            elif isinstance(data, list):
-                for r in data:
-                    self.handle_result(r)
-            elif isinstance(data, Result):
-                self.handle_result(data)
-            else:
-                log.warning(
-                    "The only thing we should ever receive in the "
-                    "result thread is a Result or list of Results. "
-                    "Ignoring %s",
-                    type(data),
-                )
+            while True:
+                try:
+                    self.handle_event(self.queue.get_nowait())
+                except Empty:
+                    break
+            if time.monotonic() - last_flush >= self.flush_interval:
+                self.writer.flush()
+                last_flush = time.monotonic()
+        self.writer.close()
 
     def results_for_relay(self, relay):
         fp = relay.fingerprint
         with self.data_lock:
+            self.expire_results()
             if fp not in self.data:
                 return []
             return self.data[fp]
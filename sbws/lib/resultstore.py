@@ -0,0 +1,256 @@
+"""Storage of the results in a SQLite database.
+
+Optionally, instead of the day files in the datadir, the results are stored
+in a SQLite database, indexed by relay and time, so that reading the recent
+results or the history of a relay does not need to read all the results.
+
+The relay counters, as ``relay_in_recent_consensus``, are stored once per
+relay and timestamp in a separate table, instead of in every result.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+from sbws.lib.resultdump import (
+    RESULT_COUNTERS,
+    Result,
+    iter_result_file,
+    trim_results_ip_changed,
+)
+from sbws.util.json import CustomEncoder, decode_timestamp, loads
+from sbws.util.timestamps import DateTimeSeq
+
+log = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    fingerprint TEXT NOT NULL,
+    time REAL NOT NULL,
+    type TEXT NOT NULL,
+    result TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS results_fingerprint_time
+    ON results (fingerprint, time, type);
+CREATE INDEX IF NOT EXISTS results_time ON results (time);
+CREATE TABLE IF NOT EXISTS relay_counters (
+    fingerprint TEXT NOT NULL,
+    name TEXT NOT NULL,
+    time TEXT NOT NULL,
+    PRIMARY KEY (fingerprint, name, time)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS relay_counters_time ON relay_counters (time);
+"""
+
+
+def _isostr(dt):
+    return dt.replace(microsecond=0).isoformat()
+
+
+class ResultStore:
+    """Results stored in the SQLite database ``fname``.
+
+    It can be used as the :class:`~sbws.lib.resultdump.ResultDump` writer:
+    the results are buffered by :meth:`write` and stored in one transaction
+    by :meth:`flush`.
+
+    The database is in WAL mode, so that it can be read by ``sbws generate``
+    and ``sbws stats`` while the scanner writes to it.
+
+    :param str fname: the path of the database.
+    :param str durability: ``flush`` to only wait for the operating system
+        to write the transactions, or ``fsync`` to wait for them to be
+        written to disk.
+    """
+
+    def __init__(self, fname, durability="flush"):
+        self.fname = fname
+        self.durability = durability
+        self._pending = []
+        self._conn = None
+
+    @property
+    def conn(self):
+        # Connect on first use, so that the connection is created in the
+        # ResultDump thread.
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.fname) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.fname, timeout=60)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "PRAGMA synchronous={}".format(
+                    "FULL" if self.durability == "fsync" else "NORMAL"
+                )
+            )
+            with self._conn:
+                self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def __len__(self):
+        return len(self._pending)
+
+    def write(self, result):
+        """Add a result to the next transaction."""
+        self._pending.append(result)
+
+    def flush(self):
+        """Store the pending results."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        try:
+            self._insert(pending)
+        # Catch any exception writing, as ResultFileWriter.
+        except Exception as e:
+            log.error("Can not write results to %s: %s.", self.fname, e)
+
+    def close(self):
+        """Store the pending results and close the database."""
+        self.flush()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _insert(self, results):
+        rows = []
+        counters = []
+        for result in results:
+            d = result.to_dict()
+            for name in RESULT_COUNTERS:
+                timestamps = d.pop(name, None) or []
+                if isinstance(timestamps, DateTimeSeq):
+                    timestamps = timestamps.list()
+                counters.extend(
+                    (result.fingerprint, name, _isostr(dt))
+                    for dt in timestamps
+                    if isinstance(dt, datetime)
+                )
+            rows.append(
+                (
+                    result.fingerprint,
+                    result.time,
+                    result.type,
+                    json.dumps(d, cls=CustomEncoder),
+                )
+            )
+        log.debug("Storing %d results.", len(rows))
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO results VALUES (?, ?, ?, ?)", rows
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO relay_counters VALUES (?, ?, ?)",
+                counters,
+            )
+
+    def _counters(self, oldest_allowed, fingerprint=None):
+        """Return the relay counters newer than ``oldest_allowed`` by relay
+        fingerprint and counter name."""
+        query = "SELECT fingerprint, name, time FROM relay_counters"
+        query += " WHERE time >= ?"
+        params = [_isostr(datetime.utcfromtimestamp(oldest_allowed))]
+        if fingerprint is not None:
+            query += " AND fingerprint = ?"
+            params.append(fingerprint)
+        counters = {}
+        for fp, name, ts in self.conn.execute(
+            query + " ORDER BY time", params
+        ):
+            counters.setdefault(fp, {}).setdefault(name, []).append(
+                decode_timestamp(ts)
+            )
+        return counters
+
+    def _results(self, query, params, counters):
+        """Return the results of ``query`` by relay fingerprint.
+
+        The last result of every relay has its ``counters``.
+        """
+        dicts = {}
+        for fp, line in self.conn.execute(query, params):
+            dicts.setdefault(fp, []).append(loads(line))
+        results = {}
+        for fp, ds in dicts.items():
+            ds[-1].update(counters.get(fp, {}))
+            results[fp] = [
+                r for r in map(Result.from_dict, ds) if r is not None
+            ]
+        return results
+
+    def load_recent_results(
+        self,
+        fresh_days,
+        success_only=False,
+        on_changed_ipv4=False,
+        on_changed_ipv6=False,
+    ):
+        """Return the results of the last ``fresh_days`` by relay
+        fingerprint, as
+        :func:`~sbws.lib.resultdump.load_recent_results_in_datadir`.
+        """
+        log.info("Reading and processing previous measurements.")
+        oldest_allowed = time.time() - fresh_days * 24 * 60 * 60
+        query = "SELECT fingerprint, result FROM results WHERE time >= ?"
+        if success_only:
+            query += " AND type = 'success'"
+        results = self._results(
+            query + " ORDER BY time",
+            [oldest_allowed],
+            self._counters(oldest_allowed),
+        )
+        results = trim_results_ip_changed(
+            results, on_changed_ipv4, on_changed_ipv6
+        )
+        num_res = sum(len(r) for r in results.values())
+        log.info("Read %d results from %s.", num_res, self.fname)
+        return results
+
+    def relay_results(self, fingerprint, start=None, end=None):
+        """Return the results of a relay between the ``start`` and ``end``
+        timestamps, ordered by time."""
+        start = 0 if start is None else start
+        end = time.time() if end is None else end
+        return self._results(
+            "SELECT fingerprint, result FROM results"
+            " WHERE fingerprint = ? AND time BETWEEN ? AND ? ORDER BY time",
+            [fingerprint, start, end],
+            self._counters(start, fingerprint),
+        ).get(fingerprint, [])
+
+    def delete_older_than(self, days):
+        """Delete the results and relay counters older than ``days``.
+
+        :returns: the number of results deleted.
+        """
+        oldest = time.time() - days * 24 * 60 * 60
+        with self.conn:
+            deleted = self.conn.execute(
+                "DELETE FROM results WHERE time < ?", [oldest]
+            ).rowcount
+            self.conn.execute(
+                "DELETE FROM relay_counters WHERE time < ?",
+                [_isostr(datetime.utcfromtimestamp(oldest))],
+            )
+        return deleted
+
+    def import_result_file(self, fname):
+        """Store the results in the result file ``fname``.
+
+        The results already stored, with the same relay, time and type, are
+        ignored.
+
+        :returns: the number of results read.
+        """
+        num_results = 0
+        for result in iter_result_file(fname):
+            self.write(result)
+            num_results += 1
+            if len(self) >= 1000:
+                self._insert(self._pending)
+                self._pending = []
+        self._insert(self._pending)
+        self._pending = []
+        return num_results
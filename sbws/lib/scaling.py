@@ -1,4 +1,9 @@
-from statistics import mean
+import logging
+from statistics import mean, median
+
+from sbws.globals import TORFLOW_BW_MARGIN, TORFLOW_OBS_LAST, TORFLOW_OBS_MEAN
+
+log = logging.getLogger(__name__)
 
 
 def bw_measurements_from_results(results):
@@ -7,11 +12,16 @@ def bw_measurements_from_results(results):
     ]
 
 
-def bw_filt(bw_measurements):
-    """Filtered bandwidth for a relay.
+def bw_stats(bw_measurements):
+    """Median, mean and filtered mean bandwidth for a relay.
 
-    It is the equivalent to Torflow's ``filt_sbw``.
-    ``mu`` in this function is the equivalent to Torflow's ``sbw``.
+    They are the values of
+    :meth:`~sbws.lib.v3bwfile.V3BWLine.bw_median_from_results`,
+    :meth:`~sbws.lib.v3bwfile.V3BWLine.bw_mean_from_results` and
+    :func:`bw_filt`, calculated from the same measurements and computing the
+    mean only once.
+
+    :returns: a tuple with ``bw_median``, ``bw_mean`` and ``bw_filt``.
     """
     # It's safe to return 0 here, because:
     # 1. this value will be the numerator when calculating the ratio.
@@ -19,11 +29,132 @@ def bw_filt(bw_measurements):
     # This should never be the case, as the measurements come from successful
     # results.
     if not bw_measurements:
-        return 0
+        return 1, 0, 0
     # Torflow is rounding to an integer, so is `bw_mean_from_results` in
     # `v3bwfile.py`
     mu = round(mean(bw_measurements))
-    bws_gte_mean = list(filter(lambda bw: bw >= mu, bw_measurements))
-    if bws_gte_mean:
-        return round(mean(bws_gte_mean))
-    return mu
+    bws_gte_mean = [bw for bw in bw_measurements if bw >= mu]
+    muf = round(mean(bws_gte_mean)) if bws_gte_mean else mu
+    return max(round(median(bw_measurements)), 1), mu, muf
+
+
+def bw_filt(bw_measurements):
+    """Filtered bandwidth for a relay.
+
+    It is the equivalent to Torflow's ``filt_sbw``.
+    ``mu`` in this function is the equivalent to Torflow's ``sbw``.
+    """
+    return bw_stats(bw_measurements)[2]
+
+
+def torflow_scale(
+    bw_mean,
+    bw_filt,
+    desc_bw_obs_last,
+    desc_bw_obs_mean,
+    desc_bw_avg,
+    desc_bw_bur,
+    bw,
+    in_consensus=None,
+    desc_bw_obs_type=TORFLOW_OBS_MEAN,
+    cap=TORFLOW_BW_MARGIN,
+):
+    """Torflow's scaling of the relays' bandwidth.
+
+    Every argument but the last three is a column with a value per relay, in
+    the same order.
+    The descriptor bandwidths can be None.
+
+    See details in :ref:`torflow_aggr`.
+
+    :param list bw: the bandwidth of the relays that can not be scaled
+        because their descriptor observed bandwidth is not known.
+    :param list in_consensus: whether the relays are in the last consensus,
+        only the bandwidth of those relays is summed to cap the bandwidth.
+        If None, all the relays are summed.
+    :returns: a tuple with the column of scaled and capped bandwidths in
+        bytes, not yet rounded, the columns of ``r_strm`` and
+        ``r_strm_filt`` ratios, None for the relays not scaled, and the mean
+        (Torflow's ``strm_avg``) and filtered mean (Torflow's ``filt_avg``)
+        of all the relays.
+    """
+    # mean (Torflow's strm_avg)
+    mu = mean(bw_mean)
+    # filtered mean (Torflow's filt_avg)
+    muf = mean(bw_filt)
+    log.debug("mu %i bytes.", mu)
+    log.debug("muf %i bytes.", muf)
+
+    # First, obtain the observed bandwidth, later check what to do if it is
+    # 0 or None.
+    if desc_bw_obs_type == TORFLOW_OBS_LAST:
+        # In case there's no last, use the mean, because it is possible that
+        # it went down for a few days, but no more than 5, otherwise the mean
+        # will be 1
+        desc_bw_obs = [
+            last or obs_mean
+            for last, obs_mean in zip(desc_bw_obs_last, desc_bw_obs_mean)
+        ]
+    # Assume that if it is not TORFLOW_OBS_LAST, then it is TORFLOW_OBS_MEAN
+    else:
+        desc_bw_obs = desc_bw_obs_mean
+
+    # Excerpt from bandwidth-file-spec.txt section 2.3
+    # A relay's MaxAdvertisedBandwidth limits the bandwidth-avg in its
+    # descriptor.
+    # Therefore generators MUST limit a relay's measured bandwidth to its
+    # descriptor's bandwidth-avg.
+    # Generators SHOULD NOT limit measured bandwidths based on descriptors'
+    # bandwidth-observed, because that penalises new relays.
+    # In the case that descriptor average or burst are None, ignore them
+    # since it must be a bug in ``Resultdump``, already logged in
+    # x_bw/bandwidth_x_from_results, but scale.
+    desc_bw = [
+        (
+            None
+            if obs is None
+            else min(b for b in (obs, bur, avg) if b is not None)
+        )
+        for obs, bur, avg in zip(desc_bw_obs, desc_bw_bur, desc_bw_avg)
+    ]
+
+    # Torflow's scaling
+    r_strm = [None if d is None else m / mu for m, d in zip(bw_mean, desc_bw)]
+    r_strm_filt = [
+        None if d is None else f / muf for f, d in zip(bw_filt, desc_bw)
+    ]
+    bw_scaled = [
+        b if d is None else max(r, rf) * d
+        for b, d, r, rf in zip(bw, desc_bw, r_strm, r_strm_filt)
+    ]
+    for d in desc_bw:
+        if d is None:
+            log.warning("Can not scale relay missing descriptor.")
+
+    # Torflow's ``tot_net_bw``, sum of the scaled bandwidth for the relays
+    # that are in the last consensus.
+    # Sum in order and without ``sum``, that since Python 3.12 compensates
+    # the float rounding errors, to obtain always the same bandwidths.
+    if in_consensus is None:
+        in_consensus = [True] * len(desc_bw)
+    sum_bw = 0
+    for b, d, counted in zip(bw_scaled, desc_bw, in_consensus):
+        if d is not None and counted:
+            sum_bw += b
+
+    # Cap maximum bw, only possible when the ``sum_bw`` is calculated.
+    # Torflow's clipping
+    hlimit = sum_bw * cap
+    log.debug(
+        "Sum of all the reported relays' scaled bandwidth: %i bytes, "
+        "the limit for any relay is: %i bytes",
+        sum_bw,
+        hlimit,
+    )
+    return (
+        [min(hlimit, b) for b in bw_scaled],
+        r_strm,
+        r_strm_filt,
+        mu,
+        muf,
+    )
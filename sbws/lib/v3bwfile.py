@@ -1,22 +1,25 @@
 # -*- coding: utf-8 -*-
 """Classes and functions that create the bandwidth measurements document
 (v3bw) used by bandwidth authorities."""
+
 # flake8: noqa: E741
 # (E741 ambiguous variable name), when using l.
 
-import copy
+import contextlib
+import gzip
 import logging
 import math
 import os
-from itertools import combinations
+from collections.abc import Sequence
+from datetime import timedelta
 from statistics import mean, median
 
-from stem.descriptor import parse_file
-
 from sbws import __version__
 from sbws.globals import (
     BW_LINE_SIZE,
     MAX_BW_DIFF_PERC,
+    MAX_RECENT_CONSENSUS_COUNT,
+    MEASUREMENTS_PERIOD,
     MIN_REPORT,
     PROP276_ROUND_DIG,
     SBWS_SCALE_CONSTANT,
@@ -28,9 +31,10 @@ from sbws.globals import (
     TORFLOW_SCALING,
 )
 from sbws.lib import scaling
+from sbws.lib.consensus import ConsensusSnapshot
 from sbws.lib.resultdump import ResultSuccess, _ResultType
 from sbws.util.filelock import DirectoryLock
-from sbws.util.state import State
+from sbws.util.state import State, StateSnapshot
 from sbws.util.timestamp import (
     dt_obj_to_isodt_str,
     isostr_to_dt_obj,
@@ -44,6 +48,8 @@ log = logging.getLogger(__name__)
 LINE_SEP = "\n"
 KEYVALUE_SEP_V1 = "="
 KEYVALUE_SEP_V2 = " "
+# Number of Bandwidth Lines serialized at once when writing the file.
+V3BW_WRITE_CHUNK_LINES = 1000
 
 # NOTE: in a future refactor make make all the KeyValues be a dictionary
 # with their type, so that it's more similar to stem parser.
@@ -282,6 +288,9 @@ BWLINE_KEYS_V1 = (
     + BWLINE_KEYS_V1_6
     + BWLINE_KEYS_V1_7
 )
+# The KeyValues are written in this order, to generate determinist lines.
+BWLINE_KEYS_V1_SORTED = sorted(set(BWLINE_KEYS_V1))
+_BWLINE_KEYS_V1_SET = frozenset(BWLINE_KEYS_V1)
 # NOTE: tech-debt: assign boolean type to vote and unmeasured,
 # when the attributes are defined with a type, as stem does.
 BWLINE_INT_KEYS = (
@@ -299,6 +308,7 @@ BWLINE_INT_KEYS = (
 )
 # This is boolean, not int.
 BWLINE_INT_KEYS.remove("consensus_bandwidth_is_unmeasured")
+_BWLINE_INT_KEYS_SET = frozenset(BWLINE_INT_KEYS)
 
 
 def round_sig_dig(n, digits=PROP276_ROUND_DIG):
@@ -332,6 +342,26 @@ def kb_round_x_sig_dig(bw_bs, digits=PROP276_ROUND_DIG):
     return round_sig_dig(bw_kb, digits=digits)
 
 
+def bw_line_v1_keyvalues(line):
+    """Return the dictionary of known KeyValues in a Bandwidth Line string
+    following spec v1.X.X, with the integer values converted."""
+    kwargs = {}
+    for kv in line.split(BWLINE_KEYVALUES_SEP_V1):
+        k, _, v = kv.partition(KEYVALUE_SEP_V1)
+        if k in _BWLINE_KEYS_V1_SET:
+            kwargs[k] = int(v) if k in _BWLINE_INT_KEYS_SET else v
+    return kwargs
+
+
+def _read_bw_file_lines(fpath):
+    """Return the lines of a bandwidth file, that can be gzip compressed."""
+    if fpath.endswith(".gz"):
+        with gzip.open(fpath, "rt") as fd:
+            return fd.read().split(LINE_SEP)
+    with open(fpath) as fd:
+        return fd.read().split(LINE_SEP)
+
+
 def num_results_of_type(results, type_str):
     return len([r for r in results if r.type == type_str])
 
@@ -393,14 +423,14 @@ class V3BWHeader(object):
         latest_bandwidth = cls.latest_bandwidth_from_results(results)
         earliest_bandwidth = cls.earliest_bandwidth_from_results(results)
         # NOTE: Blocking, reads file
-        generator_started = cls.generator_started_from_file(state_fpath)
-        recent_consensus_count = cls.consensus_count_from_file(state_fpath)
+        # Read the state file only once for all the values.
+        state = StateSnapshot(state_fpath)
+        generator_started = cls.generator_started_from_file(state_fpath, state)
+        recent_consensus_count = cls.consensus_count_from_file(
+            state_fpath, state
+        )
         timestamp = str(latest_bandwidth)
 
-        # XXX: tech-debt: obtain the other values from the state file using
-        # this state variable.
-        # Store the state as an attribute of the object?
-        state = State(state_fpath)
         tor_version = state.get("tor_version", None)
         if tor_version:
             kwargs["tor_version"] = tor_version
@@ -420,7 +450,7 @@ class V3BWHeader(object):
             kwargs["recent_consensus_count"] = recent_consensus_count
 
         recent_measurement_attempt_count = (
-            cls.recent_measurement_attempt_count_from_file(state_fpath)
+            cls.recent_measurement_attempt_count_from_file(state_fpath, state)
         )
         if recent_measurement_attempt_count is not None:
             kwargs["recent_measurement_attempt_count"] = str(
@@ -443,12 +473,14 @@ class V3BWHeader(object):
                 measurement_failures
             )
 
-        priority_lists = cls.recent_priority_list_count_from_file(state_fpath)
+        priority_lists = cls.recent_priority_list_count_from_file(
+            state_fpath, state
+        )
         if priority_lists is not None:
             kwargs["recent_priority_list_count"] = str(priority_lists)
 
         priority_relays = cls.recent_priority_relay_count_from_file(
-            state_fpath
+            state_fpath, state
         )
         if priority_relays is not None:
             kwargs["recent_priority_relay_count"] = str(priority_relays)
@@ -469,13 +501,11 @@ class V3BWHeader(object):
             log.warn("Terminator is not in lines")
             return None
         ts = lines[0]
-        kwargs = dict(
-            [
-                l.split(KEYVALUE_SEP_V1)
-                for l in lines[:index_terminator]
-                if l.split(KEYVALUE_SEP_V1)[0] in HEADER_ALL_KEYS
-            ]
-        )
+        kwargs = {}
+        for l in lines[:index_terminator]:
+            k, _, v = l.partition(KEYVALUE_SEP_V1)
+            if k in HEADER_ALL_KEYS:
+                kwargs[k] = v
         h = cls(ts, **kwargs)
         # last line is new line
         return h, lines[index_terminator + 1 : -1]
@@ -499,12 +529,13 @@ class V3BWHeader(object):
         return h, lines[1:-1]
 
     @staticmethod
-    def generator_started_from_file(state_fpath):
+    def generator_started_from_file(state_fpath, state=None):
         """
         ISO formatted timestamp for the time when the scanner process most
         recently started.
         """
-        state = State(state_fpath)
+        if state is None:
+            state = StateSnapshot(state_fpath)
         if "scanner_started" in state:
             # From v1.1.0-dev `state` is capable of converting strs to datetime
             return dt_obj_to_isodt_str(state["scanner_started"])
@@ -512,8 +543,9 @@ class V3BWHeader(object):
             return None
 
     @staticmethod
-    def consensus_count_from_file(state_fpath):
-        state = State(state_fpath)
+    def consensus_count_from_file(state_fpath, state=None):
+        if state is None:
+            state = StateSnapshot(state_fpath)
         count = state.count("recent_consensus")
         if count:
             return str(count)
@@ -521,32 +553,35 @@ class V3BWHeader(object):
 
     # NOTE: in future refactor store state in the class
     @staticmethod
-    def recent_measurement_attempt_count_from_file(state_fpath):
+    def recent_measurement_attempt_count_from_file(state_fpath, state=None):
         """
         Returns the number of times any relay was queued to be measured
         in the recent (by default 5) days from the state file.
         """
-        state = State(state_fpath)
+        if state is None:
+            state = StateSnapshot(state_fpath)
         return state.count("recent_measurement_attempt")
 
     @staticmethod
-    def recent_priority_list_count_from_file(state_fpath):
+    def recent_priority_list_count_from_file(state_fpath, state=None):
         """
         Returns the number of times
         :meth:`~sbws.lib.relayprioritizer.RelayPrioritizer.best_priority`
         was run
         in the recent (by default 5) days from the state file.
         """
-        state = State(state_fpath)
+        if state is None:
+            state = StateSnapshot(state_fpath)
         return state.count("recent_priority_list")
 
     @staticmethod
-    def recent_priority_relay_count_from_file(state_fpath):
+    def recent_priority_relay_count_from_file(state_fpath, state=None):
         """
         Returns the number of times any relay was "prioritized" to be measured
         in the recent (by default 5) days from the state file.
         """
-        state = State(state_fpath)
+        if state is None:
+            state = StateSnapshot(state_fpath)
         return state.count("recent_priority_relay")
 
     @staticmethod
@@ -689,6 +724,27 @@ class V3BWHeader(object):
         self.muf = "{:d}".format(round(muf))
 
 
+def _join_relay_counter(results, name):
+    """Return the timestamps of the relay counter ``name`` of the results.
+
+    Since result version 5, a result only contains the timestamps that were
+    not written in a previous result of the same relay in the same file,
+    while results of previous versions contain all the timestamps.
+    """
+    timestamps = []
+    for r in sorted(results, key=lambda r: r.time):
+        new = getattr(r, name, None)
+        if not new:
+            continue
+        if timestamps and new[0] <= timestamps[-1]:
+            # The result contains all the timestamps.
+            timestamps = list(new)
+        else:
+            oldest = new[-1] - timedelta(seconds=MEASUREMENTS_PERIOD)
+            timestamps = [t for t in timestamps if t > oldest] + list(new)
+    return timestamps[-MAX_RECENT_CONSENSUS_COUNT:]
+
+
 class V3BWLine(object):
     """
     Create a Bandwidth List line following the spec version 1.X.X.
@@ -743,15 +799,8 @@ class V3BWLine(object):
         kwargs["time"] = cls.last_time_from_results(results)
         kwargs.update(cls.result_types_from_results(results))
 
-        # If it has not the attribute, return list to be able to call len
-        # If it has the attribute, but it is None, return also list
         kwargs["relay_in_recent_consensus_count"] = str(
-            max(
-                [
-                    len(getattr(r, "relay_in_recent_consensus", []) or [])
-                    for r in results
-                ]
-            )
+            len(_join_relay_counter(results, "relay_in_recent_consensus"))
         )
 
         # Workaround for #34309.
@@ -821,9 +870,9 @@ class V3BWLine(object):
         number_excluded_error = len(results) - len(success_results)
         if number_excluded_error > 0:
             # then the number of error results is the number of results
-            kwargs[
-                "relay_recent_measurements_excluded_error_count"
-            ] = number_excluded_error
+            kwargs["relay_recent_measurements_excluded_error_count"] = (
+                number_excluded_error
+            )
         if not success_results:
             exclusion_reason = "recent_measurements_excluded_error_count"
             return (cls(node_id, 1, **kwargs), exclusion_reason)
@@ -831,9 +880,9 @@ class V3BWLine(object):
         results_away = cls.results_away_each_other(success_results, secs_away)
         number_excluded_near = len(success_results) - len(results_away)
         if number_excluded_near > 0:
-            kwargs[
-                "relay_recent_measurements_excluded_near_count"
-            ] = number_excluded_near
+            kwargs["relay_recent_measurements_excluded_near_count"] = (
+                number_excluded_near
+            )
         if not results_away:
             exclusion_reason = "recent_measurements_excluded_near_count"
             return (cls(node_id, 1, **kwargs), exclusion_reason)
@@ -843,9 +892,9 @@ class V3BWLine(object):
         results_recent = cls.results_recent_than(results_away, secs_recent)
         number_excluded_old = len(results_away) - len(results_recent)
         if number_excluded_old > 0:
-            kwargs[
-                "relay_recent_measurements_excluded_old_count"
-            ] = number_excluded_old
+            kwargs["relay_recent_measurements_excluded_old_count"] = (
+                number_excluded_old
+            )
         if not results_recent:
             exclusion_reason = "recent_measurements_excluded_old_count"
             return (cls(node_id, 1, **kwargs), exclusion_reason)
@@ -892,19 +941,19 @@ class V3BWLine(object):
         rtt = cls.rtt_from_results(results_recent)
         if rtt:
             kwargs["rtt"] = rtt
-        bw = cls.bw_median_from_results(results_recent)
-        # XXX: all the class functions could use the bw_measurements instead of
-        # obtaining them each time or use a class Measurements.
+        # Obtain the download bandwidths once and all their statistics
+        # together.
         bw_measurements = scaling.bw_measurements_from_results(results_recent)
-        kwargs["bw_mean"] = cls.bw_mean_from_results(results_recent)
-        kwargs["bw_filt"] = scaling.bw_filt(bw_measurements)
-        kwargs["bw_median"] = cls.bw_median_from_results(results_recent)
+        bw, kwargs["bw_mean"], kwargs["bw_filt"] = scaling.bw_stats(
+            bw_measurements
+        )
+        kwargs["bw_median"] = bw
         kwargs["desc_bw_avg"] = cls.desc_bw_avg_from_results(results_recent)
         kwargs["desc_bw_bur"] = cls.desc_bw_bur_from_results(results_recent)
         kwargs["consensus_bandwidth"] = consensus_bandwidth
-        kwargs[
-            "consensus_bandwidth_is_unmeasured"
-        ] = consensus_bandwidth_is_unmeasured
+        kwargs["consensus_bandwidth_is_unmeasured"] = (
+            consensus_bandwidth_is_unmeasured
+        )
         kwargs["desc_bw_obs_last"] = desc_bw_obs_last
         kwargs["desc_bw_obs_mean"] = cls.desc_bw_obs_mean_from_results(
             results_recent
@@ -919,16 +968,7 @@ class V3BWLine(object):
 
     @classmethod
     def from_bw_line_v1(cls, line):
-        kwargs = dict(
-            [
-                kv.split(KEYVALUE_SEP_V1)
-                for kv in line.split(BWLINE_KEYVALUES_SEP_V1)
-                if kv.split(KEYVALUE_SEP_V1)[0] in BWLINE_KEYS_V1
-            ]
-        )
-        for k, v in kwargs.items():
-            if k in BWLINE_INT_KEYS:
-                kwargs[k] = int(v)
+        kwargs = bw_line_v1_keyvalues(line)
         node_id = kwargs["node_id"]
         bw = kwargs["bw"]
         del kwargs["node_id"]
@@ -942,9 +982,11 @@ class V3BWLine(object):
         #           "secs.", secs_away)
         if secs_away is None or len(results) < 2:
             return results
-        for a, b in combinations(results, 2):
-            if abs(a.time - b.time) > secs_away:
-                return results
+        # There are two results more than secs_away apart if and only if the
+        # oldest and the newest are.
+        times = [r.time for r in results]
+        if max(times) - min(times) > secs_away:
+            return results
         # log.debug("Results are NOT away from each other in at least %ss: %s",
         #           secs_away, [unixts_to_isodt_str(r.time) for r in results])
         return []
@@ -953,9 +995,8 @@ class V3BWLine(object):
     def results_recent_than(results, secs_recent=None):
         if secs_recent is None:
             return results
-        results_recent = list(
-            filter(lambda x: (now_unixts() - x.time) < secs_recent, results)
-        )
+        now = now_unixts()
+        results_recent = [r for r in results if now - r.time < secs_recent]
         # if not results_recent:
         #     log.debug("Results are NOT more recent than %ss: %s",
         #               secs_recent,
@@ -1073,10 +1114,8 @@ class V3BWLine(object):
     def bw_keyvalue_tuple_ls(self):
         """Return list of KeyValue Bandwidth Line tuples."""
         # sort the list to generate determinist headers
-        keyvalue_tuple_ls = sorted(
-            [(k, v) for k, v in self.__dict__.items() if k in BWLINE_KEYS_V1]
-        )
-        return keyvalue_tuple_ls
+        d = self.__dict__
+        return [(k, d[k]) for k in BWLINE_KEYS_V1_SORTED if k in d]
 
     @property
     def bw_keyvalue_v1str_ls(self):
@@ -1108,6 +1147,70 @@ class V3BWLine(object):
         return bw_line_str
 
 
+class V3BWLineTable(Sequence):
+    """Bandwidth Lines parsed from a bandwidth file, stored by columns.
+
+    It is a sequence of :class:`V3BWLine`, but the lines are only created
+    when they are accessed, so that obtaining a column or the line of a
+    relay does not need to create all the lines.
+
+    :param list keyvalues: the dictionaries of KeyValues of every line.
+    """
+
+    def __init__(self, keyvalues):
+        keys = set()
+        for kwargs in keyvalues:
+            keys.update(kwargs)
+        # A missing KeyValue is None.
+        self._columns = {
+            k: [kwargs.get(k) for kwargs in keyvalues] for k in keys
+        }
+        self._lines = [None] * len(keyvalues)
+        self._node_id_index = {}
+        for i, node_id in enumerate(self.column("node_id")):
+            self._node_id_index.setdefault(node_id, i)
+
+    @classmethod
+    def from_lines_v1(cls, lines, sort_key=None):
+        """Parse Bandwidth Line strings following spec v1.X.X.
+
+        :param str sort_key: if given, the lines are sorted by this KeyValue.
+        """
+        keyvalues = [bw_line_v1_keyvalues(line) for line in lines]
+        if sort_key is not None:
+            keyvalues.sort(key=lambda kwargs: kwargs[sort_key])
+        return cls(keyvalues)
+
+    def __len__(self):
+        return len(self._lines)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        line = self._lines[i]
+        if line is None:
+            kwargs = {
+                k: column[i]
+                for k, column in self._columns.items()
+                if column[i] is not None
+            }
+            line = V3BWLine(kwargs.pop("node_id"), kwargs.pop("bw"), **kwargs)
+            self._lines[i] = line
+        return line
+
+    def column(self, key):
+        """Return the list of values of a KeyValue, with None for the lines
+        that do not have it."""
+        return self._columns.get(key, [None] * len(self))
+
+    def line_for_node_id(self, node_id):
+        """Return the first line for a relay, or None."""
+        i = self._node_id_index.get(node_id)
+        if i is None:
+            return None
+        return self[i]
+
+
 class V3BWFile(object):
     """
     Create a Bandwidth List file following spec version 1.X.X
@@ -1144,11 +1247,15 @@ class V3BWFile(object):
         consensus_path=None,
         max_bw_diff_perc=MAX_BW_DIFF_PERC,
         reverse=False,
+        consensus=None,
     ):
         """Create V3BWFile class from sbws Results.
 
         :param dict results: see below
         :param str state_fpath: path to the state file
+        :param str consensus_path: path to the cached consensus file, parsed
+            when ``consensus`` is not given
+        :param consensus: the :class:`~sbws.lib.consensus.ConsensusSnapshot`
         :param int scaling_method:
             Scaling method to obtain the bandwidth
             Possible values: {None, SBWS_SCALING, TORFLOW_SCALING} = {0, 1, 2}
@@ -1172,11 +1279,10 @@ class V3BWFile(object):
         )
         bw_lines_raw = []
         bw_lines_excluded = []
-        router_statuses_d = cls.read_router_statuses(consensus_path)
-        # XXX: Use router_statuses_d to not parse again the file.
-        number_consensus_relays = cls.read_number_consensus_relays(
-            consensus_path
-        )
+        if consensus is None:
+            consensus = ConsensusSnapshot.from_file(consensus_path)
+        router_statuses_d = consensus.router_statuses
+        number_consensus_relays = consensus.number_relays
         state = State(state_fpath)
 
         # Create a dictionary with the number of relays excluded by any of the
@@ -1244,7 +1350,9 @@ class V3BWFile(object):
             # log.debug(bw_lines[-1])
         # Not using the result for now, just warning
         cls.is_max_bw_diff_perc_reached(
-            bw_lines, max_bw_diff_perc, router_statuses_d
+            bw_lines,
+            max_bw_diff_perc,
+            sum_consensus_bw=consensus.sum_bandwidth,
         )
         header.add_time_report_half_network()
         f = cls(header, bw_lines + bw_lines_excluded)
@@ -1252,25 +1360,21 @@ class V3BWFile(object):
 
     @classmethod
     def from_v1_fpath(cls, fpath):
+        """Parse a bandwidth file, that can be gzip compressed.
+
+        The Bandwidth Lines are a :class:`V3BWLineTable`.
+        """
         log.info("Parsing bandwidth file %s", fpath)
-        with open(fpath) as fd:
-            text = fd.read()
-        all_lines = text.split(LINE_SEP)
+        all_lines = _read_bw_file_lines(fpath)
         header, lines = V3BWHeader.from_lines_v1(all_lines)
-        bw_lines = [V3BWLine.from_bw_line_v1(line) for line in lines]
-        return cls(header, bw_lines)
+        return cls(header, V3BWLineTable.from_lines_v1(lines))
 
     @classmethod
     def from_v100_fpath(cls, fpath):
         log.info("Parsing bandwidth file %s", fpath)
-        with open(fpath) as fd:
-            text = fd.read()
-        all_lines = text.split(LINE_SEP)
+        all_lines = _read_bw_file_lines(fpath)
         header, lines = V3BWHeader.from_lines_v100(all_lines)
-        bw_lines = sorted(
-            [V3BWLine.from_bw_line_v1(l) for l in lines], key=lambda l: l.bw
-        )
-        return cls(header, bw_lines)
+        return cls(header, V3BWLineTable.from_lines_v1(lines, sort_key="bw"))
 
     @staticmethod
     def set_under_min_report(bw_lines):
@@ -1285,16 +1389,19 @@ class V3BWFile(object):
 
     @staticmethod
     def bw_kb(bw_lines, reverse=False):
-        bw_lines_scaled = copy.deepcopy(bw_lines)
-        for l in bw_lines_scaled:
+        """Convert the bandwidth of the lines to KB, in place.
+
+        :returns list: the lines sorted by bandwidth.
+        """
+        for l in bw_lines:
             l.bw = max(round(l.bw / 1000), 1)
-        return sorted(bw_lines_scaled, key=lambda x: x.bw, reverse=reverse)
+        return sorted(bw_lines, key=lambda x: x.bw, reverse=reverse)
 
     @staticmethod
     def bw_sbws_scale(
         bw_lines, scale_constant=SBWS_SCALE_CONSTANT, reverse=False
     ):
-        """Return a new V3BwLine list scaled using sbws method.
+        """Scale the bandwidth of the lines in place using sbws method.
 
         :param list bw_lines:
             bw lines to scale, not self.bw_lines,
@@ -1303,18 +1410,17 @@ class V3BWFile(object):
         :param int scale_constant:
             the constant to multiply by the ratio and
             the bandwidth to obtain the new bandwidth
-        :returns list: V3BwLine list
+        :returns list: the V3BwLine list sorted by bandwidth.
         """
         log.debug("Scaling bandwidth using sbws method.")
         m = median([l.bw for l in bw_lines])
-        bw_lines_scaled = copy.deepcopy(bw_lines)
-        for l in bw_lines_scaled:
+        for l in bw_lines:
             # min is to limit the bw to descriptor average-bandwidth
             # max to avoid bandwidth with 0 value
             l.bw = max(
                 round(min(l.desc_bw_avg, l.bw * scale_constant / m) / 1000), 1
             )
-        return sorted(bw_lines_scaled, key=lambda x: x.bw, reverse=reverse)
+        return sorted(bw_lines, key=lambda x: x.bw, reverse=reverse)
 
     @staticmethod
     def warn_if_not_accurate_enough(
@@ -1335,9 +1441,19 @@ class V3BWFile(object):
 
     @staticmethod
     def is_max_bw_diff_perc_reached(
-        bw_lines, max_bw_diff_perc=MAX_BW_DIFF_PERC, router_statuses_d=None
+        bw_lines,
+        max_bw_diff_perc=MAX_BW_DIFF_PERC,
+        router_statuses_d=None,
+        sum_consensus_bw=None,
     ):
-        if router_statuses_d:
+        """Whether the sum of the bandwidth of the lines differs more than
+        ``max_bw_diff_perc`` from the sum of the consensus bandwidth.
+
+        The sum of the consensus bandwidth is ``sum_consensus_bw`` when it is
+        given, otherwise it is obtained from ``router_statuses_d`` or, without
+        consensus, from the lines.
+        """
+        if not sum_consensus_bw and router_statuses_d:
             sum_consensus_bw = sum(
                 list(
                     map(
@@ -1346,7 +1462,7 @@ class V3BWFile(object):
                     )
                 )
             )
-        else:
+        elif not sum_consensus_bw:
             sum_consensus_bw = sum(
                 [
                     l.consensus_bandwidth
@@ -1398,95 +1514,44 @@ class V3BWFile(object):
         Obtain final bandwidth measurements applying Torflow's scaling
         method.
 
+        The bandwidth of the lines is scaled in place, with
+        :func:`~sbws.lib.scaling.torflow_scale`.
+
         See details in :ref:`torflow_aggr`.
         """
         log.info("Calculating relays' bandwidth using Torflow method.")
-        bw_lines_tf = copy.deepcopy(bw_lines)
-        # mean (Torflow's strm_avg)
-        mu = mean([l.bw_mean for l in bw_lines])
-        # filtered mean (Torflow's filt_avg)
-        muf = mean([l.bw_filt for l in bw_lines])
-        log.debug("mu %i bytes.", mu)
-        log.debug("muf %i bytes.", muf)
-
-        # Torflow's ``tot_net_bw``, sum of the scaled bandwidth for the relays
-        # that are in the last consensus
-        sum_bw = 0
-        for l in bw_lines_tf:
-            # First, obtain the observed bandwidth, later check what to do
-            # if it is 0 or None.
-            if desc_bw_obs_type == TORFLOW_OBS_LAST:
-                # In case there's no last, use the mean, because it is possible
-                # that it went down for a few days, but no more than 5,
-                # otherwise the mean will be 1
-                desc_bw_obs = l.desc_bw_obs_last or l.desc_bw_obs_mean
-            # Assume that if it is not TORFLOW_OBS_LAST, then it is
-            # TORFLOW_OBS_MEAN
-            else:
-                desc_bw_obs = l.desc_bw_obs_mean
-
-            # Excerpt from bandwidth-file-spec.txt section 2.3
-            # A relay's MaxAdvertisedBandwidth limits the bandwidth-avg in its
-            # descriptor.
-            # Therefore generators MUST limit a relay's measured bandwidth to
-            # its descriptor's bandwidth-avg.
-            # Generators SHOULD NOT limit measured bandwidths based on
-            # descriptors' bandwidth-observed, because that penalises new
-            # relays.
-            # In the case that descriptor average or burst are None,
-            # ignore them since it must be a bug in ``Resultdump``, already
-            # logged in x_bw/bandwidth_x_from_results, but scale.
-            if desc_bw_obs is not None:
-                if l.desc_bw_bur is not None:
-                    if l.desc_bw_avg is not None:
-                        desc_bw = min(
-                            desc_bw_obs, l.desc_bw_bur, l.desc_bw_avg
-                        )
-                    else:
-                        desc_bw = min(desc_bw_obs, l.desc_bw_bur)
-                else:
-                    if l.desc_bw_avg is not None:
-                        desc_bw = min(desc_bw_obs, l.desc_bw_avg)
-                    else:
-                        desc_bw = desc_bw_obs
-            else:
-                log.warning("Can not scale relay missing descriptor.")
-                continue
-
-            # Torflow's scaling
-            l.r_strm = l.bw_mean / mu
-            l.r_strm_filt = l.bw_filt / muf
-            ratio = max(l.r_strm, l.r_strm_filt)
-
-            # Assign it to an attribute, so it's not lost before capping and
-            # rounding
-            l.bw = ratio * desc_bw
-
-            # If the consensus is available, sum only the bw for the relays
-            # that are in the consensus
-            if router_statuses_d:
-                if l.node_id.replace("$", "") in router_statuses_d:
-                    sum_bw += l.bw
-            # Otherwise sum all bw, for compatibility with tests that were not
-            # using the consensus file.
-            else:
-                sum_bw += l.bw
-
-        # Cap maximum bw, only possible when the ``sum_bw`` is calculated.
-        # Torflow's clipping
-        hlimit = sum_bw * cap
-        log.debug(
-            "Sum of all the reported relays' scaled bandwidth: %i bytes, "
-            "the limit for any relay is: %i bytes",
-            sum_bw,
-            hlimit,
+        in_consensus = None
+        # If the consensus is available, sum only the bw for the relays that
+        # are in the consensus.
+        # Otherwise sum all bw, for compatibility with tests that were not
+        # using the consensus file.
+        if router_statuses_d:
+            in_consensus = [
+                l.node_id.replace("$", "") in router_statuses_d
+                for l in bw_lines
+            ]
+        bws, r_strms, r_strms_filt, mu, muf = scaling.torflow_scale(
+            [l.bw_mean for l in bw_lines],
+            [l.bw_filt for l in bw_lines],
+            [l.desc_bw_obs_last for l in bw_lines],
+            [l.desc_bw_obs_mean for l in bw_lines],
+            [l.desc_bw_avg for l in bw_lines],
+            [l.desc_bw_bur for l in bw_lines],
+            [l.bw for l in bw_lines],
+            in_consensus,
+            desc_bw_obs_type,
+            cap,
         )
-        for l in bw_lines_tf:
-            bw_scaled = min(hlimit, l.bw)
+        for l, bw, r_strm, r_strm_filt in zip(
+            bw_lines, bws, r_strms, r_strms_filt
+        ):
+            if r_strm is not None:
+                l.r_strm = r_strm
+                l.r_strm_filt = r_strm_filt
             # round and convert to KB
-            l.bw = kb_round_x_sig_dig(bw_scaled, digits=num_round_dig)
+            l.bw = kb_round_x_sig_dig(bw, digits=num_round_dig)
         return (
-            sorted(bw_lines_tf, key=lambda x: x.bw, reverse=reverse),
+            sorted(bw_lines, key=lambda x: x.bw, reverse=reverse),
             mu,
             muf,
         )
@@ -1495,33 +1560,12 @@ class V3BWFile(object):
     def read_number_consensus_relays(consensus_path):
         """Read the number of relays in the Network from the cached consensus
         file."""
-        num = None
-        try:
-            num = len(list(parse_file(consensus_path)))
-        except (FileNotFoundError, AttributeError):
-            log.warning(
-                "It is not possible to obtain statistics about the "
-                "percentage of measured relays because the cached "
-                "consensus file is not found."
-            )
-        log.info("Number of relays in the network %s", num)
-        return num
+        return ConsensusSnapshot.from_file(consensus_path).number_relays
 
     @staticmethod
     def read_router_statuses(consensus_path):
         """Read the router statuses from the cached consensus file."""
-        router_statuses_d = None
-        try:
-            router_statuses_d = dict(
-                [(r.fingerprint, r) for r in parse_file(consensus_path)]
-            )
-        except (FileNotFoundError, AttributeError):
-            log.warning(
-                "It is not possible to obtain the last consensus "
-                "cached file %s.",
-                consensus_path,
-            )
-        return router_statuses_d
+        return ConsensusSnapshot.from_file(consensus_path).router_statuses
 
     @staticmethod
     def measured_progress_stats(
@@ -1651,6 +1695,8 @@ class V3BWFile(object):
 
         Used to combine data when plotting.
         """
+        if isinstance(self.bw_lines, V3BWLineTable):
+            return self.bw_lines.line_for_node_id(node_id)
         bwl = [l for l in self.bw_lines if l.node_id == node_id]
         if bwl:
             return bwl[0]
@@ -1665,7 +1711,17 @@ class V3BWFile(object):
         ys = [[getattr(l, k) for l in self.bw_lines] for k in attrs]
         return x, ys, attrs
 
-    def write(self, output):
+    def write(self, output, compress=False):
+        """Write the bandwidth file to ``output`` and symlink
+        ``latest.v3bw`` to it.
+
+        The file is written to a temporal file that is renamed to
+        ``output`` after it has been written to disk, so that readers never
+        read a partial file.
+
+        :param bool compress: whether to also write a gzip compressed copy
+            of the file, ``output`` with the ``.gz`` extension.
+        """
         if output == "/dev/stdout":
             log.info("Writing to stdout is not supported.")
             return
@@ -1676,10 +1732,7 @@ class V3BWFile(object):
         out_link = os.path.join(out_dir, "latest.v3bw")
         out_link_tmp = out_link + ".tmp"
         with DirectoryLock(out_dir):
-            with open(output, "wt") as fd:
-                fd.write(str(self.header))
-                for line in self.bw_lines:
-                    fd.write(str(line))
+            self._write_atomic(output, compress)
             output_basename = os.path.basename(output)
             # To atomically symlink a file, we need to create a temporary link,
             # then rename it to the final link name. (POSIX guarantees that
@@ -1696,3 +1749,48 @@ class V3BWFile(object):
                 )
             )
             os.rename(out_link_tmp, out_link)
+
+    def _write_atomic(self, output, compress=False):
+        """Write the bandwidth file to a temporal file, sync it to disk and
+        rename it to ``output``, and the same with the compressed copy."""
+        fnames = [output] + ([output + ".gz"] if compress else [])
+        tmp_fnames = [fname + ".tmp" for fname in fnames]
+        try:
+            with contextlib.ExitStack() as stack:
+                fds = [
+                    stack.enter_context(open(fname, "wb"))
+                    for fname in tmp_fnames
+                ]
+                writers = fds[:1]
+                if compress:
+                    writers.append(
+                        stack.enter_context(
+                            gzip.GzipFile(fileobj=fds[1], mode="wb")
+                        )
+                    )
+                # Serialize the lines once, buffered in chunks.
+                for chunk in self._iter_chunks():
+                    data = chunk.encode()
+                    for writer in writers:
+                        writer.write(data)
+                if compress:
+                    writers[1].close()
+                for fd in fds:
+                    fd.flush()
+                    os.fsync(fd.fileno())
+            for tmp_fname, fname in zip(tmp_fnames, fnames):
+                os.replace(tmp_fname, fname)
+        except BaseException:
+            for tmp_fname in tmp_fnames:
+                if os.path.exists(tmp_fname):
+                    os.remove(tmp_fname)
+            raise
+
+    def _iter_chunks(self, num_lines=V3BW_WRITE_CHUNK_LINES):
+        """Yield the bandwidth file string in chunks of ``num_lines``
+        Bandwidth Lines."""
+        yield str(self.header)
+        for i in range(0, len(self.bw_lines), num_lines):
+            yield "".join(
+                [str(line) for line in self.bw_lines[i : i + num_lines]]
+            )
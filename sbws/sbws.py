@@ -8,6 +8,7 @@ from stem import __version__ as stem_version
 import sbws.core.cleanup
 import sbws.core.flowctrl2
 import sbws.core.generate
+import sbws.core.migrate
 import sbws.core.scanner
 import sbws.core.stats
 from sbws import __version__ as version
@@ -90,6 +91,11 @@ def main():
             "a": def_args,
             "kw": def_kwargs,
         },
+        "migrate": {
+            "f": sbws.core.migrate.main,
+            "a": def_args,
+            "kw": def_kwargs,
+        },
     }
     try:
         if args.command not in known_commands:
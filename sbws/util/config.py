@@ -241,17 +241,28 @@ def _validate_general(conf):
     }
     floats = {
         "http_timeout": {"minimum": 0.0, "maximum": None},
+        "results_flush_interval": {"minimum": 0.0, "maximum": None},
+    }
+    enums = {
+        "results_durability": {"choices": ["flush", "fsync"]},
+        "results_backend": {"choices": ["files", "sqlite"]},
     }
     bools = {
         "reset_bw_ipv4_changes": {},
         "reset_bw_ipv6_changes": {},
+        "results_index": {},
+        "columnar_results": {},
     }
     all_valid_keys = (
-        list(ints.keys()) + list(floats.keys()) + list(bools.keys())
+        list(ints.keys())
+        + list(floats.keys())
+        + list(enums.keys())
+        + list(bools.keys())
     )
     errors.extend(_validate_section_keys(conf, sec, all_valid_keys, err_tmpl))
     errors.extend(_validate_section_ints(conf, sec, ints, err_tmpl))
     errors.extend(_validate_section_floats(conf, sec, floats, err_tmpl))
+    errors.extend(_validate_section_enums(conf, sec, enums, err_tmpl))
     errors.extend(_validate_section_bools(conf, sec, bools, err_tmpl))
     return errors
 
@@ -284,6 +295,8 @@ def _validate_paths(conf):
         "v3bw_dname",
         "state_fname",
         "log_dname",
+        "results_db",
+        "consensus_cache_fname",
     ]
     all_valid_keys = unvalidated_keys
     allow_missing = ["sbws_home"]
@@ -354,6 +367,7 @@ def _validate_scanner(conf):
         "num_downloads": {"minimum": 1, "maximum": 100},
         "initial_read_request": {"minimum": 1, "maximum": None},
         "measurement_threads": {"minimum": 1, "maximum": None},
+        "max_throughput": {"minimum": 0, "maximum": None},
         "min_download_size": {"minimum": 1, "maximum": None},
         "max_download_size": {"minimum": 1, "maximum": None},
     }
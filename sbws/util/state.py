@@ -101,10 +101,52 @@ class State:
         or the key value
         or None if the state doesn't have the key.
         """
-        if self.get(k):
-            if isinstance(self._state[k], list):
-                if isinstance(self._state[k][0], list):
-                    return sum(map(lambda x: x[1], self._state[k]))
-                return len(self._state[k])
-            return self.get(k)
-        return None
+        return _count(self.get(k))
+
+
+def _count(value):
+    if value:
+        if isinstance(value, list):
+            if isinstance(value[0], list):
+                return sum(map(lambda x: x[1], value))
+            return len(value)
+        return value
+    return None
+
+
+class StateSnapshot:
+    """
+    Read-only copy of a `json` state file, read once while the file is
+    locked.
+
+    Unlike :class:`State`, getting a key does not read the file again, so
+    that getting several keys is only one read and all the values are from
+    the same moment.
+    The counts of the keys are only calculated once.
+    """
+
+    def __init__(self, fname):
+        self._fname = fname
+        self._state = State(fname)._state
+        self._counts = {}
+
+    def __len__(self):
+        return self._state.__len__()
+
+    def get(self, key, d=None):
+        return self._state.get(key, d)
+
+    def __getitem__(self, key):
+        return self._state.__getitem__(key)
+
+    def __iter__(self):
+        return self._state.__iter__()
+
+    def __contains__(self, item):
+        return self._state.__contains__(item)
+
+    def count(self, k):
+        """Same as :meth:`State.count`."""
+        if k not in self._counts:
+            self._counts[k] = _count(self._state.get(k))
+        return self._counts[k]
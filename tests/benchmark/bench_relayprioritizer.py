@@ -0,0 +1,123 @@
+"""Benchmark of the prioritization of the relays to measure.
+
+It creates the relays in the consensus and server descriptors in
+``tests/data``, with a result for every relay, and prints the time that
+:meth:`~sbws.lib.relayprioritizer.RelayPrioritizer.best_priority` takes and
+the time that copying the relays, as it was done before, would take.
+
+Run it from the root directory with::
+
+    python -m tests.benchmark.bench_relayprioritizer [REPEAT]
+"""
+import argparse
+import copy
+import logging
+import os
+import tempfile
+import time
+
+from stem import descriptor
+
+from sbws import settings
+from sbws.lib.relaylist import Relay
+from sbws.lib.relayprioritizer import RelayPrioritizer
+from sbws.lib.resultdump import ResultDump, ResultSuccess
+from sbws.util.config import _get_default_config
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), "..", "data")
+CONSENSUS = "2020-02-29-10-00-00-consensus"
+SERVER_DESCRIPTORS = "2020-02-29-10-05-00-server-descriptors"
+REPEAT = 10
+
+
+class BenchController:
+    """Controller without the server descriptors missing in the file."""
+
+    def get_server_descriptor(self, fp, default=None):
+        return default
+
+
+class BenchRelayList:
+    """The relays of a consensus, without a controller."""
+
+    def __init__(self, relays):
+        self.relays = relays
+
+    @property
+    def authorities(self):
+        return [r for r in self.relays if "Authority" in r.flags]
+
+
+def data_relays():
+    """Return the relays in the ``tests/data`` consensus."""
+    descs = {
+        d.fingerprint: d
+        for d in descriptor.parse_file(
+            os.path.join(DATA_PATH, SERVER_DESCRIPTORS)
+        )
+    }
+    controller = BenchController()
+    return [
+        Relay(
+            ns.fingerprint, controller, ns=ns, desc=descs.get(ns.fingerprint)
+        )
+        for ns in descriptor.parse_file(os.path.join(DATA_PATH, CONSENSUS))
+    ]
+
+
+def bench(relay_prioritizer, relays, repeat):
+    """Return the seconds that ``best_priority`` and copying the relays
+    take."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        list(relay_prioritizer.best_priority(return_fraction=False))
+    best_priority_seconds = (time.perf_counter() - start) / repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        copy.deepcopy(relays)
+    copy_seconds = (time.perf_counter() - start) / repeat
+    return best_priority_seconds, copy_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("repeat", nargs="?", type=int, default=REPEAT)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    relays = data_relays()
+    with tempfile.TemporaryDirectory() as sbws_home:
+        conf = _get_default_config()
+        conf["paths"]["sbws_home"] = sbws_home
+        # Stop the ResultDump thread after reading the empty datadir.
+        settings.set_end_event()
+        result_dump = ResultDump(args, conf)
+        result_dump.thread.join()
+        now = time.time()
+        for i, relay in enumerate(relays):
+            result_dump.store_result(
+                ResultSuccess(
+                    [0.5],
+                    [{"amount": 1024, "duration": 1}],
+                    relay,
+                    [relay.fingerprint, relay.fingerprint],
+                    "https://example.com/sbws.bin",
+                    "bench",
+                    t=now - i,
+                )
+            )
+        relay_prioritizer = RelayPrioritizer(
+            args, conf, BenchRelayList(relays), result_dump
+        )
+        best_priority_seconds, copy_seconds = bench(
+            relay_prioritizer, relays, args.repeat
+        )
+    print(
+        "{} relays: best_priority {:.1f} ms, copying the relays {:.1f} ms"
+        "".format(
+            len(relays), best_priority_seconds * 1000, copy_seconds * 1000
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
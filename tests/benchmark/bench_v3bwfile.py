@@ -0,0 +1,102 @@
+"""Benchmark of the generation of a bandwidth file.
+
+It creates a synthetic result set and prints the time and the peak memory
+allocated by :meth:`~sbws.lib.v3bwfile.V3BWFile.from_results` with every
+scaling method.
+
+Run it from the root directory with::
+
+    python -m tests.benchmark.bench_v3bwfile [NUM_RELAYS]
+"""
+import argparse
+import logging
+import random
+import time
+import tracemalloc
+from datetime import datetime
+
+from sbws.globals import SBWS_SCALING, TORFLOW_SCALING
+from sbws.lib.resultdump import Result, ResultSuccess
+from sbws.lib.v3bwfile import V3BWFile
+
+NUM_RELAYS = 7000
+# Two results per relay, two days apart, so that the relays are not
+# excluded for not having results away from each other.
+RESULTS_AGE = [60 * 60, 2 * 24 * 60 * 60 + 60 * 60]
+
+
+def synthetic_results(num_relays, seed=0):
+    """Return a results dictionary with two successful results with five
+    downloads for ``num_relays`` relays."""
+    rng = random.Random(seed)
+    now = time.time()
+    timestamps = [datetime.utcfromtimestamp(now - age) for age in RESULTS_AGE]
+    results = {}
+    for i in range(num_relays):
+        fp = "{:040X}".format(i)
+        bw = rng.randint(10**4, 10**8)
+        relay = Result.Relay(
+            fp,
+            "relay{}".format(i),
+            "10.{}.{}.{}".format(i >> 16, (i >> 8) & 255, i & 255),
+            None,
+            average_bandwidth=bw * 2,
+            burst_bandwidth=bw * 3,
+            observed_bandwidth=bw,
+            consensus_bandwidth=bw // 1000,
+            consensus_bandwidth_is_unmeasured=False,
+            relay_in_recent_consensus=timestamps,
+            relay_recent_measurement_attempt=timestamps,
+            relay_recent_priority_list=timestamps,
+        )
+        results[fp] = [
+            ResultSuccess(
+                [0.5],
+                [
+                    {"amount": bw, "duration": rng.uniform(0.5, 2)}
+                    for _ in range(5)
+                ],
+                relay,
+                ["A" * 40, fp],
+                "https://example.com/sbws.bin",
+                "bench",
+                t=now - age,
+            )
+            for age in RESULTS_AGE
+        ]
+    return results
+
+
+def bench(results, scaling_method):
+    """Return the seconds and the peak bytes allocated to create a
+    bandwidth file from ``results``."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    V3BWFile.from_results(results, scaling_method=scaling_method)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("num_relays", nargs="?", type=int, default=NUM_RELAYS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    results = synthetic_results(args.num_relays)
+    for name, scaling_method in [
+        ("torflow", TORFLOW_SCALING),
+        ("sbws", SBWS_SCALING),
+        ("none", None),
+    ]:
+        seconds, peak = bench(results, scaling_method)
+        print(
+            "{} relays, {} scaling: {:.2f} s, {:.1f} MiB peak".format(
+                args.num_relays, name, seconds, peak / 2**20
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
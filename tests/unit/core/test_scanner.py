@@ -1,6 +1,9 @@
 """Unit tests for scanner.py."""
 import concurrent.futures
 import logging
+import threading
+import time
+from unittest import mock
 
 import pytest
 from freezegun import freeze_time
@@ -104,3 +107,122 @@ def test_complete_measurements(
             scanner.wait_futures_completed(pending_results)
             log.debug("After wait_futures_completed.")
             assert concurrent.futures.ALL_COMPLETED
+
+
+@pytest.mark.parametrize(
+    "max_throughput, max_measurements", [("0", 3), ("150", 2), ("100", 1)]
+)
+def test_main_loop_continuous(
+    args, conf, mocker, max_throughput, max_measurements
+):
+    """Test that ``main_loop`` keeps ``measurement_threads`` relays being
+    measured, or as many as fit in ``max_throughput``, without waiting for
+    the slowest relay to start a new loop, and that a relay is not measured
+    twice at the same time."""
+    conf["scanner"]["measurement_threads"] = "3"
+    conf["scanner"]["max_throughput"] = max_throughput
+    relays = []
+    for i in range(20):
+        relay = mock.Mock(
+            fingerprint="{:040X}".format(i),
+            nickname=str(i),
+            consensus_bandwidth=60,
+        )
+        relays.append(relay)
+    relay_list = mock.Mock(relays_fingerprints=[r.fingerprint for r in relays])
+    # The first loop returns the first 10 relays, the second one all the
+    # relays, and then the scanner stops.
+    relay_prioritizer = mock.Mock()
+    relay_prioritizer.best_priority.side_effect = [
+        iter(relays[:10]),
+        iter(relays),
+    ]
+    controller = mock.Mock()
+    controller.get_conf.side_effect = ["0", "1"]
+    end_event = threading.Event()
+    mocker.patch.object(scanner.settings, "end_event", end_event)
+    mocker.patch.object(
+        scanner, "stop_threads", side_effect=lambda *a: end_event.set()
+    )
+    lock = threading.Lock()
+    measuring = []
+    max_measuring = []
+
+    def measure(args, conf, destinations, cb, relay_list, target):
+        with lock:
+            assert target.fingerprint not in measuring
+            measuring.append(target.fingerprint)
+            max_measuring.append(len(measuring))
+        # The first relay is the slowest one.
+        time.sleep(0.5 if target is relays[0] else 0.01)
+        with lock:
+            measuring.remove(target.fingerprint)
+        return target.fingerprint
+
+    mocker.patch.object(scanner, "dispatch_worker_thread", side_effect=measure)
+    result_dump = mock.Mock()
+    result_dump.results_for_relay.return_value = []
+    scanner.main_loop(
+        args,
+        conf,
+        controller,
+        relay_list,
+        None,
+        result_dump,
+        relay_prioritizer,
+        None,
+    )
+    assert max_measurements == max(max_measuring)
+    # The relays measured in the first loop are not measured again in the
+    # second one.
+    measured = [c.args[0] for c in result_dump.queue.put.call_args_list]
+    assert sorted(measured) == sorted(r.fingerprint for r in relays)
+    # The second loop started while the slowest relay was being measured.
+    assert measured.index(relays[10].fingerprint) < measured.index(
+        relays[0].fingerprint
+    )
+
+
+def test_expected_throughput(result_success, result_error_stream):
+    relay = mock.Mock(consensus_bandwidth=1000, observed_bandwidth=500)
+    assert 1000 == scanner.expected_throughput(relay, [])
+    assert 1000 == scanner.expected_throughput(relay, [result_error_stream])
+    amount = sum(dl["amount"] for dl in result_success.downloads)
+    duration = sum(dl["duration"] for dl in result_success.downloads)
+    assert amount / duration == scanner.expected_throughput(
+        relay, [result_success, result_error_stream]
+    )
+    relay = mock.Mock(consensus_bandwidth=None, observed_bandwidth=500)
+    assert 500 == scanner.expected_throughput(relay, [])
+
+
+def test_measurement_scheduler(mocker):
+    """Test that the relays are only measured when their expected throughput
+    fits, except when no other relay is being measured."""
+    measuring = threading.Event()
+    mocker.patch.object(
+        scanner,
+        "dispatch_worker_thread",
+        side_effect=lambda t: measuring.wait(),
+    )
+    hbeat = mock.Mock()
+    rd = mock.Mock()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=3)
+    try:
+        scheduler = scanner.MeasurementScheduler(executor, 3, 100)
+        assert scheduler.can_submit(150)
+        scheduler.submit(mock.Mock(fingerprint="A"), 60)
+        assert scheduler.is_measuring("A")
+        assert not scheduler.can_submit(50)
+        assert scheduler.can_submit(40)
+        scheduler.submit(mock.Mock(fingerprint="B"), 40)
+        assert not scheduler.can_submit(0)
+    finally:
+        measuring.set()
+        executor.shutdown()
+    measured_fps = set()
+    while scheduler:
+        measured_fps.update(scheduler.wait_first_completed(hbeat, rd))
+    assert {"A", "B"} == measured_fps
+    assert 0 == scheduler.throughput
+    assert scheduler.can_submit(150)
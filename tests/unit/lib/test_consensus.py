@@ -0,0 +1,105 @@
+"""Unit tests for consensus.py."""
+import glob
+import os
+from unittest import mock
+
+from stem.descriptor import parse_file
+
+from sbws.lib import consensus
+from sbws.lib.consensus import (
+    ConsensusSnapshot,
+    consensus_valid_after,
+    flags_from_mask,
+    parse_router_statuses,
+    parse_router_statuses_stem,
+)
+
+
+def test_consensus_snapshot(root_data_path):
+    consensus_path = os.path.join(
+        root_data_path, "2020-02-29-10-00-00-consensus"
+    )
+    router_statuses = list(parse_file(consensus_path))
+    snapshot = ConsensusSnapshot.from_file(consensus_path)
+    assert "2020-02-29 10:00:00" == snapshot.valid_after
+    assert len(router_statuses) == snapshot.number_relays
+    assert {
+        rs.fingerprint: (rs.bandwidth, rs.is_unmeasured)
+        for rs in router_statuses
+    } == {
+        fp: (rs.bandwidth, rs.is_unmeasured)
+        for fp, rs in snapshot.router_statuses.items()
+    }
+    assert (
+        sum(rs.bandwidth * 1000 for rs in router_statuses)
+        == snapshot.sum_bandwidth
+    )
+
+
+def test_consensus_snapshot_missing(tmpdir):
+    snapshot = ConsensusSnapshot.from_file(tmpdir.join("missing").strpath)
+    assert snapshot.router_statuses is None
+    assert snapshot.number_relays is None
+    assert snapshot.sum_bandwidth is None
+
+
+def test_consensus_snapshot_cache(root_data_path, tmpdir):
+    consensus_path = tmpdir.join("cached-consensus").strpath
+    cache_fname = tmpdir.join("consensus_cache.json").strpath
+    with open(
+        os.path.join(root_data_path, "2020-02-29-10-00-00-consensus"), "rb"
+    ) as fd:
+        content = fd.read()
+    with open(consensus_path, "wb") as fd:
+        fd.write(content)
+    snapshot = ConsensusSnapshot.from_file(consensus_path, cache_fname)
+    assert os.path.exists(cache_fname)
+
+    # The consensus is not parsed again while it does not change.
+    with mock.patch.object(
+        consensus,
+        "parse_router_statuses",
+        wraps=parse_router_statuses,
+    ) as parse_mock:
+        cached = ConsensusSnapshot.from_file(consensus_path, cache_fname)
+        assert not parse_mock.called
+        assert snapshot.router_statuses == cached.router_statuses
+        assert snapshot.valid_after == cached.valid_after
+
+        # A new consensus is parsed.
+        with open(
+            os.path.join(root_data_path, "2020-02-29-11-00-00-consensus"),
+            "rb",
+        ) as fd:
+            content = fd.read()
+        with open(consensus_path, "wb") as fd:
+            fd.write(content)
+        new = ConsensusSnapshot.from_file(consensus_path, cache_fname)
+        assert parse_mock.called
+    assert "2020-02-29 11:00:00" == new.valid_after
+    assert consensus_valid_after(consensus_path) == new.valid_after
+
+
+def test_parse_router_statuses(root_data_path):
+    """The consensus line scanner obtains the same values as stem."""
+    consensus_paths = glob.glob(os.path.join(root_data_path, "*-consensus"))
+    assert consensus_paths
+    for consensus_path in consensus_paths:
+        router_statuses = parse_router_statuses(consensus_path)
+        assert parse_router_statuses_stem(consensus_path) == router_statuses
+        for rs in parse_file(consensus_path):
+            assert set(rs.flags) == set(
+                flags_from_mask(router_statuses[rs.fingerprint].flags)
+            )
+            assert router_statuses[rs.fingerprint].has_flag("Running")
+
+
+def test_consensus_snapshot_stem_fallback(root_data_path):
+    consensus_path = os.path.join(
+        root_data_path, "2020-02-29-10-00-00-consensus"
+    )
+    with mock.patch.object(
+        consensus, "parse_router_statuses", side_effect=ValueError
+    ):
+        snapshot = ConsensusSnapshot.from_file(consensus_path)
+    assert parse_router_statuses(consensus_path) == snapshot.router_statuses
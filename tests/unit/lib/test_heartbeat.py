@@ -1,5 +1,6 @@
 """Unit tests for heartbeat"""
 import logging
+from unittest.mock import patch
 
 from sbws.lib import heartbeat
 
@@ -60,3 +61,25 @@ def test_print_heartbeat_message(conf, caplog):
     hbeat.print_heartbeat_message()
     log_no_progress = "There is no progress measuring new unique relays"
     assert log_no_progress in caplog.records[0].getMessage()
+
+
+def test_threads_utilization(conf, caplog):
+    """
+    Test that the utilization of the measurement threads is the time they
+    were measuring relays since the last heartbeat message.
+    """
+    hbeat = heartbeat.Heartbeat(conf.getpath("paths", "state_fname"), 2)
+    hbeat.register_consensus_fprs(["1"])
+    with patch("time.monotonic", return_value=hbeat.heartbeat_tstart + 10):
+        hbeat.register_measurement_secs(10)
+        hbeat.register_measurement_secs(5)
+        assert 0.75 == hbeat.threads_utilization
+        hbeat.print_heartbeat_message()
+    assert (
+        "The 2 measurement threads were measuring relays 75% of the time"
+        in caplog.records[-1].getMessage()
+    )
+    assert 0 == hbeat.measurement_secs
+
+    hbeat = heartbeat.Heartbeat(conf.getpath("paths", "state_fname"))
+    assert hbeat.threads_utilization is None
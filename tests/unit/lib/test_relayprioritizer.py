@@ -1,4 +1,6 @@
 """relayprioritizer.py unit tests."""
+from unittest.mock import patch
+
 from freezegun import freeze_time
 
 
@@ -74,3 +76,19 @@ def test_increment_priority_relay(relay_prioritizer):
         relay_prioritizer.increment_recent_priority_relay(2)
     assert 6 == relay_prioritizer.recent_priority_relay_count
     assert 6 == state.count("recent_priority_relay")
+
+
+def test_best_priority_relays_not_copied(relay_prioritizer, relay_list):
+    """The relays returned are the ones in the relay list, without the
+    authorities, and their priority lists are incremented."""
+    with patch.object(relay_list, "_need_refresh", return_value=False):
+        relays = relay_list.relays
+        authorities = set(r.fingerprint for r in relay_list.authorities)
+        best = list(relay_prioritizer.best_priority(return_fraction=False))
+    assert authorities
+    assert len(relays) - len(authorities) == len(best)
+    relays_ids = set(id(relay) for relay in relays)
+    for relay in best:
+        assert id(relay) in relays_ids
+        assert relay.fingerprint not in authorities
+        assert 1 == relay.relay_recent_priority_list_count
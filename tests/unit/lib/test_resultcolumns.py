@@ -0,0 +1,87 @@
+"""Unit tests for resultcolumns."""
+
+import os
+
+from sbws.lib.resultcolumns import (
+    ColumnarResultWriter,
+    ResultColumns,
+    load_columns,
+    load_recent_columns_in_datadir,
+)
+from sbws.lib.resultdump import (
+    ResultErrorStream,
+    ResultSuccess,
+    load_recent_results,
+    result_dict_from_columns,
+    write_result_to_datadir,
+)
+from tests.unit.conftest import (
+    RESULT_ERROR_STREAM,
+    RESULT_SUCCESS1,
+    RESULT_SUCCESS2,
+)
+
+
+def test_columns_write_load(tmpdir):
+    writer = ColumnarResultWriter(str(tmpdir))
+    for result in [RESULT_SUCCESS1, RESULT_ERROR_STREAM, RESULT_SUCCESS1]:
+        writer.write(result)
+    prefix = str(tmpdir.join("2018-06-17"))
+    columns = load_columns(prefix)
+    assert 3 == len(columns)
+    assert [RESULT_SUCCESS1.fingerprint] == columns.fingerprints
+    assert RESULT_SUCCESS1.downloads == columns.downloads(0)
+    assert [] == columns.downloads(1)
+    assert RESULT_SUCCESS1.downloads == columns.downloads(2)
+    assert (
+        RESULT_SUCCESS1.relay_average_bandwidth,
+        RESULT_SUCCESS1.relay_burst_bandwidth,
+        RESULT_SUCCESS1.relay_observed_bandwidth,
+        RESULT_SUCCESS1.consensus_bandwidth,
+        RESULT_SUCCESS1.consensus_bandwidth_is_unmeasured,
+    ) == columns.relay_bandwidths(0)
+
+    # A writer appends to the existing files.
+    writer = ColumnarResultWriter(str(tmpdir))
+    writer.write(RESULT_SUCCESS1)
+    columns = load_columns(prefix)
+    assert 4 == len(columns)
+    assert RESULT_SUCCESS1.downloads == columns.downloads(3)
+
+    results = result_dict_from_columns(columns)
+    results = results[RESULT_SUCCESS1.fingerprint]
+    assert isinstance(results[0], ResultSuccess)
+    assert isinstance(results[1], ResultErrorStream)
+    assert RESULT_SUCCESS1.time == results[1].time
+    success_results = result_dict_from_columns(columns, success_only=True)
+    assert 3 == len(success_results[RESULT_SUCCESS1.fingerprint])
+
+
+def test_columns_from_results():
+    columns = ResultColumns.from_results(
+        {
+            RESULT_SUCCESS1.fingerprint: [RESULT_SUCCESS1],
+            RESULT_SUCCESS2.fingerprint: [RESULT_SUCCESS2],
+        }
+    )
+    other = ResultColumns()
+    other.extend(columns, oldest_allowed=RESULT_SUCCESS2.time)
+    assert 1 == len(other)
+    assert RESULT_SUCCESS2.fingerprint == other.fingerprint(0)
+    assert RESULT_SUCCESS2.downloads == other.downloads(0)
+
+
+def test_load_recent_results_columns(tmpdir):
+    datadir = str(tmpdir)
+    write_result_to_datadir(RESULT_SUCCESS2, datadir)
+    # There are not columns for the JSON result file.
+    assert load_recent_columns_in_datadir(5, datadir) is None
+    results = load_recent_results(5, datadir, use_columns=True)
+    assert [RESULT_SUCCESS2.fingerprint] == list(results.keys())
+
+    ColumnarResultWriter(datadir).write(RESULT_SUCCESS2)
+    assert any(f.endswith(".rec") for f in os.listdir(datadir))
+    results = load_recent_results(5, datadir, use_columns=True)
+    result = results[RESULT_SUCCESS2.fingerprint][0]
+    assert RESULT_SUCCESS2.downloads == result.downloads
+    assert result.nickname is None
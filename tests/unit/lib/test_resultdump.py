@@ -3,14 +3,44 @@
 
 import datetime
 import logging
+import os
+import random
+import time
+from unittest.mock import patch
 
+from sbws.globals import RESULT_INDEX_FNAME
+from sbws.lib import resultdump
 from sbws.lib.relaylist import Relay
 from sbws.lib.resultdump import (
+    RelayPriorityIndex,
+    Result,
     ResultError,
+    ResultErrorAuth,
     ResultErrorStream,
+    ResultFileWriter,
+    ResultIndex,
     ResultSuccess,
+    compress_result_file,
+    iter_result_file,
+    load_recent_results_in_datadir,
     load_result_file,
     trim_results_ip_changed,
+    write_result_to_datadir,
+)
+from sbws.lib.v3bwfile import V3BWLine
+from tests.unit.conftest import (
+    CIRC12,
+    DEST_URL,
+    DOWNLOADS1,
+    FP1,
+    IP1,
+    RELAY1,
+    RESULT_ERROR_STREAM,
+    RESULT_SUCCESS1,
+    RESULT_SUCCESS2,
+    RTTS1,
+    SCANNER,
+    TIME1,
 )
 
 
@@ -113,3 +143,303 @@ def test_load(datadir):
     assert 2 == len(r2.relay_recent_measurement_attempt)
     assert 3 == len(r2.relay_recent_priority_list)
     assert 3 == len(r2.relay_in_recent_consensus)
+
+
+def test_result_index(tmpdir, datadir):
+    fname = str(tmpdir.join("2018-04-17.txt"))
+    lines = datadir.readlines("results.txt")
+    with open(fname, "wt") as fd:
+        fd.writelines(lines[:2])
+    index = ResultIndex(str(tmpdir))
+    results = index.load_result_file(fname)
+    assert 2 == len(results["A" * 40])
+    index.write()
+    assert os.path.exists(str(tmpdir.join(RESULT_INDEX_FNAME)))
+
+    # A new index reads the results parsed before and only parses the new
+    # lines.
+    with open(fname, "at") as fd:
+        fd.writelines(lines[2:])
+    index = ResultIndex(str(tmpdir))
+    with patch(
+        "sbws.lib.resultdump._parse_result_line",
+        wraps=resultdump._parse_result_line,
+    ) as parse_mock:
+        results = index.load_result_file(fname)
+    assert len(lines) - 2 == parse_mock.call_count
+    assert load_result_file(fname).keys() == results.keys()
+    assert [str(r) for r in load_result_file(fname)["A" * 40]] == [
+        str(r) for r in results["A" * 40]
+    ]
+    success_results = index.load_result_file(fname, success_only=True)
+    assert all(isinstance(r, ResultSuccess) for r in success_results["A" * 40])
+
+    # Files that are no longer read are removed from the index.
+    index.prune([])
+    index.write()
+    assert {} == ResultIndex(str(tmpdir))._entries
+
+
+def test_resultdump_expire_results(result_dump):
+    # Wait for the thread to load the results from the datadir.
+    result_dump.thread.join()
+    now = time.time()
+    recent_results = [
+        ResultSuccess(
+            RTTS1, DOWNLOADS1, RELAY1, CIRC12, DEST_URL, SCANNER, t=t
+        )
+        for t in [now - 10, now - 20]
+    ]
+    for result in recent_results:
+        result_dump.store_result(result)
+    # The results are ordered by time.
+    results = result_dump.results_for_relay(RELAY1)
+    assert recent_results[::-1] == results
+
+    # A result older than data_period is expired when it is stored.
+    result_dump.store_result(RESULT_SUCCESS2)
+    result_dump.store_result(
+        ResultSuccess(
+            RTTS1, DOWNLOADS1, RELAY1, CIRC12, DEST_URL, SCANNER, t=TIME1
+        )
+    )
+    assert recent_results[::-1] == results
+
+    # The results become old.
+    with patch("time.time", return_value=now + 6 * 24 * 60 * 60):
+        assert [] == result_dump.results_for_relay(RELAY1)
+    assert {} == result_dump.data
+    assert [] == result_dump._expiry_heap
+
+
+def _best_priority(results_by_fp, fresh_seconds, now, errors=False):
+    """Calculate the priority of every relay, as ``best_priority`` did."""
+    oldest_allowed = now - fresh_seconds
+    priorities = []
+    for fp, results in results_by_fp.items():
+        priority = 0
+        for result in results:
+            if result.time < oldest_allowed:
+                continue
+            freshness = result.time - oldest_allowed
+            if errors and isinstance(result, ResultError):
+                freshness *= max(1.0 - result.freshness_reduction_factor, 0)
+            priority += freshness
+        priorities.append((priority, fp))
+    return sorted(priorities)
+
+
+def test_relay_priority_index():
+    random.seed(1)
+    fresh_seconds = 5 * 24 * 60 * 60
+    now = 1600000000
+    results_by_fp = {}
+    for i in range(300):
+        relay = Result.Relay("{:040X}".format(i), "r{}".format(i), IP1, None)
+        results = []
+        for _ in range(random.randint(0, 6)):
+            t = now - random.uniform(0, fresh_seconds)
+            cls = random.choice([ResultSuccess, ResultErrorStream])
+            if cls is ResultSuccess:
+                result = cls(
+                    RTTS1, DOWNLOADS1, relay, CIRC12, DEST_URL, "", t=t
+                )
+            else:
+                cls = random.choice([ResultErrorStream, ResultErrorAuth])
+                result = cls(relay, CIRC12, DEST_URL, "", t=t, msg="")
+            results.append(result)
+        results_by_fp[relay.fingerprint] = sorted(
+            results, key=lambda r: r.time
+        )
+    for errors in [False, True]:
+        index = RelayPriorityIndex(fresh_seconds, errors)
+        for fp, results in results_by_fp.items():
+            index.update(fp, results)
+        # Update some relays twice, to have removed entries in the heaps.
+        for fp in list(results_by_fp)[::3]:
+            index.update(fp, results_by_fp[fp])
+        # The relays order changes with time, also between relays with
+        # different number of results.
+        for later in [0, 3600, 24 * 3600, 2 * 24 * 3600]:
+            # The results that are too old are removed.
+            oldest_allowed = now + later - fresh_seconds
+            fresh = {
+                fp: [r for r in results if r.time >= oldest_allowed]
+                for fp, results in results_by_fp.items()
+            }
+            for fp, results in fresh.items():
+                index.update(fp, results)
+            expected = [
+                (priority, fp)
+                for priority, fp in _best_priority(
+                    fresh, fresh_seconds, now + later, errors
+                )
+                if priority > 0
+            ]
+            best = index.best(len(index), now=now + later)
+            assert [fp for _, fp in expected] == [fp for _, fp in best]
+            for (expected_priority, _), (priority, _) in zip(expected, best):
+                assert abs(expected_priority - priority) < 1e-3
+            # The relays are not removed from the index.
+            assert best[:10] == index.best(10, now=now + later)
+            fps = set(list(fresh)[::2])
+            assert [x for x in best if x[1] in fps][:10] == index.best(
+                10, fps, now + later
+            )
+
+
+def test_resultdump_priority_index(result_dump):
+    result_dump.thread.join()
+    now = time.time()
+    index = result_dump.priority_index()
+    assert FP1 not in index
+    result_dump.store_result(
+        ResultSuccess(
+            RTTS1, DOWNLOADS1, RELAY1, CIRC12, DEST_URL, SCANNER, t=now - 10
+        )
+    )
+    fresh_seconds = 5 * 24 * 60 * 60
+    assert abs(index.priority(FP1, now) - (fresh_seconds - 10)) < 1e-3
+    # The priority index is updated when the result is too old.
+    with patch("time.time", return_value=now + fresh_seconds):
+        result_dump.expire_results()
+    assert FP1 not in index
+    assert 0 == index.priority(FP1)
+
+
+def test_result_file_writer(tmpdir):
+    datadir = str(tmpdir)
+    writer = ResultFileWriter(datadir, durability="fsync")
+    writer.write(RESULT_SUCCESS1)
+    writer.write(RESULT_ERROR_STREAM)
+    assert 2 == len(writer)
+    fname = os.path.join(datadir, "2018-06-17.txt")
+    # Nothing is written until the batch is flushed.
+    assert not os.path.exists(fname)
+    writer.flush()
+    assert 0 == len(writer)
+    results = load_result_file(fname)
+    assert 2 == len(results[FP1])
+
+    # The file is kept open and it is opened again when it was removed.
+    os.remove(fname)
+    writer.write(RESULT_SUCCESS1)
+    writer.write(RESULT_SUCCESS2)
+    writer.close()
+    assert 1 == len(load_result_file(fname)[FP1])
+    assert 1 == len(
+        load_result_file(
+            os.path.join(
+                datadir,
+                "{}.txt".format(
+                    datetime.datetime.utcfromtimestamp(
+                        RESULT_SUCCESS2.time
+                    ).date()
+                ),
+            )
+        )[RESULT_SUCCESS2.fingerprint]
+    )
+
+
+def test_result_file_writer_counters(tmpdir):
+    datadir = str(tmpdir)
+    writer = ResultFileWriter(datadir)
+    timestamps = [datetime.datetime(2018, 6, 17, hour) for hour in range(1, 4)]
+    for i in range(1, 4):
+        relay = Result.Relay(
+            FP1, "A", None, None, relay_in_recent_consensus=timestamps[:i]
+        )
+        writer.write(
+            ResultErrorStream(relay, CIRC12, DEST_URL, SCANNER, t=TIME1 + i)
+        )
+    writer.close()
+    results = load_result_file(os.path.join(datadir, "2018-06-17.txt"))[FP1]
+    # Only the new timestamps are written in every result.
+    assert [[timestamps[i]] for i in range(3)] == [
+        r.relay_in_recent_consensus for r in results
+    ]
+    (line,) = V3BWLine.from_results(results)[:1]
+    assert "3" == line.relay_in_recent_consensus_count
+
+
+def test_load_recent_results_in_datadir_jobs(tmpdir):
+    datadir = str(tmpdir)
+    now = time.time()
+    for days in range(3):
+        for t in [now - days * 24 * 60 * 60, now - days * 24 * 60 * 60 - 1]:
+            write_result_to_datadir(
+                ResultSuccess(
+                    RTTS1, DOWNLOADS1, RELAY1, CIRC12, DEST_URL, SCANNER, t=t
+                ),
+                datadir,
+            )
+    write_result_to_datadir(RESULT_SUCCESS2, datadir)
+    results = load_recent_results_in_datadir(5, datadir)
+    assert 6 == len(results[FP1])
+    for use_index in [False, True]:
+        parallel_results = load_recent_results_in_datadir(
+            5, datadir, use_index=use_index, jobs=2
+        )
+        assert results.keys() == parallel_results.keys()
+        for fp in results:
+            assert [str(r) for r in results[fp]] == [
+                str(r) for r in parallel_results[fp]
+            ]
+
+
+def test_iter_result_file(datadir):
+    fname = datadir.join("results.txt")
+    assert 3 == len(list(iter_result_file(fname)))
+    with patch(
+        "sbws.lib.resultdump._parse_result_line",
+        wraps=resultdump._parse_result_line,
+    ) as parse_mock:
+        results = list(iter_result_file(fname, oldest_allowed=1523974147))
+        # The old result is not decoded.
+        assert 2 == parse_mock.call_count
+    assert all(isinstance(r, ResultErrorStream) for r in results)
+    with patch(
+        "sbws.lib.resultdump._parse_result_line",
+        wraps=resultdump._parse_result_line,
+    ) as parse_mock:
+        results = list(iter_result_file(fname, success_only=True))
+        assert 1 == parse_mock.call_count
+    assert 1 == len(results)
+    assert isinstance(results[0], ResultSuccess)
+
+
+def test_compress_result_file(tmpdir, datadir):
+    fname = tmpdir.join("results.txt").strpath
+    with open(datadir.join("results.txt"), "rt") as fd:
+        lines = fd.readlines()
+    with open(fname, "wt") as fd:
+        fd.writelines(lines)
+    gz_fname = compress_result_file(fname, block_lines=1)
+    assert gz_fname == fname + ".gz"
+    assert 3 == len(list(iter_result_file(gz_fname)))
+    with patch(
+        "sbws.lib.resultdump._parse_result_line",
+        wraps=resultdump._parse_result_line,
+    ) as parse_mock:
+        results = list(iter_result_file(gz_fname, oldest_allowed=1523974147))
+        assert 2 == parse_mock.call_count
+    assert all(isinstance(r, ResultErrorStream) for r in results)
+    # Without the blocks, the whole file is read.
+    os.remove(gz_fname + ".idx")
+    assert 3 == len(list(iter_result_file(gz_fname)))
+    assert 2 == len(
+        list(iter_result_file(gz_fname, oldest_allowed=1523974147))
+    )
+
+
+def test_load_recent_results_in_datadir_compressed(tmpdir):
+    datadir = tmpdir.mkdir("datadir").strpath
+    write_result_to_datadir(RESULT_SUCCESS2, datadir)
+    (fname,) = [f for f in os.listdir(datadir) if f.endswith(".txt")]
+    compress_result_file(os.path.join(datadir, fname))
+    os.remove(os.path.join(datadir, fname))
+    for use_index in (False, True, True):
+        results = load_recent_results_in_datadir(
+            5, datadir, use_index=use_index
+        )
+        assert 1 == len(results[RESULT_SUCCESS2.fingerprint])
@@ -1,3 +1,4 @@
+from array import array
 from unittest.mock import patch
 
 from sbws.globals import RESULT_VERSION
@@ -328,3 +329,19 @@ def test_relay_recent_priority_list_count(
         "scanner_nick",
     )
     assert 2 == len(r.relay_recent_priority_list)
+
+
+def test_result_compact(result_success_dict):
+    """Results read from a file have no ``__dict__``, share their strings and
+    store their timestamps as integers."""
+    r1 = Result.from_dict(result_success_dict)
+    r2 = Result.from_dict(dict(result_success_dict))
+    assert not hasattr(r1, "__dict__")
+    assert not hasattr(r1._relay, "__dict__")
+    assert r1.fingerprint is r2.fingerprint
+    assert isinstance(r1._relay.relay_in_recent_consensus, array)
+    assert [
+        dt.replace(microsecond=0)
+        for dt in result_success_dict["relay_in_recent_consensus"]
+    ] == r1.relay_in_recent_consensus
+    assert str(r1) == str(r2)
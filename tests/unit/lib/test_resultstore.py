@@ -0,0 +1,80 @@
+"""Unit tests for resultstore."""
+
+import os
+import time
+from unittest.mock import patch
+
+from sbws.lib.resultdump import ResultErrorStream, ResultSuccess
+from sbws.lib.resultstore import ResultStore
+from tests.unit.conftest import (
+    FP1,
+    RESULT_ERROR_STREAM,
+    RESULT_SUCCESS1,
+    RESULT_SUCCESS2,
+    TIME1,
+)
+
+
+def test_result_store(tmpdir):
+    store = ResultStore(tmpdir.join("results.sqlite").strpath)
+    store.write(RESULT_SUCCESS1)
+    store.write(RESULT_ERROR_STREAM)
+    store.write(RESULT_SUCCESS2)
+    # The same result is stored only once.
+    store.write(RESULT_SUCCESS2)
+    assert 4 == len(store)
+    store.flush()
+    assert 0 == len(store)
+
+    with patch("time.time", return_value=TIME1 + 1):
+        results = store.load_recent_results(1)
+    assert {FP1, RESULT_SUCCESS2.fingerprint} == set(results)
+    assert [ResultSuccess, ResultErrorStream] == [
+        type(r) for r in results[FP1]
+    ]
+    # The counters are only in the last result of every relay.
+    assert results[FP1][0].relay_in_recent_consensus is None
+    assert 1 == len(results[FP1][1].relay_in_recent_consensus)
+    assert RESULT_SUCCESS1.downloads == results[FP1][0].downloads
+
+    with patch("time.time", return_value=TIME1 + 1):
+        results = store.load_recent_results(1, success_only=True)
+    assert [ResultSuccess] == [type(r) for r in results[FP1]]
+
+    results = store.load_recent_results(1)
+    assert [RESULT_SUCCESS2.fingerprint] == list(results)
+
+    assert 2 == len(store.relay_results(FP1))
+    assert [] == store.relay_results(FP1, end=TIME1 - 1)
+
+    assert 2 == store.delete_older_than(1)
+    assert [] == store.relay_results(FP1)
+    store.close()
+
+
+def test_import_result_file(tmpdir, datadir):
+    store = ResultStore(tmpdir.join("results.sqlite").strpath)
+    fname = str(datadir.join("results.txt"))
+    assert 3 == store.import_result_file(fname)
+    # Importing the file again does not duplicate the results.
+    assert 3 == store.import_result_file(fname)
+    results = store.relay_results(FP1)
+    # Two results have the same relay, time and type.
+    assert 2 == len(results)
+    assert 3 == len(results[-1].relay_recent_priority_list)
+    store.close()
+    assert os.path.exists(store.fname)
+
+
+def test_load_recent_results_in_results_db(tmpdir):
+    from sbws.lib.resultdump import load_recent_results
+
+    fname = tmpdir.join("results.sqlite").strpath
+    store = ResultStore(fname)
+    store.write(RESULT_SUCCESS2)
+    store.close()
+    results = load_recent_results(
+        1, str(tmpdir), results_db=fname, success_only=True
+    )
+    assert 1 == len(results[RESULT_SUCCESS2.fingerprint])
+    assert time.time() > results[RESULT_SUCCESS2.fingerprint][0].time
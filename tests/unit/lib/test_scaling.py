@@ -1,7 +1,11 @@
 """Unit tests for scaling.py."""
+import copy
+import itertools
 import os
+import random
 from statistics import mean
 
+from sbws.globals import TORFLOW_BW_MARGIN, TORFLOW_OBS_LAST, TORFLOW_OBS_MEAN
 from sbws.lib import scaling
 from sbws.lib.resultdump import ResultSuccess, load_result_file
 
@@ -70,3 +74,156 @@ def test_bw_filt_from_results(root_data_path):
     assert 5583737 == bw_filts["270A861ABED22EC2B625198BCCD7B2B9DBFFC93C"][1]
     assert 5379911 == bw_filts["E894C65997F8EC96558B554176EEEA39C6A43EF6"][0]
     assert 5485088 == bw_filts["E894C65997F8EC96558B554176EEEA39C6A43EF6"][1]
+
+
+def test_bw_stats_from_results(root_data_path):
+    """The statistics calculated together are the same as the ones
+    calculated by every function."""
+    from sbws.lib.v3bwfile import V3BWLine
+
+    results_file = os.path.join(
+        root_data_path, ".sbws", "datadir", "2019-03-25.txt"
+    )
+    results = load_result_file(results_file)
+    assert results
+    for fp, values in results.items():
+        success_results = [r for r in values if isinstance(r, ResultSuccess)]
+        bw_measurements = scaling.bw_measurements_from_results(success_results)
+        bw_filt = 0
+        if bw_measurements:
+            mu = round(mean(bw_measurements))
+            bws_gte_mean = [bw for bw in bw_measurements if bw >= mu]
+            bw_filt = round(mean(bws_gte_mean)) if bws_gte_mean else mu
+        assert (
+            V3BWLine.bw_median_from_results(success_results),
+            V3BWLine.bw_mean_from_results(success_results),
+            bw_filt,
+        ) == scaling.bw_stats(bw_measurements)
+
+
+def _bw_torflow_scale_lines(bw_lines, desc_bw_obs_type, router_statuses_d):
+    """Torflow's scaling as it was implemented line by line, to check that
+    :func:`scaling.torflow_scale` obtains the same values."""
+    from sbws.lib.v3bwfile import kb_round_x_sig_dig
+
+    bw_lines = copy.deepcopy(bw_lines)
+    mu = mean([line.bw_mean for line in bw_lines])
+    muf = mean([line.bw_filt for line in bw_lines])
+    sum_bw = 0
+    for line in bw_lines:
+        if desc_bw_obs_type == TORFLOW_OBS_LAST:
+            desc_bw_obs = line.desc_bw_obs_last or line.desc_bw_obs_mean
+        else:
+            desc_bw_obs = line.desc_bw_obs_mean
+        if desc_bw_obs is None:
+            continue
+        desc_bw = min(
+            [
+                bw
+                for bw in (desc_bw_obs, line.desc_bw_bur, line.desc_bw_avg)
+                if bw is not None
+            ]
+        )
+        line.r_strm = line.bw_mean / mu
+        line.r_strm_filt = line.bw_filt / muf
+        line.bw = max(line.r_strm, line.r_strm_filt) * desc_bw
+        if not router_statuses_d or line.node_id[1:] in router_statuses_d:
+            sum_bw += line.bw
+    hlimit = sum_bw * TORFLOW_BW_MARGIN
+    for line in bw_lines:
+        line.bw = kb_round_x_sig_dig(min(hlimit, line.bw))
+    return sorted(bw_lines, key=lambda x: x.bw), mu, muf
+
+
+def _synthetic_bw_lines(num_lines):
+    from sbws.lib.v3bwfile import V3BWLine
+
+    rng = random.Random(num_lines)
+    bw_lines = []
+    for i in range(num_lines):
+        bw_mean = rng.randint(1, 10**8)
+        desc_bws = [rng.choice([None, rng.randint(0, 10**8)]) for _ in "abcd"]
+        bw_lines.append(
+            V3BWLine(
+                "${:040X}".format(i),
+                rng.randint(1, 10**8),
+                bw_mean=bw_mean,
+                bw_filt=bw_mean + rng.randint(0, 10**7),
+                desc_bw_obs_last=desc_bws[0],
+                desc_bw_obs_mean=desc_bws[1],
+                desc_bw_avg=desc_bws[2],
+                desc_bw_bur=desc_bws[3],
+            )
+        )
+    return bw_lines
+
+
+def test_torflow_scale_equivalence(root_data_path):
+    """Scaling the bandwidth by columns obtains exactly the same lines."""
+    from sbws.lib.v3bwfile import V3BWFile, V3BWLine
+
+    results = load_result_file(
+        os.path.join(root_data_path, ".sbws", "datadir", "2019-03-25.txt")
+    )
+    results_lines = [
+        line
+        for line, reason in map(V3BWLine.from_results, results.values())
+        if not reason
+    ]
+    assert results_lines
+    for bw_lines in (results_lines, _synthetic_bw_lines(500)):
+        router_statuses_d = {
+            line.node_id[1:]: None for line in bw_lines[: len(bw_lines) // 2]
+        }
+        for desc_bw_obs_type, router_statuses in itertools.product(
+            (TORFLOW_OBS_LAST, TORFLOW_OBS_MEAN), (None, router_statuses_d)
+        ):
+            expected_lines, expected_mu, expected_muf = (
+                _bw_torflow_scale_lines(
+                    bw_lines, desc_bw_obs_type, router_statuses
+                )
+            )
+            scaled_lines, mu, muf = V3BWFile.bw_torflow_scale(
+                copy.deepcopy(bw_lines),
+                desc_bw_obs_type,
+                router_statuses_d=router_statuses,
+            )
+            assert (expected_mu, expected_muf) == (mu, muf)
+            assert [line.__dict__ for line in expected_lines] == [
+                line.__dict__ for line in scaled_lines
+            ]
+
+
+def test_torflow_scale_columns():
+    bws, r_strm, r_strm_filt, mu, muf = scaling.torflow_scale(
+        bw_mean=[100, 300],
+        bw_filt=[200, 400],
+        desc_bw_obs_last=[None, 500],
+        desc_bw_obs_mean=[1000, None],
+        desc_bw_avg=[600, None],
+        desc_bw_bur=[None, None],
+        bw=[1, 2],
+        in_consensus=[True, False],
+        desc_bw_obs_type=TORFLOW_OBS_LAST,
+        cap=0.5,
+    )
+    assert (200, 300) == (mu, muf)
+    assert [0.5, 1.5] == r_strm
+    assert [200 / 300, 400 / 300] == r_strm_filt
+    # The second relay is not in the consensus, so the sum is only the
+    # bandwidth of the first one, 0.6667 * 600 = 400 and the limit is 200.
+    assert [200, 200] == bws
+
+    # Without descriptor observed bandwidth, the first relay is not scaled
+    # and its bandwidth is only capped.
+    bws, r_strm, r_strm_filt, _, _ = scaling.torflow_scale(
+        bw_mean=[100, 300],
+        bw_filt=[200, 400],
+        desc_bw_obs_last=[None, None],
+        desc_bw_obs_mean=[None, 500],
+        desc_bw_avg=[600, None],
+        desc_bw_bur=[None, None],
+        bw=[1, 2],
+    )
+    assert [None, 1.5] == r_strm
+    assert [1, 1.5 * 500 * TORFLOW_BW_MARGIN] == bws
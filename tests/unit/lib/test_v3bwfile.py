@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
 """Test generation of bandwidth measurements document (v3bw)"""
+
+import gzip
+import itertools
 import json
 import logging
 import math
@@ -17,6 +20,7 @@ from sbws.globals import (
     TORFLOW_ROUND_DIG,
     TORFLOW_SCALING,
 )
+from sbws.lib.consensus import ConsensusSnapshot
 from sbws.lib.resultdump import Result, ResultSuccess, load_result_file
 from sbws.lib.v3bwfile import (
     HEADER_RECENT_MEASUREMENTS_EXCLUDED_KEYS,
@@ -26,10 +30,11 @@ from sbws.lib.v3bwfile import (
     V3BWFile,
     V3BWHeader,
     V3BWLine,
+    V3BWLineTable,
     num_results_of_type,
     round_sig_dig,
 )
-from sbws.util.state import CustomDecoder
+from sbws.util.state import CustomDecoder, State
 from sbws.util.timestamp import now_fname, now_isodt_str, now_unixts
 
 timestamp = 1523974147
@@ -346,6 +351,55 @@ def test_from_arg_results_write(datadir, tmpdir, conf, args):
     assert os.path.isfile(output)
 
 
+def test_write_atomic(datadir, args):
+    results = load_result_file(str(datadir.join("results.txt")))
+    v3bwfile = V3BWFile.from_results(results)
+    output = os.path.join(args.output, now_fname())
+    v3bwfile.write(output, compress=True)
+    with gzip.open(output + ".gz", "rt") as fd:
+        assert str(v3bwfile) == fd.read()
+    assert os.path.basename(output) == os.readlink(
+        os.path.join(args.output, "latest.v3bw")
+    )
+
+    # A file that fails to be written does not replace the previous one.
+    expected = str(v3bwfile)
+    v3bwfile.bw_lines = []
+    with mock.patch("os.fsync", side_effect=OSError):
+        with pytest.raises(OSError):
+            v3bwfile.write(output, compress=True)
+    with open(output) as fd:
+        assert expected == fd.read()
+    assert not [f for f in os.listdir(args.output) if f.endswith(".tmp")]
+
+
+def test_from_v1_fpath(datadir, args):
+    results = load_result_file(str(datadir.join("results.txt")))
+    v3bwfile = V3BWFile.from_results(results)
+    output = os.path.join(args.output, now_fname())
+    v3bwfile.write(output, compress=True)
+    for fpath in [output, output + ".gz"]:
+        parsed = V3BWFile.from_v1_fpath(fpath)
+        assert isinstance(parsed.bw_lines, V3BWLineTable)
+        # The lines are created only when they are accessed.
+        assert [None] == parsed.bw_lines._lines
+        node_id = v3bwfile.bw_lines[0].node_id
+        assert [node_id] == parsed.bw_lines.column("node_id")
+        assert [None] == parsed.bw_lines.column("unknown")
+        bw_line = parsed.bw_line_for_node_id(node_id)
+        assert bw_line is parsed.bw_lines[0]
+        assert parsed.bw_line_for_node_id("$" + "0" * 40) is None
+        assert list(map(str, v3bwfile.bw_lines)) == list(
+            map(str, parsed.bw_lines)
+        )
+        # The same lines as parsing them one by one.
+        with open(output) as fd:
+            _, lines = V3BWHeader.from_lines_v1(fd.read().split(LINE_SEP))
+        assert [vars(V3BWLine.from_bw_line_v1(line)) for line in lines] == [
+            vars(line) for line in parsed.bw_lines
+        ]
+
+
 def test_from_arg_results_write_read(datadir, tmpdir, conf, args):
     results = load_result_file(str(datadir.join("results.txt")))
     v3bwfile = V3BWFile.from_results(results)
@@ -367,8 +421,10 @@ def num_consensus_relays(fpath):
 
 
 # To do not have to create a consensus-cache file and set the path,
-# mock the result since it only returns the number of relays.
-@mock.patch.object(V3BWFile, "read_number_consensus_relays")
+# mock the number of relays in the consensus.
+@mock.patch.object(
+    ConsensusSnapshot, "number_relays", new_callable=mock.PropertyMock
+)
 def test_torflow_scale(mock_consensus, datadir, tmpdir, conf):
     mock_consensus.return_value = 1
     # state_fpath = str(tmpdir.join('.sbws', 'state.dat'))
@@ -512,6 +568,44 @@ def test_results_away_each_other(datadir):
     assert len(success_results) < min_num
 
 
+def _results_away_each_other_pairs(results, secs_away=None):
+    """Check every pair of results, as ``results_away_each_other`` did."""
+    if secs_away is None or len(results) < 2:
+        return results
+    for a, b in itertools.combinations(results, 2):
+        if abs(a.time - b.time) > secs_away:
+            return results
+    return []
+
+
+def test_results_away_each_other_exclusion_counters(datadir, conf):
+    """The relays excluded are the same as checking every pair of results."""
+    state_fpath = conf["paths"]["state_fpath"]
+    results = load_result_file(str(datadir.join("results_away.txt")))
+    for secs_away in [None, 0, 43199, 43200, 43201, 86400, 172800]:
+        v3bwfile = V3BWFile.from_results(
+            results, state_fpath=state_fpath, secs_away=secs_away, min_num=2
+        )
+        with mock.patch.object(
+            V3BWLine,
+            "results_away_each_other",
+            side_effect=_results_away_each_other_pairs,
+        ):
+            expected = V3BWFile.from_results(
+                results,
+                state_fpath=state_fpath,
+                secs_away=secs_away,
+                min_num=2,
+            )
+        for key in HEADER_RECENT_MEASUREMENTS_EXCLUDED_KEYS:
+            assert getattr(expected.header, key) == getattr(
+                v3bwfile.header, key
+            )
+        assert [str(line) for line in expected.bw_lines] == [
+            str(line) for line in v3bwfile.bw_lines
+        ]
+
+
 def test_measured_progress_stats(datadir):
     number_consensus_relays = 3
     bw_lines_raw = []
@@ -603,7 +697,9 @@ def test_time_measure_half_network(caplog):
     assert caplog.records[-1].getMessage() == expected_log
 
 
-@mock.patch.object(V3BWFile, "read_number_consensus_relays")
+@mock.patch.object(
+    ConsensusSnapshot, "number_relays", new_callable=mock.PropertyMock
+)
 def test_set_under_min_report(mock_consensus, conf, datadir):
     # The number of relays (1) is the same as the ones in the consensus,
     # therefore there is no any relay excluded and under_min_report is not set.
@@ -653,6 +749,17 @@ def test_generator_started(root_data_path, datadir):
     assert "2020-02-29T10:00:00" == header.generator_started
 
 
+def test_header_from_results_reads_state_once(root_data_path, datadir):
+    state_fpath = os.path.join(root_data_path, ".sbws/state.dat")
+    results = load_result_file(str(datadir.join("results.txt")))
+    state = State(state_fpath)._state
+    with mock.patch.object(State, "_read", return_value=state) as read_mock:
+        header = V3BWHeader.from_results(results, state_fpath=state_fpath)
+    assert 1 == read_mock.call_count
+    assert "1" == header.recent_consensus_count
+    assert "2020-02-29T10:00:00" == header.generator_started
+
+
 def test_recent_consensus_count(root_data_path, datadir):
     # This state has recent_consensus_count
     state_fpath = os.path.join(root_data_path, ".sbws/state.dat")
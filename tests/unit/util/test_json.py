@@ -1,7 +1,14 @@
 """json.py unit tests."""
+
 import json
+from datetime import datetime
 
-from sbws.util.json import CustomDecoder, CustomEncoder
+from sbws.util.json import (
+    CustomDecoder,
+    CustomEncoder,
+    decode_timestamp,
+    loads,
+)
 
 STATE = """{
     "min_perc_reached": null,
@@ -52,3 +59,16 @@ def test_decode_encode_roundtrip():
     d = json.loads(STATE, cls=CustomDecoder)
     s = json.dumps(d, cls=CustomEncoder, indent=4, sort_keys=True)
     assert s == STATE
+
+
+def test_decode_timestamp():
+    assert datetime(2020, 3, 4, 10) == decode_timestamp("2020-03-04T10:00:00")
+    assert datetime(2020, 3, 4, 10) == decode_timestamp(
+        "2020-03-04T10:00:00.123456"
+    )
+    for obj in ["2020-03-04", "AAAAAAAAAATAAAAAAAA", "x", 1, None]:
+        assert obj == decode_timestamp(obj)
+
+
+def test_loads():
+    assert {"a": float("inf"), "b": [1]} == loads('{"a": Infinity, "b": [1]}')
@@ -1,6 +1,7 @@
 import os
+from unittest import mock
 
-from sbws.util.state import State
+from sbws.util.state import State, StateSnapshot
 
 # from tempfile import NamedTemporaryFile as NTF
 
@@ -94,3 +95,24 @@ def test_datetime_values(tmpdir):
     now = datetime.datetime.utcnow().replace(microsecond=0)
     state["datetimes"] = now
     assert now == state["datetimes"]
+
+
+def test_state_snapshot(tmpdir):
+    fname = os.path.join(str(tmpdir), "statefoo")
+    state = State(fname)
+    state["a"] = [1, 2, 3]
+    state["b"] = [["x", 2], ["y", 3]]
+    state["c"] = 4
+    with mock.patch.object(State, "_read", wraps=state._read) as read_mock:
+        snapshot = StateSnapshot(fname)
+        assert "a" in snapshot
+        assert "d" not in snapshot
+        assert [1, 2, 3] == snapshot["a"]
+        for key in ["a", "b", "c", "d"]:
+            assert state.count(key) == snapshot.count(key)
+        # The file is read only once by the snapshot, and once by every
+        # State.count.
+        assert 1 + 4 == read_mock.call_count
+    # The snapshot does not change when the file changes.
+    state["c"] = 5
+    assert 4 == snapshot.get("c")